@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Compare the generated codecs against the generic structattr (de)serializer,
+per message type.
+"""
+import argparse
+import random
+import timeit
+
+from velbus.VelbusMessage._registry import command_registry
+from velbus.VelbusMessage.ModuleInfo._registry import module_type_registry
+
+__import__('velbus.VelbusMessage', globals(), level=0, fromlist=['*'])
+# ^^^ equivalent of `from .VelbusMessage import *`, but without polluting the namespace
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--number', help="Number of iterations per measurement", type=int, default=10000)
+args = parser.parse_args()
+
+
+def sample(cls):
+    """
+    Get some valid data for `cls`: the encoding of the default instance if
+    possible, otherwise search by trial and error
+    """
+    try:
+        return bytes(cls().data())
+    except (ValueError, TypeError):
+        pass
+
+    length = sum(a.type.bits() for a in cls._data_attributes()) // 8
+    rand = random.Random(0)
+    for _ in range(10000):
+        data = bytearray(rand.randrange(0x20, 0x7f) for _ in range(length))
+        if hasattr(cls, 'Command'):
+            data[0] = [cmd.value for cmd in cls.Command][0]
+        try:
+            cls.from_bytes(data=bytes(data)).to_json_able()
+            return bytes(data)
+        except ValueError:
+            pass
+    return None
+
+
+def measure(cls, data):
+    obj = cls.from_bytes(data=data)
+    return [
+        timeit.timeit(lambda: cls.from_bytes(data=data), number=args.number),
+        timeit.timeit(lambda: obj.data(), number=args.number),
+        timeit.timeit(lambda: obj.to_json_able(), number=args.number),
+    ]
+
+
+classes = set()
+for candidates in list(command_registry.values()) + list(module_type_registry.values()):
+    for cls in candidates:
+        if cls.__dict__.get('_codec') is not None:
+            classes.add(cls)
+
+print("usec/call, generic -> generated (speedup)")
+print("{:<28} {:>22} {:>22} {:>22}".format("", "decode", "encode", "to_json_able"))
+for cls in sorted(classes, key=lambda c: c.__name__):
+    data = sample(cls)
+    if data is None:
+        print("{:<28} no valid sample found".format(cls.__name__))
+        continue
+
+    fast = measure(cls, data)
+    codec = cls._codec
+    cls._codec = None
+    try:
+        slow = measure(cls, data)
+    finally:
+        cls._codec = codec
+
+    print("{:<28} {}".format(cls.__name__, " ".join(
+        "{:>7.2f} -> {:>5.2f} {:>5.1f}x".format(
+            s / args.number * 1e6, f / args.number * 1e6, s / f)
+        for s, f in zip(slow, fast)
+    )))
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Load test a running daemon, end-to-end: frames on the TCP port, requests on
+the REST API and updates on the /module_state WebSocket, at the given rates.
+
+Meant to run against a simulated bus (see `python -m velbus.simulator`);
+the defaults match the addresses the simulator uses by default:
+
+    python -m velbus.simulator &
+    python run.py socket://127.0.0.1:8446 &
+    python benchmark_load.py --ramp 4
+
+Measures:
+ - tcp: frames sent on one TCP connection until they're relayed to another
+ - http: the REST requests (from the scheduled send time, so a saturated
+         daemon doesn't hide its latency by slowing down the sender)
+ - ws: the SwitchRelay frames sent over TCP until the state change arrives
+       on the WebSocket
+
+With --ramp, the rates are doubled every step. The daemon is saturated when
+it does not keep up with the offered rate, or errors start.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import time
+import typing
+
+import websockets
+
+from velbus.VelbusMessage.VelbusFrame import VelbusFrame
+from velbus.VelbusMessage.SwitchRelay import SwitchRelay
+
+
+def address_list(s: str) -> typing.List[int]:
+    addresses = []
+    for part in s.split(','):
+        first, _, last = part.partition('-')
+        addresses.extend(range(int(first, 16), int(last or first, 16) + 1))
+    return addresses
+
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('--tcp-port', type=int, default=8445)
+parser.add_argument('--http-port', type=int, default=8080)
+parser.add_argument('--duration', help="Seconds per step", type=float, default=10)
+parser.add_argument('--ramp', help="Number of steps, doubling the rates every step", type=int, default=1)
+parser.add_argument('--tcp-rate', help="SwitchRelay frames per second on the TCP port", type=float, default=5)
+parser.add_argument('--relay-addresses', help="VMB4RYNO modules to switch (hex, ranges allowed)",
+                    type=address_list, default='01-28')
+parser.add_argument('--http-rate', help="REST requests per second", type=float, default=20)
+parser.add_argument('--http-connections', help="Number of (keep-alive) HTTP connections", type=int, default=8)
+parser.add_argument('--http-path', help="REST path to request (repeat for more; used round robin)",
+                    action='append', default=None)
+parser.add_argument('--ws-clients', help="Number of /module_state WebSocket clients", type=int, default=4)
+parser.add_argument('--timeout', help="Request timeout (seconds)", type=float, default=5)
+args = parser.parse_args()
+if args.http_path is None:
+    args.http_path = ['/module/01/type', '/module/01/1/relay', '/module/29/1/dimvalue', '/module/47/temperature']
+
+
+def percentile(ordered: typing.List[float], p: float) -> typing.Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+
+class Measurement:
+    def __init__(self):
+        self.latencies = []
+        self.offered = 0
+        self.errors = 0
+
+    def add(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+
+    def report(self, name: str, duration: float) -> dict:
+        ordered = sorted(self.latencies)
+        return {
+            'path': name,
+            'offered/s': self.offered / duration,
+            'done/s': len(ordered) / duration,
+            'errors': self.errors,
+            'p50': percentile(ordered, 0.5),
+            'p95': percentile(ordered, 0.95),
+            'p99': percentile(ordered, 0.99),
+            'max': ordered[-1] if ordered else None,
+        }
+
+
+class HttpConnection:
+    """
+    Minimal HTTP/1.1 keep-alive client, so the measurement doesn't depend on
+    (the overhead of) an HTTP library
+    """
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: asyncio.StreamReader = None
+        self.writer: asyncio.StreamWriter = None
+
+    async def get(self, path: str) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write("GET {p} HTTP/1.1\r\nHost: {h}\r\n\r\n".format(p=path, h=self.host).encode())
+        try:
+            status = int((await self.reader.readline()).split()[1])
+            length = 0
+            close = False
+            while True:
+                line = (await self.reader.readline()).strip()
+                if not line:
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                name = name.strip().lower()
+                if name == 'content-length':
+                    length = int(value)
+                elif name == 'connection' and value.strip().lower() == 'close':
+                    close = True
+            await self.reader.readexactly(length)
+        except (IndexError, ValueError, asyncio.IncompleteReadError):
+            close = True
+            status = 0
+        if close:
+            self.close()
+        return status
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def tcp_load(rate: float, duration: float, tcp: Measurement,
+                   ws_pending: typing.List[typing.Dict[int, collections.deque]]):
+    """
+    :param ws_pending: per WebSocket client: address -> send times of the
+                       frames that should cause an update
+    """
+    if rate <= 0:
+        return
+    _, sender = await asyncio.open_connection(args.host, args.tcp_port)
+    receiver, receiver_w = await asyncio.open_connection(args.host, args.tcp_port)
+    sent_at: typing.Dict[bytes, collections.deque] = collections.defaultdict(collections.deque)
+
+    async def receive():
+        buf = bytearray()
+        while True:
+            data = await receiver.read(4096)
+            if not data:
+                return
+            buf.extend(data)
+            while True:
+                try:
+                    length = VelbusFrame.frame_length(buf)
+                except BufferError:
+                    break
+                except ValueError:
+                    del buf[0]
+                    continue
+                frame = bytes(buf[0:length])
+                del buf[0:length]
+                pending = sent_at.get(frame)
+                if pending:
+                    tcp.add(time.perf_counter() - pending.popleft())
+
+    receiving = asyncio.ensure_future(receive())
+    await asyncio.sleep(0.1)  # let both connections settle
+
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    i = 0
+    while loop.time() - start < duration:
+        address = args.relay_addresses[i % len(args.relay_addresses)]
+        step = i // len(args.relay_addresses)
+        frame = bytes(VelbusFrame(address=address, message=SwitchRelay(
+            command=SwitchRelay.Command.SwitchRelayOn if step % 2 == 0 else SwitchRelay.Command.SwitchRelayOff,
+            channel=step // 2 % 5 + 1,
+        )).to_bytes())
+        now = time.perf_counter()
+        sent_at[frame].append(now)
+        for pending in ws_pending:
+            pending[address].append(now)
+        sender.write(frame)
+        tcp.offered += 1
+        i += 1
+        await asyncio.sleep(max(0., start + i / rate - loop.time()))
+
+    await asyncio.sleep(min(args.timeout, 1))  # collect the stragglers
+    tcp.errors += sum(len(d) for d in sent_at.values())  # never relayed
+    receiving.cancel()
+    sender.close()
+    receiver_w.close()
+
+
+async def http_load(rate: float, duration: float, http: typing.Dict[str, Measurement]):
+    if rate <= 0:
+        return
+    pool = asyncio.Queue()
+    for _ in range(args.http_connections):
+        pool.put_nowait(HttpConnection(args.host, args.http_port))
+
+    async def request(path: str, scheduled: float):
+        conn = await pool.get()
+        try:
+            status = await asyncio.wait_for(conn.get(path), args.timeout)
+            if status // 100 == 2:
+                http[path].add(time.perf_counter() - scheduled)
+            else:
+                http[path].errors += 1
+        except (asyncio.TimeoutError, OSError):
+            conn.close()
+            http[path].errors += 1
+        finally:
+            pool.put_nowait(conn)
+
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    tasks = []
+    i = 0
+    while loop.time() - start < duration:
+        path = args.http_path[i % len(args.http_path)]
+        http[path].offered += 1
+        tasks.append(asyncio.ensure_future(request(path, time.perf_counter())))
+        i += 1
+        await asyncio.sleep(max(0., start + i / rate - loop.time()))
+
+    await asyncio.gather(*tasks)
+    while not pool.empty():
+        pool.get_nowait().close()
+
+
+async def ws_client(ws_updates: Measurement, ws_pending: typing.Dict[int, collections.deque], ready: asyncio.Event):
+    uri = "ws://{h}:{p}/module_state".format(h=args.host, p=args.http_port)
+    async with websockets.connect(uri) as ws:
+        await ws.send(json.dumps([
+            {'op': 'add', 'path': '/{:02x}'.format(address), 'value': True}
+            for address in args.relay_addresses
+        ]))
+        ready.set()
+        async for msg in ws:
+            now = time.perf_counter()
+            for op in json.loads(msg):
+                path = op.get('path', '').split('/')
+                if len(path) < 3 or path[-1] != 'relay':
+                    continue  # initial state, or not caused by us
+                pending = ws_pending.get(int(path[1], 16))
+                if pending:
+                    ws_updates.add(now - pending.popleft())
+                else:
+                    ws_updates.errors += 1  # update we can't match
+
+
+async def step(factor: float) -> typing.List[dict]:
+    tcp = Measurement()
+    ws_updates = Measurement()
+    http = collections.defaultdict(Measurement)
+    ws_pending = [collections.defaultdict(collections.deque) for _ in range(args.ws_clients)]
+
+    ws_tasks = []
+    for pending in ws_pending:
+        ready = asyncio.Event()
+        ws_tasks.append(asyncio.ensure_future(ws_client(ws_updates, pending, ready)))
+        await asyncio.wait_for(ready.wait(), args.timeout)
+
+    await asyncio.gather(
+        tcp_load(args.tcp_rate * factor, args.duration, tcp, ws_pending),
+        http_load(args.http_rate * factor, args.duration, http),
+    )
+    await asyncio.sleep(1)
+    for t in ws_tasks:
+        t.cancel()
+    ws_updates.offered = tcp.offered * args.ws_clients
+
+    return [tcp.report('tcp', args.duration)] + \
+        [m.report('http ' + path, args.duration) for path, m in sorted(http.items())] + \
+        ([ws_updates.report('ws', args.duration)] if args.ws_clients else [])
+
+
+def ms(v: typing.Optional[float]) -> str:
+    return "{:8.1f}".format(v * 1000) if v is not None else "       -"
+
+
+async def main():
+    saturated_at = None
+    for i in range(args.ramp):
+        factor = 2 ** i
+        reports = await step(factor)
+        print("step {i}: rates x{f}".format(i=i + 1, f=factor))
+        print("  {:<32} {:>9} {:>9} {:>6} {:>8} {:>8} {:>8} {:>8}".format(
+            "path", "offered/s", "done/s", "errors", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+        saturated = False
+        for r in reports:
+            print("  {:<32} {:>9.1f} {:>9.1f} {:>6} {} {} {} {}".format(
+                r['path'], r['offered/s'], r['done/s'], r['errors'],
+                ms(r['p50']), ms(r['p95']), ms(r['p99']), ms(r['max'])))
+            if r['offered/s'] and (r['done/s'] < 0.9 * r['offered/s'] or r['errors']):
+                saturated = True
+        if saturated and saturated_at is None:
+            saturated_at = factor
+    if args.ramp > 1:
+        if saturated_at is None:
+            print("not saturated")
+        else:
+            print("saturated at x{f}: tcp {t:.0f} frames/s, http {h:.0f} requests/s".format(
+                f=saturated_at, t=args.tcp_rate * saturated_at, h=args.http_rate * saturated_at))
+
+
+asyncio.get_event_loop().run_until_complete(main())
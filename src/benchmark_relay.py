@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Measure the TCP-to-TCP relay latency: the time between a client sending a
+frame, and another client receiving it. With and without the raw relay of
+VelbusTcpProtocol.
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from velbus.VelbusProtocol import VelbusTcpProtocol
+from velbus.VelbusBus import VelbusBus
+from velbus.VelbusMessage.VelbusFrame import VelbusFrame
+from velbus.VelbusMessage.ModuleStatusRequest import ModuleStatusRequest
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--number', help="Number of frames per measurement", type=int, default=1000)
+parser.add_argument('--log-level', help="Log level of the daemon", default='INFO')
+args = parser.parse_args()
+
+logging.basicConfig(level=args.log_level, filename='/dev/null')
+
+
+class NullSerial:
+    """Stands in for the serial port, drops everything"""
+    paused = False
+
+    def transmit(self, data, source=None):
+        pass
+
+
+async def measure(raw_relay: bool) -> list:
+    loop = asyncio.get_event_loop()
+    velbus = VelbusBus('benchmark')
+    velbus.serial_client = NullSerial()
+    VelbusTcpProtocol.raw_relay = raw_relay
+    server = await loop.create_server(lambda: VelbusTcpProtocol(velbus=velbus), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    _, sender = await asyncio.open_connection('127.0.0.1', port)
+    receiver, receiver_w = await asyncio.open_connection('127.0.0.1', port)
+    while len(velbus.tcp_clients) < 2:
+        await asyncio.sleep(0.01)
+
+    frame = bytes(VelbusFrame(address=0x11, message=ModuleStatusRequest()).to_bytes())
+    latencies = []
+    for _ in range(args.number):
+        start = time.perf_counter()
+        sender.write(frame)
+        await receiver.readexactly(len(frame))
+        latencies.append(time.perf_counter() - start)
+
+    sender.close()
+    receiver_w.close()
+    server.close()
+    await server.wait_closed()
+    return latencies
+
+
+def report(name: str, latencies: list) -> None:
+    latencies = sorted(latencies)
+    print("{:<10} median {:>7.1f} usec, p99 {:>7.1f} usec".format(
+        name,
+        statistics.median(latencies) * 1e6,
+        latencies[int(len(latencies) * 0.99)] * 1e6,
+    ))
+
+
+loop = asyncio.get_event_loop()
+report("decoded", loop.run_until_complete(measure(raw_relay=False)))
+report("raw", loop.run_until_complete(measure(raw_relay=True)))
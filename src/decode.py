@@ -1,26 +1,189 @@
 #!/usr/bin/env python3
+"""
+Decode the frames in daemon logs (the `VBM: [0f fb ...]` lines).
+
+The input is read in blocks, which are decoded by worker processes; the
+output stays in input order. Frames are filtered by address and command
+before they are decoded, so a selective filter skips most of the work.
+
+    python decode.py --address 1f --type SwitchRelay velbus.log.* > relay.txt
+    python decode.py --json < velbus.log | jq .message.type
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
 import re
 import sys
-import binascii
+import typing
 
+from velbus.FrameFilter import FrameFilter
 from velbus.VelbusMessage.VelbusFrame import VelbusFrame
+from velbus.VelbusMessage.VelbusMessage import VelbusMessage
+from velbus.VelbusMessage._registry import command_registry
 
 __import__('velbus.VelbusMessage', globals(), level=0, fromlist=['*'])
 # ^^^ equivalent of `from .VelbusMessage import *`, but without polluting the namespace
 
 
-for line in sys.stdin:
-    match = re.match('^(.*)VBM: \[([0-9A-Fa-f]{2}(?: [0-9A-Fa-f]{2})*)\](.*)$', line)
-    if not match:
-        continue
+VBM_LINE = re.compile(rb'^(.*)VBM: \[([0-9A-Fa-f]{2}(?: [0-9A-Fa-f]{2})*)\](.*)$', re.MULTILINE)
+
+BLOCK_SIZE = 1 << 20
+
+
+def read_blocks(files: typing.Iterable[typing.BinaryIO]) -> typing.Iterator[bytes]:
+    """
+    Read `files` in blocks of about BLOCK_SIZE, ending at a line boundary
+    """
+    for f in files:
+        rest = b''
+        while True:
+            data = f.read(BLOCK_SIZE)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                rest = data  # no newline yet: line longer than a block
+                continue
+            rest = data[end:]
+            yield data[0:end]
+        if rest:
+            yield rest
+
+
+class Decoder:
+    def __init__(self,
+                 frame_filter: FrameFilter,
+                 types: typing.Optional[typing.Set[str]] = None,
+                 output_json: bool = False,
+                 ):
+        """
+        :param types: VelbusMessage class names to output (None: all)
+        """
+        self.frame_filter = frame_filter
+        self.types = types
+        self.output_json = output_json
+
+    def decode_block(self, block: bytes) -> str:
+        out = []
+        for match in VBM_LINE.finditer(block):
+            try:
+                raw = bytes.fromhex(match.group(2).decode('ascii'))
+                if not self.frame_filter.matches(raw):
+                    continue
+                vbm = VelbusFrame.from_bytes(raw)
+                if self.types is not None and type(vbm.message).__name__ not in self.types:
+                    continue
+                vbm.message  # decode now, inside the try
+            except (BufferError, ValueError, IndexError):
+                continue  # not a (valid) frame
+            prefix = match.group(1).decode('utf-8', errors='replace')
+            suffix = match.group(3).decode('utf-8', errors='replace')
+            if self.output_json:
+                out.append(json.dumps({
+                    'prefix': prefix,
+                    'raw': match.group(2).decode('ascii'),
+                    **vbm.to_json_able(),
+                    'suffix': suffix,
+                }))
+            else:
+                out.append("{}VBM: {}{}".format(prefix, vbm, suffix))
+        return ''.join(line + '\n' for line in out)
+
+
+decoder: Decoder = None
+
+
+def init_worker(d: Decoder) -> None:
+    global decoder
+    decoder = d
+
+
+def decode_block(block: bytes) -> str:
+    return decoder.decode_block(block)
+
+
+def message_types(cls: type = VelbusMessage) -> typing.Set[str]:
+    """
+    Names of all (loaded) VelbusMessage classes
+    """
+    names = set()
+    for subclass in cls.__subclasses__():
+        names.add(subclass.__name__)
+        names |= message_types(subclass)
+    return names
+
+
+def commands_for(types: typing.Iterable[str]) -> typing.Set[int]:
+    """
+    The command bytes used by the given VelbusMessage classes
+    """
+    return {
+        command
+        for command, classes in command_registry.items()
+        for cls in classes
+        if cls.__name__ in types
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--address', help="Address(es) to output (hex, ranges allowed)", type=str)
+    parser.add_argument('--command', help="Command(s) to output (hex, ranges allowed)", type=str)
+    parser.add_argument('--type', help="VelbusMessage type(s) to output (comma separated)", type=str)
+    parser.add_argument('--json', help="Output JSON Lines instead of text", action='store_true')
+    parser.add_argument('--jobs', help="Number of worker processes", type=int, default=os.cpu_count())
+    parser.add_argument('file', nargs='*', help="Log file(s) to decode (default: stdin)")
+    args = parser.parse_args()
+
+    types = None
+    filter_args = {}
+    if args.address:
+        filter_args['address'] = args.address
+    if args.command:
+        filter_args['command'] = args.command
+    if args.type:
+        types = set(args.type.split(','))
+        unknown = types - message_types()
+        if unknown:
+            parser.error("Unknown type(s): {}".format(', '.join(sorted(unknown))))
+        commands = commands_for(types)
+        if commands and not args.command:
+            # Frames without data (e.g. ModuleTypeRequest) still pass, see FrameFilter
+            filter_args['command'] = ','.join('{:02x}'.format(c) for c in commands)
+    try:
+        frame_filter = FrameFilter.parse(' '.join(
+            [FrameFilter.PREFIX.decode()] + ['{k}={v}'.format(k=k, v=v) for k, v in filter_args.items()]
+        ))
+    except ValueError as e:
+        parser.error(str(e))
+    d = Decoder(frame_filter, types, args.json)
+
+    files = [open(path, 'rb') for path in args.file] if args.file else [sys.stdin.buffer]
+    blocks = read_blocks(files)
+    out = sys.stdout
+
+    if args.jobs <= 1:
+        for block in blocks:
+            out.write(d.decode_block(block))
+        return
 
-    hexdump = match.group(2)
-    binary = binascii.unhexlify(hexdump.replace(' ', ''))
-    vbm = VelbusFrame.from_bytes(binary)
+    with multiprocessing.Pool(args.jobs, initializer=init_worker, initargs=(d,)) as pool:
+        # Pool.imap() would read all input up front; keep a bounded number
+        # of blocks in flight instead, and output them in order
+        pending = collections.deque()
+        for block in blocks:
+            pending.append(pool.apply_async(decode_block, (block,)))
+            if len(pending) >= 4 * args.jobs:
+                out.write(pending.popleft().get())
+        while pending:
+            out.write(pending.popleft().get())
 
-    # optionally filter here?
 
-    print("{}VBM: {}{}".format(
-        match.group(1),
-        vbm,
-        match.group(3)))
+if __name__ == '__main__':
+    try:
+        main()
+    except BrokenPipeError:  # e.g. `| head`
+        sys.stderr.close()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Find frames in capture files (see `run.py --capture`), by time, address
+and/or command, e.g.:
+
+    python query.py --since 2020-03-10T18:00 --until 2020-03-10T19:00 --address 1f capture.vbcap*
+
+The index of the capture (see velbus.CaptureIndex) is used to only read
+the relevant parts. Times are in UTC.
+"""
+import argparse
+import datetime
+import os
+import time
+
+from velbus.Capture import CaptureReader
+from velbus.CaptureIndex import CaptureIndex
+from velbus.FrameFilter import FrameFilter
+from velbus.VelbusMessage.VelbusFrame import VelbusFrame
+
+__import__('velbus.VelbusMessage', globals(), level=0, fromlist=['*'])
+# ^^^ equivalent of `from .VelbusMessage import *`, but without polluting the namespace
+
+
+def timestamp_ns(s: str) -> int:
+    t = datetime.datetime.fromisoformat(s)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return int(t.timestamp() * 1e9)
+
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--since', help="ISO 8601 timestamp", type=timestamp_ns)
+parser.add_argument('--until', help="ISO 8601 timestamp (exclusive)", type=timestamp_ns)
+parser.add_argument('--address', help="Address(es) to look for (hex, ranges allowed)", type=str)
+parser.add_argument('--command', help="Command(s) to look for (hex, ranges allowed)", type=str)
+parser.add_argument('--raw', help="Print the frames in hex instead of decoding them", action='store_true')
+parser.add_argument('--stats', help="Print timing information at the end", action='store_true')
+parser.add_argument('capture', nargs='+', help="Capture file(s)")
+args = parser.parse_args()
+
+frame_filter = FrameFilter.parse(' '.join(
+    [FrameFilter.PREFIX.decode()] +
+    ['{k}={v}'.format(k=key, v=getattr(args, key)) for key in FrameFilter.KEYS if getattr(args, key)]
+))
+addresses = None
+if args.address:
+    addresses = [a for a in range(256) if frame_filter.address_table[a]]
+
+
+start = time.perf_counter()
+found = 0
+scanned = 0
+for path in sorted(args.capture, key=os.path.getmtime):
+    if path.endswith('.idx'):
+        continue  # allow `capture.vbcap*`
+    had_index = os.path.exists(CaptureIndex.path_for(path))
+    index = CaptureIndex.load(path)
+    if not had_index:
+        index.save(path)  # capture from before the index
+
+    with CaptureReader(path) as reader:
+        for range_start, range_end in index.search(args.since, args.until, addresses):
+            for record in reader.read(range_start, range_end):
+                scanned += 1
+                if (args.since is not None and record.wall_ns < args.since) \
+                        or (args.until is not None and record.wall_ns >= args.until) \
+                        or not frame_filter.matches(record.frame):
+                    continue
+                found += 1
+                if args.raw:
+                    message = '[' + ' '.join('{:02x}'.format(b) for b in record.frame) + ']'
+                else:
+                    message = VelbusFrame.from_bytes(record.frame)
+                print("{t}Z {s} : VBM: {m}".format(
+                    t=datetime.datetime.utcfromtimestamp(record.wall_ns / 1e9).isoformat(),
+                    s=record.client_id,
+                    m=message,
+                ))
+
+if args.stats:
+    print("{f} frames found, {s} read, in {t:.3f} seconds".format(
+        f=found, s=scanned, t=time.perf_counter() - start))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Replay capture files (see `run.py --capture`), at the original pace or
+faster.
+
+By default, the decoded frames are printed. With --listen, the frames are
+sent to the TCP clients instead, so a daemon can use the replay as its
+"serial port":
+
+    python replay.py --listen 127.0.0.1:8446 --speed 10 capture.vbcap &
+    python run.py socket://127.0.0.1:8446
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import logging
+import os
+
+from velbus.Capture import CaptureReader, replay
+from velbus.VelbusBus import default_bus
+from velbus.VelbusProtocol import VelbusTcpProtocol
+
+__import__('velbus.VelbusMessage', globals(), level=0, fromlist=['*'])
+# ^^^ equivalent of `from .VelbusMessage import *`, but without polluting the namespace
+
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--speed', help="Replay this many times faster than real time", type=float, default=1)
+parser.add_argument('--fast', help="Replay as fast as possible", action='store_true')
+parser.add_argument('--listen', help="Send the frames to TCP clients on [host:]port, "
+                                     "starting when the first client connects", type=str)
+parser.add_argument('capture', nargs='+', help="Capture file(s)")
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def records():
+    for path in sorted(args.capture, key=os.path.getmtime):
+        if path.endswith('.idx'):
+            continue  # allow `capture.vbcap*`
+        with CaptureReader(path) as reader:
+            yield from reader
+
+
+def print_frame(vbm):
+    print("{t}Z {s} : VBM: {m}".format(
+        t=datetime.datetime.utcfromtimestamp(current.wall_ns / 1e9).isoformat(),
+        s=current.client_id,
+        m=vbm,
+    ))
+
+
+current = None
+
+
+def tracking(records_):
+    """Keep the record being replayed available for print_frame()"""
+    global current
+    for current in records_:
+        yield current
+
+
+async def main():
+    if args.listen:
+        host, _, port = args.listen.rpartition(':')
+        connected = asyncio.Event()
+
+        class Protocol(VelbusTcpProtocol):
+            def connection_made(self, transport):
+                super().connection_made(transport)
+                connected.set()
+
+        server = await asyncio.get_event_loop().create_server(
+            functools.partial(Protocol, velbus=default_bus), host or None, int(port))
+        await connected.wait()
+    else:
+        default_bus.listeners.add(print_frame)
+
+    count = await replay(tracking(records()), default_bus, speed=0 if args.fast else args.speed)
+    logging.getLogger(__name__).warning("Replayed {n} frames".format(n=count))
+
+    if args.listen:
+        server.close()
+        await server.wait_closed()
+
+
+asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,270 @@
+"""
+Binary capture of bus traffic
+
+A capture file starts with an 8-byte header (`MAGIC`, followed by the
+format version), followed by records:
+
+    uint16   length of the record, including this field
+    int64    monotonic timestamp (nanoseconds)
+    int64    wall-clock timestamp (nanoseconds since the Unix epoch)
+    uint8    length of the source client_id
+    ...      client_id (UTF-8)
+    ...      raw frame
+
+All integers are little endian. A record that is cut short (e.g. because
+the daemon was killed while writing) ends the capture.
+
+See CaptureIndex to find records by time or address.
+"""
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+import typing
+
+import attr
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'VBCAP\x00\x00'
+VERSION = 1
+HEADER = MAGIC + bytes([VERSION])
+RECORD = struct.Struct('<HqqB')
+REPLAY_CLOCK_SLACK_NS = 60 * 10**9
+"""How far the monotonic clock may run ahead of the wall clock during replay(), see there"""
+
+
+@attr.s(slots=True, auto_attribs=True)
+class CaptureRecord:
+    monotonic_ns: int
+    wall_ns: int
+    client_id: str
+    frame: bytes
+
+
+class CaptureWriter:
+    """
+    Append frames to a capture file, rotating it when it grows beyond
+    `max_bytes`: `path` is renamed to `path.1`, `path.1` to `path.2` and so
+    on, keeping `backup_count` old files.
+
+    Records are buffered, and flushed at least every `flush_interval` seconds
+    (when a frame is written).
+
+    The index of the capture (see CaptureIndex) is kept up to date as well.
+    """
+    def __init__(self, path: str, max_bytes: int = 0, backup_count: int = 0, flush_interval: float = 1.):
+        """
+        :param max_bytes: Rotate when the file would get larger than this. 0 to never rotate
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.file = None
+        self.size = 0
+        self.index = None
+        self.index_file = None
+        self.last_flush = time.monotonic()
+        self.records = 0
+        self.rotations = 0
+        self._open()
+
+    def _open(self) -> None:
+        from .CaptureIndex import CaptureIndex  # avoid import cycle
+
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+        if self.size < len(HEADER):
+            self.file.truncate(0)  # new file, or crashed while writing the header
+            self.file.write(HEADER)
+            self.file.flush()
+            self.size = len(HEADER)
+
+        # Index what's not indexed yet (e.g. when we crashed), before adding to it
+        self.index = CaptureIndex.load(self.path)
+        if self.index.indexed_end < self.size:
+            # We crashed halfway through a record: records appended after it
+            # would be unreadable
+            logger.warning("{}: dropping truncated record at offset {}".format(self.path, self.index.indexed_end))
+            self.file.truncate(self.index.indexed_end)
+            self.size = self.index.indexed_end
+        self.index.save(self.path)
+        self.index_file = open(CaptureIndex.path_for(self.path), 'ab')
+
+    def _close(self) -> None:
+        closed = self.index.close_bucket()
+        if closed is not None:
+            self.index_file.write(self.index.pack(closed))
+        self.index_file.close()
+        self.file.close()
+
+    def rotate(self) -> None:
+        from .CaptureIndex import CaptureIndex  # avoid import cycle
+
+        def move(src: str, dst: typing.Optional[str]) -> None:
+            for src, dst in ((src, dst), (CaptureIndex.path_for(src), dst and CaptureIndex.path_for(dst))):
+                if not os.path.exists(src):
+                    continue
+                if dst is None:
+                    os.remove(src)
+                else:
+                    os.replace(src, dst)
+
+        self._close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                move("{}.{}".format(self.path, i), "{}.{}".format(self.path, i + 1))
+            move(self.path, self.path + ".1")
+        else:
+            move(self.path, None)
+        self.rotations += 1
+        self._open()
+
+    def write(self, frame: bytes, client_id: str, monotonic_ns: int = None, wall_ns: int = None) -> None:
+        if monotonic_ns is None:
+            monotonic_ns = time.monotonic_ns()
+        if wall_ns is None:
+            wall_ns = time.time_ns()
+        source = client_id.encode('utf-8')[0:255]
+        length = RECORD.size + len(source) + len(frame)
+
+        if self.max_bytes and self.size + length > self.max_bytes and self.size > len(HEADER):
+            self.rotate()
+
+        self.file.write(RECORD.pack(length, monotonic_ns, wall_ns, len(source)))
+        self.file.write(source)
+        self.file.write(frame)
+        closed = self.index.add(self.size, self.size + length, wall_ns, frame[2])
+        if closed is not None:
+            self.index_file.write(self.index.pack(closed))
+        self.size += length
+        self.records += 1
+
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self.file.flush()
+        self.index_file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self._close()
+            self.file = None
+
+    def statistics(self) -> dict:
+        return {
+            'path': self.path,
+            'records': self.records,
+            'size': self.size,
+            'rotations': self.rotations,
+        }
+
+
+class CaptureReader:
+    """
+    Read a capture file. The file is memory mapped, so large captures are
+    not loaded into memory.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < len(HEADER):
+                raise ValueError("{}: not a capture file".format(path))
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[0:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("{}: not a capture file".format(path))
+        if self.mmap[len(MAGIC)] != VERSION:
+            version = self.mmap[len(MAGIC)]
+            self.close()
+            raise ValueError("{}: unsupported capture version {}".format(path, version))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self.mmap.close()
+
+    def __iter__(self) -> typing.Iterator[CaptureRecord]:
+        return self.read()
+
+    def read(self, start: int = None, end: int = None) -> typing.Iterator[CaptureRecord]:
+        """
+        :param start: offset of the first record (see CaptureIndex.search())
+        :param end: offset to stop at
+        """
+        buf = self.mmap
+        end = len(buf) if end is None else min(end, len(buf))
+        offset = len(HEADER) if start is None else start
+        while offset + RECORD.size <= end:
+            length, monotonic_ns, wall_ns, source_len = RECORD.unpack_from(buf, offset)
+            if length < RECORD.size + source_len or offset + length > end:
+                logger.warning("{}: truncated record at offset {}".format(self.path, offset))
+                return
+            source_start = offset + RECORD.size
+            frame_start = source_start + source_len
+            yield CaptureRecord(
+                monotonic_ns=monotonic_ns,
+                wall_ns=wall_ns,
+                client_id=buf[source_start:frame_start].decode('utf-8', errors='replace'),
+                frame=buf[frame_start:(offset + length)],
+            )
+            offset += length
+
+
+async def replay(records: typing.Iterable[CaptureRecord],
+                 velbus: 'VelbusBus' = None,
+                 speed: float = 1.) -> int:
+    """
+    Feed captured frames back into `velbus`, with the original timing. Every
+    frame is processed by a VelbusProtocol with the client_id it was
+    captured from, as if it was received again.
+
+    The timing follows the monotonic timestamps. Where these go backwards,
+    or jump ahead of the wall clock by more than `REPLAY_CLOCK_SLACK_NS`
+    (the capture spans a restart of the machine), the wall-clock timestamps
+    are used for that gap instead.
+
+    :param velbus: The bus to replay on (default: `default_bus`)
+    :param speed: Replay this many times faster than real time. 0 (or
+                  infinity) to replay as fast as possible
+    :return: the number of frames replayed
+    """
+    from .VelbusProtocol import VelbusProtocol  # avoid import cycle
+
+    protocols: typing.Dict[str, VelbusProtocol] = {}
+    loop = asyncio.get_event_loop()
+    previous = None
+    at = None
+    count = 0
+    for record in records:
+        if speed and speed != float('inf'):
+            if previous is None:
+                at = loop.time()
+            else:
+                elapsed_ns = record.monotonic_ns - previous.monotonic_ns
+                wall_elapsed_ns = record.wall_ns - previous.wall_ns
+                if elapsed_ns < 0 or elapsed_ns > wall_elapsed_ns + REPLAY_CLOCK_SLACK_NS:
+                    elapsed_ns = max(wall_elapsed_ns, 0)  # monotonic clock restarted
+                at += elapsed_ns / 1e9 / speed
+            previous = record
+            delay = at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        protocol = protocols.get(record.client_id)
+        if protocol is None:
+            protocol = protocols[record.client_id] = VelbusProtocol(client_id=record.client_id, velbus=velbus)
+        vbm = protocol.frame_cache.from_bytes(record.frame, protocol.velbus.decoding_context)
+        await protocol.process_message(vbm)
+        count += 1
+    return count
@@ -0,0 +1,172 @@
+import os
+import struct
+import typing
+
+from .Capture import CaptureReader, HEADER, RECORD
+
+
+class CaptureIndex:
+    """
+    Index of a capture file (see Capture), by time and by address, to find
+    the relevant frames without reading the whole capture.
+
+    The capture is split in buckets of `bucket_seconds` (wall-clock time).
+    Per bucket, the index holds the range of the capture file it occupies,
+    and a bitmap of the addresses that occur in it.
+
+    The index is kept in a sidecar file (`path_for()`): an 8-byte header
+    (`MAGIC` followed by the format version), followed by the entries:
+
+        int64    bucket number (wall-clock nanoseconds // bucket size)
+        uint64   start offset in the capture
+        uint64   end offset in the capture
+        32 bytes address bitmap (bit `address` set if it occurs)
+
+    All integers are little endian. The bucket size is fixed at
+    `bucket_seconds` for now.
+
+    CaptureWriter maintains the index while capturing. Records without an
+    index entry (the bucket being written, or a capture from before the
+    index existed) are indexed when the index is loaded.
+    """
+    MAGIC = b'VBIDX\x00\x00'
+    VERSION = 1
+    HEADER = MAGIC + bytes([VERSION])
+    ENTRY = struct.Struct('<qQQ32s')
+
+    bucket_seconds = 60
+
+    def __init__(self):
+        self.bucket_ns = self.bucket_seconds * 1_000_000_000
+        self.entries: typing.List[typing.Tuple[int, int, int, int]] = []
+        """(bucket, start offset, end offset, address bitmap)"""
+
+        self.indexed_end = len(HEADER)
+        """Capture offset up to which the entries (and the open bucket) cover"""
+        self._bucket = None
+        self._start = None
+        self._bitmap = 0
+
+    @staticmethod
+    def path_for(capture_path: str) -> str:
+        return capture_path + '.idx'
+
+    @classmethod
+    def load(cls, capture_path: str) -> 'CaptureIndex':
+        """
+        Load the index of `capture_path`, and index the records that are not
+        in it yet.
+        """
+        index = cls()
+        try:
+            with open(cls.path_for(capture_path), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = cls.HEADER
+        if data[0:len(cls.HEADER)] != cls.HEADER:
+            raise ValueError("{}: not a capture index".format(cls.path_for(capture_path)))
+        data = data[len(cls.HEADER):]
+        data = data[0:len(data) - len(data) % cls.ENTRY.size]  # cut off partially written entry
+        for bucket, start, end, bitmap in cls.ENTRY.iter_unpack(data):
+            index.entries.append((bucket, start, end, int.from_bytes(bitmap, 'little')))
+            index.indexed_end = max(index.indexed_end, end)
+
+        with CaptureReader(capture_path) as reader:
+            if index.indexed_end > len(reader.mmap):
+                # Index of an older capture with the same name
+                index = cls()
+            index.scan(reader)
+        return index
+
+    def scan(self, reader: CaptureReader) -> None:
+        """
+        Index the records of `reader` after `indexed_end`, and close the
+        last bucket
+        """
+        buf = reader.mmap
+        offset = self.indexed_end
+        end = len(buf)
+        while offset + RECORD.size <= end:
+            length, _, wall_ns, source_len = RECORD.unpack_from(buf, offset)
+            if length <= RECORD.size + source_len + 2 or offset + length > end:
+                break  # truncated
+            self.add(offset, offset + length, wall_ns, buf[offset + RECORD.size + source_len + 2])
+            offset += length
+        self.close_bucket()
+
+    def add(self, start: int, end: int, wall_ns: int, address: int
+            ) -> typing.Optional[typing.Tuple[int, int, int, int]]:
+        """
+        Index the record at [start, end) of the capture
+
+        :return: the entry of the previous bucket, if this record closed it
+        """
+        closed = None
+        bucket = wall_ns // self.bucket_ns
+        if bucket != self._bucket:
+            closed = self.close_bucket()
+            self._bucket = bucket
+            self._start = start
+        self._bitmap |= 1 << address
+        self.indexed_end = end
+        return closed
+
+    def close_bucket(self) -> typing.Optional[typing.Tuple[int, int, int, int]]:
+        """
+        Finish the entry for the current bucket, if any
+
+        :return: the new entry
+        """
+        if self._bucket is None:
+            return None
+        entry = (self._bucket, self._start, self.indexed_end, self._bitmap)
+        self.entries.append(entry)
+        self._bucket = None
+        self._bitmap = 0
+        return entry
+
+    @classmethod
+    def pack(cls, entry: typing.Tuple[int, int, int, int]) -> bytes:
+        bucket, start, end, bitmap = entry
+        return cls.ENTRY.pack(bucket, start, end, bitmap.to_bytes(32, 'little'))
+
+    def save(self, capture_path: str) -> None:
+        path = self.path_for(capture_path)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.HEADER)
+            for entry in self.entries:
+                f.write(self.pack(entry))
+        os.replace(path + '.tmp', path)
+
+    def search(self,
+               since_ns: int = None,
+               until_ns: int = None,
+               addresses: typing.Iterable[int] = None,
+               ) -> typing.Iterator[typing.Tuple[int, int]]:
+        """
+        Find the parts of the capture that may contain records in the given
+        time range (wall clock, nanoseconds since the epoch), for one of the
+        given addresses. The records themselves still need to be checked.
+
+        :return: [start, end) offsets in the capture, in file order
+        """
+        mask = -1
+        if addresses is not None:
+            mask = 0
+            for address in addresses:
+                mask |= 1 << address
+
+        pending = None
+        for bucket, start, end, bitmap in self.entries:
+            if not bitmap & mask \
+                    or (since_ns is not None and (bucket + 1) * self.bucket_ns <= since_ns) \
+                    or (until_ns is not None and bucket * self.bucket_ns >= until_ns):
+                continue
+            if pending is not None and pending[1] == start:
+                pending = (pending[0], end)  # merge adjacent buckets
+                continue
+            if pending is not None:
+                yield pending
+            pending = (start, end)
+        if pending is not None:
+            yield pending
@@ -0,0 +1,65 @@
+import collections
+import typing
+
+from .VelbusMessage.VelbusFrame import VelbusFrame
+
+
+class FrameCache:
+    """
+    Bounded LRU cache of parsed frames, keyed by their raw bytes.
+
+    Most traffic on the bus is the same few frames over and over again
+    (BusActive, RxBufReady, status requests and identical status replies).
+    Frames returned from the cache are shared between all users, and are
+    therefore frozen: use `.copy()` to get a modifiable copy.
+    """
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._frames = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def from_bytes(self,
+                   frame: typing.Union[bytes, bytearray],
+                   context: typing.Mapping[int, type] = None,
+                   ) -> VelbusFrame:
+        """
+        Like `VelbusFrame.from_bytes()`, but returns a shared, frozen
+        VelbusFrame. `frame` must contain exactly 1 frame.
+
+        :raises BufferError when the frame is incomplete
+        :raises ValueError when the frame can not be decoded
+        """
+        module_type = context.get(frame[2]) if context is not None and len(frame) > 2 else None
+        key = (bytes(frame), module_type)
+        try:
+            vbm = self._frames[key]
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return vbm
+        except KeyError:
+            pass
+
+        self.misses += 1
+        vbm = VelbusFrame.from_bytes(key[0], context)
+        vbm.freeze()
+
+        self._frames[key] = vbm
+        if len(self._frames) > self.maxsize:
+            self._frames.popitem(last=False)
+        return vbm
+
+    def clear(self) -> None:
+        self._frames.clear()
+
+    def statistics(self) -> dict:
+        return {
+            'size': len(self._frames),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
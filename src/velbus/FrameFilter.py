@@ -0,0 +1,74 @@
+import typing
+
+
+class FrameFilter:
+    """
+    Selects the frames a TCP client is interested in, by address and/or
+    command (the first data byte).
+
+    TCP clients register a filter in-band, by sending a line instead of a
+    frame (Velbus frames always start with 0x0f, so the two can't be
+    confused):
+
+        FILTER address=01,10-1f command=ee,fb\\n
+
+    Numbers are hexadecimal, ranges are inclusive. Omitted keys match
+    everything, so a plain `FILTER\\n` removes the filter again. Frames
+    without data bytes (e.g. module type requests) only need to match the
+    address.
+
+    The filter is compiled to lookup tables, so checking a frame costs two
+    indexing operations.
+    """
+    PREFIX = b'FILTER'
+    KEYS = ('address', 'command')
+
+    def __init__(self, address: typing.Iterable[int] = None, command: typing.Iterable[int] = None):
+        self.address_table = self._table(address)
+        self.command_table = self._table(command)
+
+    @staticmethod
+    def _table(values: typing.Optional[typing.Iterable[int]]) -> bytes:
+        if values is None:
+            return b'\x01' * 256
+        table = bytearray(256)
+        for v in values:
+            table[v] = 1
+        return bytes(table)
+
+    @classmethod
+    def parse(cls, line: str) -> 'FrameFilter':
+        """
+        Parse a `FILTER ...` line (see class documentation)
+
+        :raises ValueError when the line is not a valid filter
+        """
+        words = line.split()
+        if not words or words[0] != cls.PREFIX.decode():
+            raise ValueError("Not a FILTER line")
+
+        kwargs = {}
+        for word in words[1:]:
+            key, sep, values = word.partition('=')
+            if not sep or key not in cls.KEYS:
+                raise ValueError("Unknown filter `{}`".format(word))
+            kwargs[key] = list(cls._parse_values(values))
+        return cls(**kwargs)
+
+    @staticmethod
+    def _parse_values(values: str) -> typing.Iterator[int]:
+        for part in values.split(','):
+            first, _, last = part.partition('-')
+            first = int(first, 16)
+            last = int(last, 16) if last else first
+            if not 0 <= first <= last <= 0xff:
+                raise ValueError("Invalid range `{}`".format(part))
+            yield from range(first, last + 1)
+
+    def matches(self, frame: bytes) -> bool:
+        """
+        :param frame: a complete (valid) frame
+        """
+        if not self.address_table[frame[2]]:
+            return False
+        return not frame[3] & 0x0f or bool(self.command_table[frame[4]])
@@ -32,8 +32,18 @@ Setting the `null` value means the module was not found.
 
 When the module is removed from the server, it is also removed from the client
 The client can re-request a subscription if it wants to.
+
+
+Multiple buses
+--------------
+
+The routes of the default bus are available without prefix (e.g.
+`/module/1f/`). When the daemon serves multiple buses, every bus is
+available under `/bus/<name>` as well (e.g. `/bus/garage/module/1f/` and
+`/bus/garage/module_state`).
 """
 import contextvars
+import functools
 import inspect
 import json
 import logging
@@ -52,18 +62,23 @@ from .CachedException import CachedTimeoutError
 from .JsonPatchDict import JsonPatchOperation, JsonPatch
 from .mqtt import MqttStateSync
 from .VelbusProtocol import VelbusProtocol, VelbusHttpProtocol, format_sockaddr
+from .VelbusBus import VelbusBus, default_bus, buses
 
 from .VelbusMessage.VelbusFrame import VelbusFrame
 from .VelbusMessage.ModuleTypeRequest import ModuleTypeRequest
 from .VelbusMessage.ModuleType import ModuleType
+from .VelbusMessage.ModuleInfo.UnknownModuleInfo import UnknownModuleInfo
 
 from .VelbusModule._registry import module_registry
 from .VelbusModule.VelbusModule import VelbusModule
 from .VelbusModule.UnknownModule import UnknownModule
 
 
-modules: Dict[int, Union[asyncio.Future, Awaitable[VelbusModule]]] = dict()
-ws_clients = set()
+# State of the default bus. Other buses keep their own, see VelbusBus
+modules: Dict[int, Union[asyncio.Future, Awaitable[VelbusModule]]] = default_bus.modules
+module_types: Dict[int, type] = default_bus.module_types
+"""address -> ModuleInfo class, as learned from ModuleType messages"""
+ws_clients = default_bus.ws_clients
 
 sanic_request = contextvars.ContextVar('sanic_request')
 sanic_request_datetime = contextvars.ContextVar('sanic_request_datetime')
@@ -82,38 +97,83 @@ def timestamp(request: sanic.request) -> sanic.response:
     return sanic.response.text("{}\r\n".format(datetime.datetime.utcnow().timestamp()))
 
 
-async def delete_modules(request: sanic.request) -> sanic.response:
-    del request  # unused
-    modules.clear()
-    for ws in ws_clients:
-        ws.subscribed_modules = set()
-        await ws.send(json.dumps([{
-            'op': 'replace',
-            'path': '/',
-            'value': {},
-        }]))
+async def statistics(request: sanic.request, velbus: VelbusBus = default_bus) -> sanic.response:
+    """
+    Returns internal counters, for monitoring
+    """
+    if velbus.owner is not None:
+        # The counters of a worker would only describe whichever worker answers
+        return await velbus.owner.forward(request, velbus, 'statistics')
+    return sanic.response.json({
+        'frame_cache': VelbusProtocol.frame_cache.statistics(),
+        'buses': {
+            name: velbus.statistics()
+            for name, velbus in buses.items()
+        },
+    })
+
+
+async def delete_modules(request: sanic.request, velbus: VelbusBus = default_bus) -> sanic.response:
+    if velbus.owner is not None:
+        return await velbus.owner.forward(request, velbus, 'delete_modules')
+    await forget_modules(velbus)
     return sanic.response.text("Cache flushed\r\n")
 
 
-async def delete_module(request: sanic.request, address: str) -> sanic.response:
-    del request  # unused
+async def delete_module(request: sanic.request, address: str, velbus: VelbusBus = default_bus) -> sanic.response:
+    if velbus.owner is not None:
+        return await velbus.owner.forward(request, velbus, 'delete_module', address=address)
     address = int(address, 16)
-    if address in modules:
-        del modules[address]
-        for ws in ws_clients:
-            if address in ws.subscribed_modules:
-                await ws_client_unlisten_module(address, ws)
+    velbus.module_types.pop(address, None)
+    if await forget_module(velbus, address):
         return sanic.response.text("Deleted from cache\r\n")
     else:
         return sanic.response.text("Not in cache\r\n")
 
 
-async def module_req(request: sanic.request, address: str, module_path: str) -> sanic.response:
+async def forget_modules(velbus: VelbusBus) -> None:
+    velbus.modules.clear()
+    velbus.module_types.clear()
+    notify_state_listeners(velbus, JsonPatchOperation(JsonPatchOperation.Operation.replace, [], {}))
+    for ws in velbus.ws_clients:
+        ws.subscribed_modules = set()
+        await ws.send(json.dumps([{
+            'op': 'replace',
+            'path': '/',
+            'value': {},
+        }]))
+
+
+async def forget_module(velbus: VelbusBus, address: int) -> bool:
+    """
+    :return: whether the module was in the cache
+    """
+    if address not in velbus.modules:
+        return False
+    del velbus.modules[address]
+    notify_state_listeners(velbus, JsonPatchOperation(
+        JsonPatchOperation.Operation.remove, ['{:02x}'.format(address)]))
+    for ws in velbus.ws_clients:
+        if address in ws.subscribed_modules:
+            await ws_client_unlisten_module(address, ws)
+    return True
+
+
+def notify_state_listeners(velbus: VelbusBus, *ops: JsonPatchOperation) -> None:
+    if not velbus.state_listeners:
+        return
+    patch = JsonPatch(ops)
+    for listener in velbus.state_listeners:
+        listener(patch)
+
+
+async def module_req(request: sanic.request, address: str, module_path: str,
+                     velbus: VelbusBus = default_bus) -> sanic.response:
     sanic_request.set(request)
     sanic_request_datetime.set(datetime.datetime.utcnow())
 
     address = int(address, 16)
-    bus = VelbusHttpProtocol(request)
+    bus = VelbusHttpProtocol(request, velbus=velbus)
     mod = await get_module(bus, address)
 
     response = mod.dispatch(module_path, request, bus)
@@ -122,7 +182,8 @@ async def module_req(request: sanic.request, address: str, module_path: str) ->
     return response
 
 
-async def module_state_ws(request: sanic.request, ws: websockets.protocol.WebSocketCommonProtocol):
+async def module_state_ws(request: sanic.request, ws: websockets.protocol.WebSocketCommonProtocol,
+                          velbus: VelbusBus = default_bus):
     client_id = format_sockaddr(ws.remote_address)
     logger.info("{p} : new WebSocket connection ({ua})".format(
         p=client_id,
@@ -131,11 +192,11 @@ async def module_state_ws(request: sanic.request, ws: websockets.protocol.WebSoc
 
     ws.subscribed_modules = set()
 
-    ws_clients.add(ws)
+    velbus.ws_clients.add(ws)
     try:
         while True:
             msg = await ws.recv()
-            await handle_ws_message(VelbusHttpProtocol(request), ws, msg)
+            await handle_ws_message(VelbusHttpProtocol(request, velbus=velbus), ws, msg)
 
     except ValueError as e:
         logger.warning("{p} : invalid message received, dropping client: {e}".format(
@@ -153,7 +214,7 @@ async def module_state_ws(request: sanic.request, ws: websockets.protocol.WebSoc
         ))
         logger.error(traceback.format_exc())
     finally:
-        ws_clients.remove(ws)
+        velbus.ws_clients.remove(ws)
 
 
 async def handle_ws_message(bus: VelbusHttpProtocol,
@@ -246,23 +307,53 @@ async def ws_client_unlisten_module(address: int, ws: websockets.protocol.WebSoc
 
 
 def add_routes(bus: VelbusProtocol, app: sanic.Sanic):
-    bus.listeners.add(message)
+    """
+    Add the routes for the bus of `bus`. The default bus gets the routes
+    without prefix (and the global routes), all buses get routes under
+    /bus/<name>
+    """
+    velbus = bus.velbus
+    prefixes = ['/bus/{}'.format(velbus.name)]
+    if velbus is default_bus:
+        velbus.listeners.add(message)
+        prefixes.insert(0, '')
+
+        app.add_route(timestamp, '/timestamp', methods=['GET'])
+        app.add_route(statistics, '/statistics', methods=['GET'])
+    else:
+        velbus.listeners.add(functools.partial(message, velbus=velbus))
+    velbus.decoding_context = velbus.module_types
 
-    app.add_route(timestamp, '/timestamp', methods=['GET'])
+    def handler(f):
+        if velbus is default_bus:
+            return f
+        h = functools.partial(f, velbus=velbus)
+        h.__name__ = f.__name__
+        return h
 
-    app.add_route(delete_modules, '/module', methods=['DELETE'])
-    app.add_route(delete_module, '/module/<address:[0-9a-fA-F]{2}>', methods=['DELETE'])
+    for prefix in prefixes:
+        name = '' if prefix == '' else '_' + velbus.name
+        app.add_route(handler(delete_modules), prefix + '/module', methods=['DELETE'],
+                      name='delete_modules' + name)
+        app.add_route(handler(delete_module), prefix + '/module/<address:[0-9a-fA-F]{2}>', methods=['DELETE'],
+                      name='delete_module' + name)
 
-    app.add_route(module_req, '/module/<address:[0-9a-fA-F]{2}><module_path:|/.*>',
-                  # Explicitly mention `/` in the regex to force `.` to also match `/`
-                  methods=['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE'])
+        app.add_route(handler(module_req), prefix + '/module/<address:[0-9a-fA-F]{2}><module_path:|/.*>',
+                      # Explicitly mention `/` in the regex to force `.` to also match `/`
+                      methods=['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE'],
+                      name='module_req' + name)
 
-    app.add_websocket_route(module_state_ws, '/module_state')
+        app.add_websocket_route(handler(module_state_ws), prefix + '/module_state',
+                                name='module_state_ws' + name)
 
 
-def message(vbm: VelbusFrame):
+def message(vbm: VelbusFrame, velbus: VelbusBus = default_bus):
+    if isinstance(vbm.message, ModuleType) and \
+            not isinstance(vbm.message.module_info, UnknownModuleInfo):
+        velbus.module_types[vbm.address] = vbm.message.module_info.__class__
+
     try:
-        mod = modules[vbm.address].result()
+        mod = velbus.modules[vbm.address].result()
         return mod.message(vbm)  # May be an awaitable
     except (KeyError, asyncio.CancelledError, asyncio.InvalidStateError, TimeoutError):
         # module not loaded, get_module() was cancelled, is not done (yet) or resulted in a timeout
@@ -278,6 +369,7 @@ def get_module(bus: VelbusProtocol, address: int) -> Awaitable[VelbusModule]:
     :param address: address to create object for
     :return: A future resulting in the VelbusModule object of the correct type
     """
+    modules = bus.velbus.modules
     if address in modules:
         if modules[address].cancelled():
             del modules[address]
@@ -293,33 +385,50 @@ def get_module(bus: VelbusProtocol, address: int) -> Awaitable[VelbusModule]:
     return modules[address]
 
 
-def gen_update_state_cb(address) -> Callable:
+def gen_update_state_cb(address, velbus: VelbusBus = default_bus) -> Callable:
     def update_state_cb(ops: JsonPatch):
         prefixed_ops = ops.prefixed(['{:02x}'.format(address)])
         json_patch = json.dumps(prefixed_ops.to_json_able())
 
-        for op in prefixed_ops:
+        # MQTT is shared by all buses: put the state of other buses under their name
+        mqtt_ops = prefixed_ops if velbus is default_bus else prefixed_ops.prefixed([velbus.name])
+        for op in mqtt_ops:
             for mqtt in mqtt_sync_clients:
                 asyncio.get_event_loop().create_task(mqtt.publish(op))
 
-        for ws in ws_clients:
+        notify_state_listeners(velbus, *prefixed_ops)
+
+        for ws in velbus.ws_clients:
             if address in ws.subscribed_modules:
                 asyncio.ensure_future(ws.send(json_patch))
     return update_state_cb
 
 
 async def get_module_fresh(bus: VelbusProtocol, address: int) -> VelbusModule:
+    if bus.velbus.owner is not None:
+        # Worker process: the main process does the querying
+        return await bus.velbus.owner.get_module(bus.velbus, address)
+
     try:
         module_type = await bus.velbus_query(
             VelbusFrame(
                 address=address,
                 message=ModuleTypeRequest()
             ),
-            ModuleType
+            ModuleType,
+            coalesce=True,
         )
     except TimeoutError:
         raise CachedTimeoutError from TimeoutError
-    module_type_cls = module_type.message.module_info.__class__
+
+    mod = create_module(bus, address, module_type.message.module_info)
+    notify_state_listeners(bus.velbus, JsonPatchOperation(
+        JsonPatchOperation.Operation.add, ['{:02x}'.format(address)], mod.state))
+    return mod
+
+
+def create_module(bus: VelbusProtocol, address: int, module_info) -> VelbusModule:
+    module_type_cls = module_info.__class__
 
     try:
         try:
@@ -331,8 +440,8 @@ async def get_module_fresh(bus: VelbusProtocol, address: int) -> VelbusModule:
             try:
                 mod = c(bus=bus,
                          address=address,
-                         module_info=module_type.message.module_info)
-                mod.state_callback.add(gen_update_state_cb(address))
+                         module_info=module_info)
+                mod.state_callback.add(gen_update_state_cb(address, bus.velbus))
                 return mod
             except ValueError:
                 pass
@@ -342,5 +451,5 @@ async def get_module_fresh(bus: VelbusProtocol, address: int) -> VelbusModule:
     except ValueError:
         return UnknownModule(bus=bus,
                              address=address,
-                             module_info=module_type.message.module_info,
-                             update_state_cb=gen_update_state_cb(address))
+                             module_info=module_info,
+                             update_state_cb=gen_update_state_cb(address, bus.velbus))
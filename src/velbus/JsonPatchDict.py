@@ -16,7 +16,7 @@ class JsonPatchOperation:
         replace = 'replace'
     op: Operation
     path: List[str]
-    value: object
+    value: object = None
 
     def to_json_able(self):
         o = {
@@ -28,6 +28,20 @@ class JsonPatchOperation:
 
         return o
 
+    @classmethod
+    def from_json_able(cls, o: dict) -> "JsonPatchOperation":
+        if o['path'] == '':
+            path = []
+        elif o['path'].startswith('/'):
+            path = [JsonPatchOperation.unescape_path(p) for p in o['path'][1:].split('/')]
+        else:
+            raise ValueError("Invalid path `{}`".format(o['path']))
+        return cls(
+            op=JsonPatchOperation.Operation(o['op']),
+            path=path,
+            value=o.get('value'),
+        )
+
     @staticmethod
     def escape_path(path):
         path = re.sub(r'~', '~0', path)
@@ -62,6 +76,32 @@ class JsonPatch(list):
     def to_json_able(self):
         return [o.to_json_able() for o in self]
 
+    @classmethod
+    def from_json_able(cls, ops: list) -> "JsonPatch":
+        return cls(JsonPatchOperation.from_json_able(o) for o in ops)
+
+    def apply(self, doc: dict) -> None:
+        """
+        Apply the operations to `doc`, in place.
+
+        Only what JsonPatchDict generates is supported: `add` and `replace`
+        are both upserts, and the parent of the path must exist.
+        """
+        for op in self:
+            if not op.path:
+                doc.clear()
+                if op.op != JsonPatchOperation.Operation.remove:
+                    doc.update(op.value)
+                continue
+
+            parent = doc
+            for key in op.path[:-1]:
+                parent = parent[key]
+            if op.op == JsonPatchOperation.Operation.remove:
+                parent.pop(op.path[-1], None)
+            else:
+                parent[op.path[-1]] = op.value
+
     def prefixed(self, path: List[str]) -> "JsonPatch":
         """
         Return a new JsonPatch with the same operations prefixed by the given path
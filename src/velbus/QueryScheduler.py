@@ -0,0 +1,219 @@
+import asyncio
+import collections
+import typing
+
+
+class RoundTripTime:
+    """
+    Round-trip time statistics of a single module.
+
+    Keeps a smoothed average and variance (like TCP does), the most recent
+    samples (for percentiles), and a histogram.
+    """
+    BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1., 2., 5.)
+    """Upper bounds of the histogram buckets, in seconds"""
+
+    def __init__(self, recent: int = 64):
+        self.srtt: float = None
+        self.rttvar: float = None
+        self.recent = collections.deque(maxlen=recent)
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+        self.timeouts = 0
+        self.consecutive_timeouts = 0
+
+    def add(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.recent.append(rtt)
+        for i, bound in enumerate(self.BUCKETS):
+            if rtt <= bound:
+                break
+        else:
+            i = len(self.BUCKETS)
+        self.histogram[i] += 1
+        self.consecutive_timeouts = 0
+
+    def timed_out(self) -> None:
+        self.timeouts += 1
+        self.consecutive_timeouts += 1
+
+    def percentile(self, p: float) -> typing.Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+    def timeout(self, cap: float, minimum: float, min_samples: int) -> float:
+        """
+        Timeout to use for the next query, derived from the history: the
+        larger of the smoothed RTT + 4 deviations and 1.5x the 95th
+        percentile. After a timeout this is doubled, so a module that got
+        slower is not given up on too quickly. It is not doubled again on
+        further timeouts: a module that is gone would soon cost the full
+        `cap` on every query again.
+        """
+        if len(self.recent) < min_samples:
+            return cap
+        t = max(self.srtt + 4 * self.rttvar, 1.5 * self.percentile(0.95), minimum)
+        if self.consecutive_timeouts:
+            t *= 2
+        return min(t, cap)
+
+    def statistics(self) -> dict:
+        return {
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'timeouts': self.timeouts,
+            'histogram': {
+                ('<={}'.format(bound) if i < len(self.BUCKETS) else '>{}'.format(self.BUCKETS[-1])): count
+                for i, (bound, count) in enumerate(zip(self.BUCKETS + (None,), self.histogram))
+            },
+        }
+
+
+class QueryScheduler:
+    """
+    Limits the number of queries that are waiting for a reply, per address
+    and on the whole bus.
+
+    Queries over the limit wait for a slot, in order. A query for an address
+    that is at its limit does not hold up queries for other addresses.
+
+    The round-trip times per address are tracked as well, to give queries a
+    timeout based on the history of the module (see `timeout_for()`).
+    """
+    def __init__(self, max_per_address: int = 2, max_total: int = 8, max_wait: float = 10,
+                 min_timeout: float = 0.5, min_samples: int = 5):
+        """
+        :param max_wait: Maximum time (in seconds) a query waits for a slot
+        :param min_timeout: Never use a shorter timeout than this (seconds)
+        :param min_samples: Number of replies needed before the timeout is adapted
+        """
+        self.max_per_address = max_per_address
+        self.max_total = max_total
+        self.max_wait = max_wait
+        self.min_timeout = min_timeout
+        self.min_samples = min_samples
+        self.rtt: typing.Dict[int, RoundTripTime] = {}
+
+        self.in_flight = collections.Counter()
+        """address -> number of queries"""
+        self.total_in_flight = 0
+        self.waiting = collections.deque()
+        """[address, future] for every query waiting for a slot, in order"""
+        self.waiting_per_address = collections.Counter()
+
+        self.waits = 0
+        self.wait_total = 0.
+        self.wait_max = 0.
+        self.round_trips = 0
+        self.round_trip_total = 0.
+        self.round_trip_max = 0.
+
+    def _available(self, address: int) -> bool:
+        return self.total_in_flight < self.max_total and \
+            self.in_flight[address] < self.max_per_address
+
+    def _take(self, address: int) -> None:
+        self.in_flight[address] += 1
+        self.total_in_flight += 1
+
+    async def acquire(self, address: int) -> None:
+        """
+        Wait until a query for `address` is allowed
+        """
+        if self.waiting_per_address[address] == 0 and self._available(address):
+            self._take(address)
+            return
+
+        entry = [address, asyncio.get_event_loop().create_future()]
+        self.waiting.append(entry)
+        self.waiting_per_address[address] += 1
+        try:
+            await entry[1]
+        except asyncio.CancelledError:
+            if entry[1].done() and not entry[1].cancelled():
+                # We got the slot, but are not using it anymore
+                self.release(address)
+            else:
+                self.waiting.remove(entry)
+                self._dequeued(address)
+            raise
+
+    def _dequeued(self, address: int) -> None:
+        self.waiting_per_address[address] -= 1
+        if self.waiting_per_address[address] == 0:
+            del self.waiting_per_address[address]
+
+    def release(self, address: int) -> None:
+        self.in_flight[address] -= 1
+        if self.in_flight[address] == 0:
+            del self.in_flight[address]
+        self.total_in_flight -= 1
+
+        for entry in list(self.waiting):
+            if self.total_in_flight >= self.max_total:
+                break
+            waiting_address, future = entry
+            if future.done():
+                continue  # cancelled (e.g. timed out): acquire() removes it
+            if not self._available(waiting_address):
+                continue
+            self.waiting.remove(entry)
+            self._dequeued(waiting_address)
+            self._take(waiting_address)
+            future.set_result(None)
+
+    def add_wait(self, seconds: float) -> None:
+        self.waits += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def add_round_trip(self, address: int, seconds: float) -> None:
+        self.round_trips += 1
+        self.round_trip_total += seconds
+        self.round_trip_max = max(self.round_trip_max, seconds)
+        self._rtt(address).add(seconds)
+
+    def timed_out(self, address: int) -> None:
+        self._rtt(address).timed_out()
+
+    def _rtt(self, address: int) -> RoundTripTime:
+        try:
+            return self.rtt[address]
+        except KeyError:
+            rtt = self.rtt[address] = RoundTripTime()
+            return rtt
+
+    def timeout_for(self, address: int, cap: float) -> float:
+        """
+        Timeout to use for a query to `address`: based on the round-trip
+        times of this module, but never more than `cap`.
+        """
+        try:
+            return self.rtt[address].timeout(cap, self.min_timeout, self.min_samples)
+        except KeyError:
+            return cap
+
+    def statistics(self) -> dict:
+        """
+        Counters. Times are in seconds.
+        """
+        return {
+            'in_flight': self.total_in_flight,
+            'waiting': len(self.waiting),
+            'wait_avg': self.wait_total / self.waits if self.waits else None,
+            'wait_max': self.wait_max,
+            'round_trip_avg': self.round_trip_total / self.round_trips if self.round_trips else None,
+            'round_trip_max': self.round_trip_max,
+            'modules': {
+                '{:02x}'.format(address): rtt.statistics()
+                for address, rtt in sorted(self.rtt.items())
+            },
+        }
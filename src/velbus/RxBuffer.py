@@ -0,0 +1,79 @@
+import typing
+
+
+class RxBuffer:
+    """
+    Receive buffer that keeps track of a read offset, instead of deleting
+    consumed bytes from the front of a bytearray for every frame.
+
+    Consumed bytes are only really removed (compacted) once they make up
+    the majority of the buffer, so the cost of removing them is amortized
+    over many frames.
+    """
+    def __init__(self, compact_threshold: int = 4096):
+        """
+        :param compact_threshold: Minimum number of consumed bytes before
+                                  the buffer is compacted.
+        """
+        self.buf = bytearray()
+        self.offset = 0
+        self.compact_threshold = compact_threshold
+
+        self.discarded_bytes = 0
+        self.resyncs = 0
+
+    def __len__(self) -> int:
+        return len(self.buf) - self.offset
+
+    def __bool__(self) -> bool:
+        return len(self.buf) > self.offset
+
+    def extend(self, data: typing.Union[bytes, bytearray]) -> None:
+        self.buf.extend(data)
+
+    def peek(self, length: int = None) -> bytes:
+        """
+        Return (a copy of) the unconsumed bytes, without consuming them.
+        :param length: Maximum number of bytes to return (default: all)
+        """
+        if length is None:
+            return bytes(self.buf[self.offset:])
+        return bytes(self.buf[self.offset:(self.offset + length)])
+
+    def consume(self, length: int) -> bytes:
+        """
+        Remove `length` bytes from the front of the buffer and return them
+        """
+        data = bytes(self.buf[self.offset:(self.offset + length)])
+        self.offset += len(data)
+        self._maybe_compact()
+        return data
+
+    def resync(self, start_byte: int = 0x0f) -> bytes:
+        """
+        Discard bytes until the next occurrence of `start_byte`.
+        The current first byte is always discarded (it is assumed to be the
+        start of an invalid frame).
+
+        :return: the discarded bytes
+        """
+        next_start = self.buf.find(start_byte, self.offset + 1)
+        if next_start == -1:
+            next_start = len(self.buf)
+
+        discarded = self.consume(next_start - self.offset)
+        self.discarded_bytes += len(discarded)
+        self.resyncs += 1
+        return discarded
+
+    def compact(self) -> None:
+        del self.buf[0:self.offset]
+        self.offset = 0
+
+    def _maybe_compact(self) -> None:
+        if self.offset == len(self.buf):
+            # Everything consumed, cheap to reset
+            self.buf.clear()
+            self.offset = 0
+        elif self.offset >= self.compact_threshold and self.offset * 2 >= len(self.buf):
+            self.compact()
@@ -0,0 +1,110 @@
+import collections
+import typing
+
+
+class TransmitQueue:
+    """
+    Frames waiting to be transmitted on the bus.
+
+    Frames are scheduled by their Velbus priority (`frame[1] & 0x03`, where
+    0 is the most urgent): a frame is only sent when no frames of a more
+    urgent priority are waiting. Within a priority, the sources (see
+    VelbusProtocol.source: a connection or subsystem) take turns, so a single
+    chatty source can not hold up the others.
+    """
+    PRIORITIES = 4
+
+    def __init__(self):
+        self._lanes = [collections.OrderedDict() for _ in range(self.PRIORITIES)]
+        """priority -> {source -> deque of (enqueue time, frame)}"""
+        self._len = 0
+
+        self.lane_queued = [0] * self.PRIORITIES
+        self.lane_max_queued = [0] * self.PRIORITIES
+        self.lane_frames = [0] * self.PRIORITIES
+        self.lane_wait_total = [0.] * self.PRIORITIES
+        self.lane_wait_max = [0.] * self.PRIORITIES
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __bool__(self) -> bool:
+        return self._len > 0
+
+    @staticmethod
+    def priority(frame: bytes) -> int:
+        return frame[1] & 0x03
+
+    def put(self, frame: bytes, source: str, now: float) -> None:
+        """
+        Add `frame` to the end of the queue of `source`.
+        :param now: current time, to measure the time spent in the queue
+        """
+        prio = self.priority(frame)
+        lane = self._lanes[prio]
+        try:
+            lane[source].append((now, frame))
+        except KeyError:
+            lane[source] = collections.deque([(now, frame)])
+
+        self._len += 1
+        self.lane_queued[prio] += 1
+        if self.lane_queued[prio] > self.lane_max_queued[prio]:
+            self.lane_max_queued[prio] = self.lane_queued[prio]
+
+    def get(self, now: float) -> bytes:
+        """
+        Remove and return the next frame to transmit.
+        :raises IndexError when the queue is empty
+        """
+        return self.get_with_source(now)[1]
+
+    def get_with_source(self, now: float) -> typing.Tuple[typing.Hashable, bytes]:
+        """
+        Like get(), but return (source, frame)
+        """
+        for prio, lane in enumerate(self._lanes):
+            if not lane:
+                continue
+
+            source, frames = next(iter(lane.items()))
+            enqueued, frame = frames.popleft()
+            if frames:
+                lane.move_to_end(source)  # next source's turn
+            else:
+                del lane[source]
+
+            self._len -= 1
+            self.lane_queued[prio] -= 1
+            self.lane_frames[prio] += 1
+            wait = now - enqueued
+            self.lane_wait_total[prio] += wait
+            if wait > self.lane_wait_max[prio]:
+                self.lane_wait_max[prio] = wait
+            return source, frame
+
+        raise IndexError("get from an empty TransmitQueue")
+
+    def clear(self) -> None:
+        for lane in self._lanes:
+            lane.clear()
+        self._len = 0
+        self.lane_queued = [0] * self.PRIORITIES
+
+    def statistics(self) -> typing.List[dict]:
+        """
+        Per priority lane counters. Wait times are in seconds.
+        """
+        return [
+            {
+                'priority': prio,
+                'queued': self.lane_queued[prio],
+                'max_queued': self.lane_max_queued[prio],
+                'sources': len(self._lanes[prio]),
+                'frames': self.lane_frames[prio],
+                'wait_avg': self.lane_wait_total[prio] / self.lane_frames[prio]
+                if self.lane_frames[prio] else None,
+                'wait_max': self.lane_wait_max[prio],
+            }
+            for prio in range(self.PRIORITIES)
+        ]
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import typing
+
+from .QueryScheduler import QueryScheduler
+
+
+logger = logging.getLogger(__name__)
+
+
+class VelbusBus:
+    """
+    State of a single, physical Velbus bus: its serial connection, the TCP
+    clients and listeners that get its frames, the queries waiting for a
+    reply and the modules found on it.
+
+    A process can serve multiple buses. All VelbusProtocol objects belong to
+    exactly one bus (by default `default_bus`).
+
+    When the connection to the bus is lost, the bus is closed (see
+    `close()`). The other buses in the process are not affected.
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+        self.serial_client: 'VelbusSerialProtocol' = None
+        self.tcp_clients: 'typing.Set[VelbusTcpProtocol]' = set()
+        self.listeners = set()
+        self.capture: 'typing.Optional[CaptureWriter]' = None
+        """Record all frames relayed on this bus, see Capture"""
+
+        self.decoding_context: typing.Mapping[int, type] = None
+        """Optional mapping of address -> ModuleInfo class, used to decode received frames"""
+
+        self.pending_queries: 'typing.Dict[int, typing.Dict[type, typing.List[PendingQuery]]]' = {}
+        """address -> response type -> queries waiting for a reply, see VelbusProtocol.velbus_query()"""
+        self.in_flight_queries: typing.Dict[tuple, asyncio.Future] = {}
+        """Identical queries share a single question on the bus, see VelbusProtocol.velbus_query()"""
+        self.coalesced_queries = 0
+        self.query_scheduler = QueryScheduler()
+        """Limits the number of queries in flight, see VelbusProtocol.velbus_query()"""
+
+        # Used by HttpApi
+        self.modules: 'typing.Dict[int, typing.Union[asyncio.Future, typing.Awaitable[VelbusModule]]]' = {}
+        self.module_types: typing.Dict[int, type] = {}
+        """address -> ModuleInfo class, as learned from ModuleType messages"""
+        self.ws_clients = set()
+        self.state_listeners: typing.Set[typing.Callable[['JsonPatch'], None]] = set()
+        """Called with the changes to the state of all modules (paths start with the hex address)"""
+        self.owner: 'typing.Optional[WorkerLink]' = None
+        """In a worker process: the link to the main process, which owns this bus (see Workers)"""
+
+        self.closed = False
+        self.close_callbacks: typing.List[typing.Callable[['VelbusBus'], None]] = []
+        """Called when the bus is closed, see close()"""
+
+    def __repr__(self):
+        return "{cls}({name!r})".format(cls=self.__class__.__name__, name=self.name)
+
+    def close(self, reason: str) -> None:
+        """
+        Mark the bus as closed, after its (serial or upstream) connection is
+        lost, and run the `close_callbacks`. What happens next is up to
+        those: e.g. the daemon disconnects the bus' TCP clients, and exits
+        once all its buses are closed.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        logger.warning("Bus {b}: closed ({r})".format(b=self.name, r=reason))
+        for callback in self.close_callbacks:
+            callback(self)
+
+    def statistics(self) -> dict:
+        return {
+            'closed': self.closed,
+            'serial_tx': self.serial_client.statistics()
+            if self.serial_client is not None else None,
+            'queries': {
+                'waiting': sum(
+                    len(queries)
+                    for by_type in self.pending_queries.values()
+                    for queries in by_type.values()
+                ),
+                'in_flight': len(self.in_flight_queries),
+                'coalesced': self.coalesced_queries,
+                'scheduler': self.query_scheduler.statistics(),
+            },
+            'tcp_clients': {
+                c.client_id: c.statistics()
+                for c in self.tcp_clients
+            },
+            'modules': len(self.modules),
+            'capture': self.capture.statistics()
+            if self.capture is not None else None,
+        }
+
+
+default_bus = VelbusBus('default')
+
+buses: typing.Dict[str, VelbusBus] = {default_bus.name: default_bus}
+"""name -> bus"""
@@ -1,9 +1,10 @@
 import attr
 
-from ._registry import register
+from ._registry import register_for
 from ._utils import AttrSerializer
 from .VelbusMessage import VelbusMessage
 from ._types import UInt, Enum
+from .ModuleInfo.VMBDALI import VMBDALI
 
 
 @attr.s(slots=True)
@@ -16,7 +17,7 @@ class DaliDeviceSettingValueLevel(DaliDeviceSettingValue):
     level: UInt(8) = 255
 
 
-@register
+@register_for(VMBDALI)
 @attr.s(slots=True, auto_attribs=True)
 class DaliDeviceSettings(VelbusMessage):
     _priority: UInt(2) = 3
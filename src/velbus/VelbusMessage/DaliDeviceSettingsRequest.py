@@ -1,11 +1,12 @@
 import attr
 
-from ._registry import register
+from ._registry import register_for
 from .VelbusMessage import VelbusMessage
 from ._types import UInt, Enum
+from .ModuleInfo.VMBDALI import VMBDALI
 
 
-@register
+@register_for(VMBDALI)
 @attr.s(slots=True, auto_attribs=True)
 class DaliDeviceSettingsRequest(VelbusMessage):
     _priority: UInt(2) = 3
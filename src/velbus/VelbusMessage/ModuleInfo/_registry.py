@@ -1,3 +1,6 @@
+from .._codec import compile_codec
+
+
 module_type_registry = {}
 
 def register(cls):
@@ -10,4 +13,5 @@ def register(cls):
         if m not in module_type_registry:
             module_type_registry[m] = []
         module_type_registry[m].append(cls)
+    compile_codec(cls)
     return cls
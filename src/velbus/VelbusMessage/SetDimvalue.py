@@ -1,8 +1,9 @@
 import attr
 
-from ._registry import register
+from ._registry import register, register_for
 from .VelbusMessage import VelbusMessage
 from ._types import UInt, Enum, Index
+from .ModuleInfo.VMBDALI import VMBDALI
 
 
 @register
@@ -23,6 +24,7 @@ class SetDimvalue(VelbusMessage):
     """contains a 16-bit time in seconds needed for dimming to the desired value"""
 
 
+@register_for(VMBDALI)
 @attr.s(slots=True, auto_attribs=True)
 class SetDimvalue_VMBDALI(VelbusMessage):
     _priority: UInt(2) = 0
@@ -1,75 +1,205 @@
 import attr
 
-from ._registry import command_registry
+from ._registry import decoders_for
 from ._types import UInt
 from .VelbusMessage import VelbusMessage
 from .UnknownMessage import UnknownMessage
 from .ModuleTypeRequest import ModuleTypeRequest
 
 
-@attr.s(slots=True)
 class VelbusFrame:
-    address = attr.ib(converter=UInt(8))
-    message = attr.ib()
+    """
+    A Velbus frame: a message sent from/to an address.
 
-    @classmethod
-    def from_bytes(cls, frame: 'Union[bytes, bytearray]') -> 'VelbusFrame':
+    Frames parsed with `from_bytes()` keep their raw bytes. The message is
+    only decoded when `.message` is first accessed, and `to_bytes()` returns
+    the raw bytes, so relaying a frame does not need to decode or re-encode
+    it.
+    The decoded message of a parsed frame should be treated as read-only:
+    to change it, assign a new message to `.message`.
+
+    Frames can be frozen (e.g. when they are shared via a FrameCache), which
+    freezes the message as well. Use `copy()` to get a modifiable frame.
+    """
+    __slots__ = ('_address', '_message', '_raw', '_module_type', '_frozen')
+
+    def __init__(self, address: int, message: VelbusMessage):
+        self._address = UInt(8)(address)
+        self._message = message
+        self._raw = None
+        self._module_type = None
+        self._frozen = False
+
+    @property
+    def address(self) -> int:
+        return self._address
+
+    @address.setter
+    def address(self, address: int):
+        if self._frozen:
+            raise attr.exceptions.FrozenInstanceError()
+        self._address = UInt(8)(address)
+        self._raw = None
+
+    @property
+    def message(self) -> VelbusMessage:
+        if self._message is None:
+            self._message = self._decode(self._raw, self._module_type)
+            if self._frozen:
+                self._message.freeze()
+        return self._message
+
+    @message.setter
+    def message(self, message: VelbusMessage):
+        if self._frozen:
+            raise attr.exceptions.FrozenInstanceError()
+        self._message = message
+        self._raw = None
+
+    @property
+    def decoded(self) -> bool:
         """
-        Parse the given bytes in to a VelbusFrame
+        Has the message been decoded (or was it given)?
+        """
+        return self._message is not None
 
-        if message supports item deletion (`del message[0:5]`), the
-        consumed message is removed from `message`.
+    @property
+    def frozen(self) -> bool:
+        return self._frozen
 
-        :raises BufferError when the message is incomplete
-        :raises ValueError when the message can not be decoded
+    def freeze(self) -> None:
+        """
+        Make this frame immutable. The message is frozen as well (when it
+        gets decoded).
+        """
+        self._frozen = True
+        if self._message is not None:
+            self._message.freeze()
+
+    def copy(self) -> 'VelbusFrame':
+        """
+        Return a modifiable copy of this frame (and its message)
+        """
+        return self.__class__(
+            address=self._address,
+            message=self.message.copy(),
+        )
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        if self._raw is not None and other._raw is not None \
+                and self._module_type is other._module_type:
+            return self._raw == other._raw
+        return self._address == other._address and self.message == other.message
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None  # mutable
+
+    def __repr__(self):
+        return "{cls}(address={address!r}, message={message!r})".format(
+            cls=self.__class__.__name__,
+            address=self._address,
+            message=self.message,
+        )
+
+    @classmethod
+    def frame_length(cls, buf: 'Union[bytes, bytearray]', offset: int = 0) -> int:
+        """
+        Validate the framing (header, length, checksum & trailer) of the frame
+        starting at `buf[offset]`, without decoding it.
+
+        :return: the length of the frame in bytes
+        :raises BufferError when the frame is incomplete
+        :raises ValueError when the bytes do not form a valid frame
         """
-        if len(frame) < 6:
+        available = len(buf) - offset
+        if available < 6:
             raise BufferError("Not enough data to decode message")
 
-        if frame[0] != 0x0f:
+        if buf[offset] != 0x0f:
             raise ValueError("data[0] != 0x0f")
 
-        if frame[1] & 0xfc != 0xf8:
+        if buf[offset + 1] & 0xfc != 0xf8:
             raise ValueError("data[1] & 0xfc != 0xf8")
-        prio = frame[1] & 0x03
-
-        addr = frame[2]
 
-        if frame[3] & 0xb0 != 0x00:
+        if buf[offset + 3] & 0xb0 != 0x00:
             raise ValueError("data[3] & 0xb0 != 0x00")
-        rtr = bool(frame[3] & 0x40)
-        dlen = frame[3] & 0x0f
+        dlen = buf[offset + 3] & 0x0f
 
-        if len(frame) < 4 + dlen + 2:
+        length = 4 + dlen + 2
+        if available < length:
             raise BufferError("Not enough data to read data bytes")
 
-        data = frame[4:(4 + dlen)]
-
-        checksum_my = 0
-        for b in frame[0:(4 + dlen)]:
-            checksum_my += b
-        checksum_my = (-checksum_my) & 0xff
-
-        checksum_msg = frame[4 + dlen]
+        checksum_my = (-sum(buf[offset:(offset + 4 + dlen)])) & 0xff
+        checksum_msg = buf[offset + 4 + dlen]
         if checksum_my != checksum_msg:
             raise ValueError("Checksum mismatch: got 0x{msg:x}, expected 0x{my:x}".format(
                 my=checksum_my,
                 msg=checksum_msg
             ))
 
-        if frame[4 + dlen + 1] != 0x04:
+        if buf[offset + 4 + dlen + 1] != 0x04:
             raise ValueError("data[-1] != 0x04")
 
+        return length
+
+    @classmethod
+    def from_bytes(cls,
+                   frame: 'Union[bytes, bytearray]',
+                   context: 'Mapping[int, type]' = None,
+                   ) -> 'VelbusFrame':
+        """
+        Parse the given bytes in to a VelbusFrame
+
+        if message supports item deletion (`del message[0:5]`), the
+        consumed message is removed from `message`.
+
+        The framing is validated immediately, the message itself is decoded
+        when it is first accessed.
+
+        :param context: Optional mapping of address -> ModuleInfo class of
+                        the module at that address. Used to pick the correct
+                        decode for messages that differ per module type.
+
+        :raises BufferError when the message is incomplete
+        :raises ValueError when the message can not be decoded
+        """
+        length = cls.frame_length(frame)
+        raw = bytes(frame[0:length])
+
         try:
-            del frame[0:(4 + dlen + 1 + 1)]
+            del frame[0:length]
         except TypeError:
             # message is bytes, not bytearray. ignore
             pass
 
+        obj = cls.__new__(cls)
+        obj._address = UInt(8)(raw[2])
+        obj._message = None
+        obj._raw = raw
+        # Velbus messages CAN NOT always be decoded without context. Depending
+        # on the type of the module, the same bytes have different meaning.
+        # If the module type at this address is known, remember it for decoding.
+        obj._module_type = context.get(raw[2]) if context is not None else None
+        obj._frozen = False
+        return obj
+
+    @staticmethod
+    def _decode(raw: bytes, module_type: type = None) -> VelbusMessage:
+        """
+        Decode the message in the (already validated) frame `raw`
+        """
+        prio = raw[1] & 0x03
+        rtr = bool(raw[3] & 0x40)
+        data = raw[4:-2]
+
         # attempt to decode
-        # TODO: fix this
-        # Velbus messages CAN NOT be decoded without context. Depending on the
-        # type of the module, the same bytes have different meaning.
         # e.g.
         #   * command 0xEE is decoded differently from an VMB1LED vs VMBDALI
         #   * SetDimvalue (0x07) has either an Index(8) channel (VMB4DC) or an UInt(8) (VMBDALI)
@@ -82,10 +212,8 @@ class VelbusFrame:
                     )
 
             else:
-                command = data[0]
-                try:
-                    candidates = command_registry[command]
-                except KeyError:
+                candidates = decoders_for(data, module_type)
+                if len(candidates) == 0:
                     # Could not decode
                     raise ValueError()
 
@@ -111,15 +239,15 @@ class VelbusFrame:
                 data=data,
             )
 
-        return cls(
-            address=addr,
-            message=data,
-        )
+        return data
 
     def to_bytes(self) -> bytes:
         """
         Reconstruct the VelbusFrame
         """
+        if self._raw is not None:
+            return self._raw
+
         m = bytearray(b'\x0f')
         m.append(0xf8 | self.message._priority)
         m.append(self.address)
@@ -146,4 +274,4 @@ class VelbusFrame:
         return {
             'address': self.address,
             'message': self.message.to_json_able(),
-        }
\ No newline at end of file
+        }
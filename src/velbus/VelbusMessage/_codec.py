@@ -0,0 +1,277 @@
+"""
+Generated (de)serializers for AttrSerializer classes
+
+The generic `structattr` path interprets the field list of a class on every
+call. When a class is registered, `compile_codec()` generates specialized
+Python code for it instead: fields are extracted and inserted with
+precomputed shifts and masks, and types with a limited set of valid values
+(see `valid_values()` in `_types`) are decoded with a lookup table.
+
+The generated code must produce exactly the same results as the generic path.
+Classes that can not be compiled (e.g. because a field has no fixed width)
+keep using `structattr`.
+"""
+import logging
+import typing
+
+import attr
+
+from ._types import UInt, Bitmap
+
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(slots=True)
+class Codec:
+    decode = attr.ib()
+    """decode(cls, data, args, kwargs) -> instance of cls"""
+    encode = attr.ib()
+    """encode(obj) -> bytes"""
+    validate = attr.ib()
+    """validate(obj) -> None"""
+    source = attr.ib(repr=False)
+    """Generated source code, for debugging"""
+
+
+def _is_uint(t) -> bool:
+    base = UInt(t.bits())
+    return issubclass(t, base) and \
+        t.__new__ is base.__new__ and \
+        t.from_int.__func__ is base.from_int.__func__ and \
+        t.to_int is base.to_int
+
+
+def _is_bitmap(t) -> bool:
+    base = Bitmap(t.bits())
+    return issubclass(t, base) and \
+        t.__new__ is base.__new__ and \
+        t.from_int.__func__ is base.from_int.__func__ and \
+        t.to_int is base.to_int
+
+
+def _value_table(t) -> typing.Optional[dict]:
+    """
+    Precompute {raw value: decoded value} for types that only accept a
+    limited set of values.
+    """
+    if not hasattr(t, 'valid_values') or not hasattr(t, 'from_int'):
+        return None
+    try:
+        return {raw: t.from_int(raw) for raw in t.valid_values()}
+    except (ValueError, TypeError):
+        return None
+
+
+def _field_code(i: int, t, name: str, raw: str, bits: int, aligned: bool, data_slice: str, ns: dict):
+    """
+    Generate the code to decode & encode a single field
+
+    :param name: name of the field, for error messages
+    :param raw: expression extracting the raw field value from the data
+    :return: (decode lines, encode lines). The decode lines store the value
+             in `f_<i>`, the encode lines take the value from `x` and leave
+             the raw (unsigned) value in `r`
+    """
+    mask = (1 << bits) - 1
+    kwarg = "f_{}".format(i)
+    dec = []
+    enc = []
+
+    table = _value_table(t)
+    if table is not None:
+        ns['tbl_{}'.format(i)] = table
+        ns['rev_{}'.format(i)] = {value: raw_value for raw_value, value in table.items()}
+        dec.append("{k} = tbl_{i}[{raw}]".format(k=kwarg, i=i, raw=raw))
+        enc.append("r = rev_{i}.get(x)".format(i=i))
+        enc.append("if r is None: r = x.to_int()")
+
+    elif _is_uint(t) or _is_bitmap(t):
+        # value is masked, so skip the range check in __new__
+        dec.append("{k} = _int_new(T_{i}, {raw})".format(k=kwarg, i=i, raw=raw))
+        enc.append("r = x")
+
+    elif hasattr(t, 'from_int'):
+        dec.append("{k} = T_{i}.from_int({raw})".format(k=kwarg, i=i, raw=raw))
+        enc.append("r = x.to_int()")
+
+    elif hasattr(t, 'from_signed_int'):
+        sign = 1 << (bits - 1)
+        dec.append("r = {raw}".format(raw=raw))
+        dec.append("{k} = T_{i}.from_signed_int(r - ((r & 0x{s:x}) << 1))".format(
+            k=kwarg, i=i, s=sign))
+        enc.append("r = x.to_signed_int()")
+        enc.append("if not -0x{s:x} <= r < 0x{s:x}: raise ValueError('{n} out of range')".format(
+            s=sign, n=name))
+        enc.append("r &= 0x{:x}".format(mask))
+        return dec, enc
+
+    elif hasattr(t, 'from_bytes'):
+        # from_bytes() gets left-aligned data
+        pad = -bits % 8
+        num_bytes = (bits + pad) // 8
+        if aligned:
+            dec.append("{k} = T_{i}.from_bytes({d})".format(k=kwarg, i=i, d=data_slice))
+        else:
+            dec.append("{k} = T_{i}.from_bytes(({raw} << {p}).to_bytes({n}, 'big'))".format(
+                k=kwarg, i=i, raw=raw, p=pad, n=num_bytes))
+        enc.append("b = x.to_bytes()")
+        enc.append("if len(b) != {n}: raise ValueError('{name} must be {n} bytes')".format(n=num_bytes, name=name))
+        enc.append("r = _from_bytes(b, 'big') >> {p}".format(p=pad))
+
+    else:
+        raise TypeError("Don't know how to (de)serialize {}".format(t))
+
+    enc.append("if r >> {b} or r < 0: raise ValueError('{n} out of range')".format(b=bits, n=name))
+    return dec, enc
+
+
+def _construct_code(cls, attributes, ns: dict) -> typing.List[str]:
+    """
+    Generate the code to construct the object from the decoded fields (in
+    f_0, f_1, ...) and the remaining (non-data) fields in kwargs.
+
+    The slots are filled in directly instead of going through __init__ (and
+    __setattr__); this is equivalent as long as the class has no
+    converters, validators or __attrs_post_init__. Since all decoded values
+    have the correct type, the object stays marked as validated.
+    """
+    kwarg_names = {a.name: "f_{}".format(i) for i, a in enumerate(attributes)}
+    init_kwargs = ", ".join("{}={}".format(name.lstrip('_'), var) for name, var in kwarg_names.items())
+
+    fields = attr.fields(cls)
+    if hasattr(cls, '__attrs_post_init__') or \
+            '__slots__' not in cls.__dict__ or \
+            any(getattr(a, 'converter', None) is not None or a.validator is not None or not a.init for a in fields):
+        return ["return cls(*args, {}, **kwargs)".format(init_kwargs)]
+
+    code = [
+        "if args:",
+        "    return cls(*args, {}, **kwargs)".format(init_kwargs),
+        "obj = _new(cls)",
+    ]
+    ns['_new'] = object.__new__
+    for j, a in enumerate(fields):
+        ns['set_{}'.format(j)] = getattr(cls, a.name).__set__
+        if a.name in kwarg_names:
+            code.append("set_{j}(obj, {v})".format(j=j, v=kwarg_names[a.name]))
+        elif a.default is attr.NOTHING:
+            code.append("set_{j}(obj, kwargs.pop('{k}'))".format(j=j, k=a.name.lstrip('_')))
+        elif isinstance(a.default, attr.Factory):
+            ns['default_{}'.format(j)] = a.default.factory
+            code.append("set_{j}(obj, kwargs.pop('{k}') if '{k}' in kwargs else default_{j}())".format(
+                j=j, k=a.name.lstrip('_')))
+        else:
+            ns['default_{}'.format(j)] = a.default
+            code.append("set_{j}(obj, kwargs.pop('{k}', default_{j}))".format(j=j, k=a.name.lstrip('_')))
+    code.append("if kwargs:")
+    code.append("    raise TypeError('Unexpected arguments: {}'.format(', '.join(kwargs)))")
+    code.append("return obj")
+    return code
+
+
+def _generate(cls, attributes) -> typing.Tuple[str, dict]:
+    """
+    Generate the source code of decode(), encode() and validate() for `cls`
+    :return: (source, namespace to execute it in)
+    """
+    ns = {
+        '_from_bytes': int.from_bytes,
+        '_int_new': int.__new__,
+    }
+    total_bits = sum(a.type.bits() for a in attributes)
+    if total_bits % 8 != 0:
+        raise TypeError("{} does not fill whole bytes".format(cls.__name__))
+    num_bytes = total_bits // 8
+
+    decode = []
+    encode = []
+    validate = []
+    need_v = False
+
+    offset = 0
+    for i, a in enumerate(attributes):
+        t = a.type
+        bits = t.bits()
+        shift = total_bits - offset - bits
+        start = offset // 8
+        end = (offset + bits + 7) // 8
+        aligned = offset % 8 == 0 and bits % 8 == 0
+        offset += bits
+
+        ns['T_{}'.format(i)] = t
+
+        data_slice = "data[{}:{}]".format(start, end)
+        if aligned and bits == 8:
+            raw = "data[{}]".format(start)
+        elif aligned:
+            raw = "_from_bytes({}, 'big')".format(data_slice)
+        else:
+            raw = "(v >> {} & 0x{:x})".format(shift, (1 << bits) - 1)
+            need_v = True
+
+        dec, enc = _field_code(i, t, a.name, raw, bits, aligned, data_slice, ns)
+        decode.extend(dec)
+
+        # Convert to the correct type first, just like validate() does
+        encode.append("x = self.{n}".format(n=a.name))
+        encode.append("if not isinstance(x, T_{i}):".format(i=i))
+        encode.append("    x = T_{i}(x)".format(i=i))
+        encode.append("    self.{n} = x".format(n=a.name))
+        encode.extend(enc)
+        encode.append("v = r" if i == 0 else "v = v << {} | r".format(bits))
+
+        validate.append("if not isinstance(self.{n}, T_{i}):".format(n=a.name, i=i))
+        validate.append("    self.{n} = T_{i}(self.{n})".format(n=a.name, i=i))
+
+    source = ["def decode(cls, data, args, kwargs):"]
+    source.append("    if len(data) != {n}:".format(n=num_bytes))
+    source.append("        raise ValueError('Expected {n} data bytes, got {{}}'.format(len(data)))".format(
+        n=num_bytes))
+    if need_v:
+        source.append("    v = _from_bytes(data, 'big')")
+    source.append("    try:")
+    source.extend("        " + line for line in decode)
+    source.append("    except KeyError as e:")
+    source.append("        raise ValueError('Invalid value: {}'.format(e)) from None")
+    source.extend("    " + line for line in _construct_code(cls, attributes, ns))
+    source.append("")
+
+    source.append("def encode(self):")
+    source.extend("    " + line for line in encode)
+    source.append("    return v.to_bytes({n}, 'big')".format(n=num_bytes))
+    source.append("")
+
+    source.append("def validate(self):")
+    source.extend("    " + line for line in validate)
+    source.append("")
+
+    return "\n".join(source), ns
+
+
+def compile_codec(cls) -> typing.Optional[Codec]:
+    """
+    Generate a specialized codec for `cls`, and attach it to the class.
+    AttrSerializer will use it instead of the generic structattr path.
+
+    :return: the Codec, or None if `cls` can not be compiled
+    """
+    attributes = list(cls._data_attributes())
+    if len(attributes) == 0:
+        return None
+
+    try:
+        source, ns = _generate(cls, attributes)
+    except (AttributeError, TypeError) as e:
+        logger.debug("No generated codec for {cls}: {e}".format(cls=cls.__name__, e=e))
+        return None
+
+    exec(compile(source, "<codec for {}>".format(cls.__qualname__), 'exec'), ns)
+    codec = Codec(
+        decode=ns['decode'],
+        encode=ns['encode'],
+        validate=ns['validate'],
+        source=source,
+    )
+    cls._codec = codec
+    return codec
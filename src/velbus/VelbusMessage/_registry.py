@@ -1,14 +1,228 @@
+import logging
+import typing
+
+import attr
+
+from ._utils import AttrSerializer
+from ._codec import compile_codec
+
+
+logger = logging.getLogger(__name__)
+
+
 command_registry = {}
+"""
+command byte -> list of classes that use this command, in registration order
+"""
 
+decoder_index = {}
+"""
+(command byte, data length) -> Decoder
 
-def register(cls):
+Classes that parse their (variable length) data themselves are indexed
+under a data length of `None`.
+"""
+
+module_decoder_index = {}
+"""
+ModuleInfo class -> {(command byte, data length) -> Decoder}
+
+Decoders that only apply to frames from/to a specific module type. These take
+precedence over `decoder_index` when the module type of the address is known.
+"""
+
+any_module_decoder_index = {}
+"""
+(command byte, data length) -> Decoder
+
+All module specific decoders, regardless of module type. Used as a last
+resort when the module type of the address is unknown.
+"""
+
+
+@attr.s(slots=True)
+class Decoder:
     """
-    Class decorator to register a command
-    :param cls: the class to register. Must contain a `Command` Enum class
+    Index entry for all classes sharing a command byte and data length.
+
+    When multiple classes share the same entry, the first field where all
+    candidates only accept disjoint sets of values is used to pick the
+    correct class directly, without trying to decode.
+    """
+    candidates = attr.ib(factory=list)
+
+    # Location of the distinguishing field in the data: data[start:end] >> shift & mask
+    start = attr.ib(default=None)
+    end = attr.ib(default=None)
+    shift = attr.ib(default=None)
+    mask = attr.ib(default=None)
+    table = attr.ib(default=None)
+    """raw field value -> class"""
+
+    def candidates_for(self, data: bytes) -> typing.List[type]:
+        if self.table is None:
+            return self.candidates
+
+        value = int.from_bytes(data[self.start:self.end], 'big') >> self.shift & self.mask
+        try:
+            return [self.table[value]]
+        except KeyError:
+            return []
+
+    @property
+    def ambiguous(self) -> bool:
+        return len(self.candidates) > 1 and self.table is None
+
+    def add(self, cls) -> None:
+        self.candidates.append(cls)
+        self.table = None
+        if len(self.candidates) < 2 or _data_length(cls) is None:
+            return
+
+        for bit_offset, bits, values_per_class in _field_value_sets(self.candidates):
+            if _disjoint(values_per_class):
+                self.start = bit_offset // 8
+                self.end = (bit_offset + bits + 7) // 8
+                self.shift = self.end * 8 - (bit_offset + bits)
+                self.mask = (1 << bits) - 1
+                self.table = {
+                    value: c
+                    for c, values in zip(self.candidates, values_per_class)
+                    for value in values
+                }
+                return
+
+
+def _data_length(cls) -> typing.Optional[int]:
+    """
+    Number of data bytes `cls` decodes, or None if `cls` parses its data
+    itself (and may accept multiple lengths)
+    """
+    if getattr(cls.from_bytes, '__func__', None) is not AttrSerializer.from_bytes.__func__:
+        return None
+    try:
+        bits = sum(a.type.bits() for a in cls._data_attributes())
+    except AttributeError:
+        return None
+    if bits % 8 != 0:
+        return None
+    return bits // 8
+
+
+def _field_value_sets(candidates):
+    """
+    Yield (bit offset, bits, [valid values for each candidate]) for every
+    field position that is present in all candidates and restricted to a
+    finite set of values in all of them.
     """
+    layouts = []
+    for c in candidates:
+        layout = {}
+        offset = 0
+        for a in c._data_attributes():
+            layout[offset, a.type.bits()] = a.type
+            offset += a.type.bits()
+        layouts.append(layout)
+
+    for position in sorted(layouts[0].keys()):
+        types = [layout.get(position) for layout in layouts]
+        if any(t is None or not hasattr(t, 'valid_values') for t in types):
+            continue
+        yield position[0], position[1], [frozenset(t.valid_values()) for t in types]
+
+
+def _disjoint(sets) -> bool:
+    seen = set()
+    for s in sets:
+        if not seen.isdisjoint(s):
+            return False
+        seen.update(s)
+    return True
+
+
+def _add_to_command_registry(cls) -> None:
     commands = [cmd.value for cmd in cls.Command]
     for c in commands:
         if c not in command_registry:
             command_registry[c] = []
         command_registry[c].append(cls)
+
+
+def _add_to_index(index: dict, cls, warn_ambiguous: bool = True) -> None:
+    length = _data_length(cls)
+    for c in [cmd.value for cmd in cls.Command]:
+        decoder = index.setdefault((c, length), Decoder())
+        if cls in decoder.candidates:
+            continue
+        decoder.add(cls)
+        if warn_ambiguous and decoder.ambiguous:
+            logger.warning("Ambiguous decoders for command 0x{cmd:02x} with {len} data bytes: "
+                           "{names}; these will be tried in order".format(
+                               cmd=c,
+                               len=length if length is not None else 'variable',
+                               names=', '.join(d.__name__ for d in decoder.candidates),
+                           ))
+
+
+def register(cls):
+    """
+    Class decorator to register a command
+    :param cls: the class to register. Must contain a `Command` Enum class
+    """
+    _add_to_command_registry(cls)
+    _add_to_index(decoder_index, cls)
+    compile_codec(cls)
     return cls
+
+
+def register_for(*module_types):
+    """
+    Class decorator to register a command that is only used by (a) specific
+    module type(s).
+    :param module_types: ModuleInfo classes of the modules using this command
+    """
+    def decorator(cls):
+        _add_to_command_registry(cls)
+        for module_type in module_types:
+            _add_to_index(module_decoder_index.setdefault(module_type, {}), cls)
+        _add_to_index(any_module_decoder_index, cls, warn_ambiguous=False)
+        compile_codec(cls)
+        return cls
+    return decorator
+
+
+def _lookup(index: dict, data: bytes) -> typing.List[type]:
+    command = data[0]
+    candidates = []
+
+    decoder = index.get((command, len(data)))
+    if decoder is not None:
+        candidates = decoder.candidates_for(data)
+
+    decoder = index.get((command, None))
+    if decoder is not None:
+        candidates = candidates + decoder.candidates
+
+    return candidates
+
+
+def decoders_for(data: bytes, module_type: type = None) -> typing.List[type]:
+    """
+    Look up the class(es) that can decode `data` (the data-part of a frame,
+    starting with the command byte).
+
+    :param module_type: ModuleInfo class of the module at the address of the
+                        frame, or None if unknown
+    :return: list of candidate classes, normally 0 or 1 element
+    """
+    if module_type is None:
+        return _lookup(decoder_index, data) + _lookup(any_module_decoder_index, data)
+
+    try:
+        candidates = _lookup(module_decoder_index[module_type], data)
+        if len(candidates) > 0:
+            return candidates
+    except KeyError:
+        pass
+
+    return _lookup(decoder_index, data)
@@ -15,6 +15,10 @@ For a type to be usable as field type, it needs several methods:
       obj.to_int() -> int
       obj.to_bytes() -> bytes
   Note: the data from to_bytes must be left-aligned (only relevant if bits() % 8 != 0)
+
+* optionally, if only a limited set of raw values is valid:
+      cls.valid_values() -> Iterable[int]
+  This is used to tell apart messages that share the same command and length
 """
 import enum
 import functools
@@ -34,6 +38,10 @@ def Enum(bits: int):
         def from_int(cls, data: int):
             return cls(data)
 
+        @classmethod
+        def valid_values(cls):
+            return cls._value2member_map_.keys()
+
         def to_int(self) -> int:
             return self.value
 
@@ -55,7 +63,7 @@ def Bytes(num_bytes: int):
 
         @classmethod
         def from_bytes(cls, data: bytes):
-            return data
+            return cls(data)
 
         def to_bytes(self) -> bytes:
             return self
@@ -69,31 +77,88 @@ def Bytes(num_bytes: int):
 @functools.lru_cache(maxsize=None)
 def Bitmap(bits: int):
     """
-    Returns a class holding a list of booleans for the given number of bits
+    Returns a class holding the given number of bits.
+
+    The bits are stored in a (immutable) int, but the object behaves like a
+    list of booleans: index 0 is the most significant bit. It can be
+    constructed from an int or from an iterable of booleans, and compares
+    equal to both.
     """
-    class Bitmap(list):
+    class Bitmap(int):
+        __slots__ = ()
+
         @classmethod
         def bits(cls):
             return bits
 
         @classmethod
         def from_int(cls, data: int):
-            v = list()
-            for i in range(bits):
-                v.append(bool(data & 1))
-                data >>= 1
-            return list(reversed(v))
+            return cls(data)
 
         def to_int(self) -> int:
-            out = 0
-            for v in self:
-                out <<= 1
-                out |= int(v)
-            return out
+            return int(self)
 
         @classmethod
         def zero(cls):
-            return cls.from_int(0)
+            return cls(0)
+
+        def __new__(cls, value=0):
+            if not isinstance(value, int):
+                v = 0
+                n = 0
+                for b in value:
+                    v = v << 1 | bool(b)
+                    n += 1
+                if n != bits:
+                    raise ValueError("Expected {b} bits, got {n}".format(b=bits, n=n))
+                value = v
+            elif value < 0 or value >> bits:
+                raise ValueError("Value does not fit in {b} bits".format(b=bits))
+            return super().__new__(cls, value)
+
+        def __len__(self) -> int:
+            return bits
+
+        def __getitem__(self, i):
+            if isinstance(i, slice):
+                return [self[j] for j in range(*i.indices(bits))]
+            if i < 0:
+                i += bits
+            if not 0 <= i < bits:
+                raise IndexError("Bitmap index out of range")
+            return bool(self >> (bits - 1 - i) & 1)
+
+        def __iter__(self):
+            v = int(self)
+            return (bool(v >> i & 1) for i in range(bits - 1, -1, -1))
+
+        def __eq__(self, other):
+            if isinstance(other, int):
+                return int(self) == int(other)
+            if isinstance(other, (list, tuple)):
+                return list(self) == list(other)
+            return NotImplemented
+
+        def __ne__(self, other):
+            result = self.__eq__(other)
+            if result is NotImplemented:
+                return result
+            return not result
+
+        __hash__ = int.__hash__
+
+        def set_bits(self) -> list:
+            """
+            Indices of the bits that are set
+            """
+            v = int(self)
+            return [i for i in range(bits) if v >> (bits - 1 - i) & 1]
+
+        def __repr__(self):
+            return repr(list(self))
+
+        def to_json_able(self) -> list:
+            return list(self)
 
     return Bitmap
 
@@ -203,6 +268,10 @@ def Index(bits: int, max_bits: int = None):
                     return cls(i + 1)  # 1-based indexing!
             raise ValueError("0x{:x} does not have exactly 1 bit set".format(data))
 
+        @classmethod
+        def valid_values(cls):
+            return [1 << i for i in range(0, max_bits)]
+
         def to_int(self) -> int:
             return int(1 << (self - 1))  # 1-based indexing
     return Index
@@ -237,6 +306,10 @@ class BlindNumber(int):
         else:
             raise ValueError()
 
+    @classmethod
+    def valid_values(cls):
+        return [0b0011, 0b1100]
+
     def to_int(self) -> int:
         return 0b11 << 2*(self - 1)
 
@@ -2,8 +2,75 @@ import attr
 import structattr
 
 
+def _copy_json(value):
+    """
+    Copy the containers of a JSON-able value, so the copy can be modified
+    without touching the original. Leaves (str, int, ...) are immutable and
+    are shared.
+    """
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(v) for v in value]
+    return value
+
+
 class AttrSerializer:
     _bitstruct_info = None
+    # A generated `_codec.Codec` is attached to registered classes. It is
+    # looked up in the class' own __dict__, so subclasses don't inherit it.
+
+    _frozen = False
+
+    # Objects that are decoded (by a generated codec) have their slots filled
+    # in directly, and hold values of the correct type: they don't need to
+    # be validated. Any assignment (including the ones in __init__) marks
+    # the object as not validated, and drops the cached JSON-able form.
+    # These flags live in the instance __dict__, next to the slots.
+    _validated = True
+    _json = None
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise attr.exceptions.FrozenInstanceError()
+        super().__setattr__(name, value)
+        if self._validated:
+            d = self.__dict__
+            d['_validated'] = False
+            d.pop('_json', None)
+
+    def freeze(self) -> None:
+        """
+        Make this object (and nested AttrSerializer objects) immutable,
+        e.g. because it is shared. Use `copy()` to get a modifiable copy.
+        """
+        if self._frozen:
+            return
+        self.validate()
+        for attribute in attr.fields(self.__class__):
+            value = getattr(self, attribute.name)
+            if isinstance(value, AttrSerializer):
+                value.freeze()
+        object.__setattr__(self, '_frozen', True)
+
+    @property
+    def frozen(self) -> bool:
+        return self._frozen
+
+    def copy(self) -> 'AttrSerializer':
+        """
+        Return a modifiable copy of this object.
+        Nested AttrSerializer objects and lists are copied as well.
+        """
+        kwargs = {}
+        for attribute in attr.fields(self.__class__):
+            value = getattr(self, attribute.name)
+            if isinstance(value, AttrSerializer):
+                value = value.copy()
+            elif isinstance(value, list):
+                value = value.__class__(value)
+            kwargs[attribute.name.lstrip('_')] = value
+        return self.__class__(**kwargs)
 
     @classmethod
     def bitstruct_info(cls):
@@ -18,7 +85,14 @@ class AttrSerializer:
         Validate if the attributes hold valid values, and convert the to the correct type
         :raises ValueError: if the a value is not acceptable
         """
-        return structattr.validate(self, True, self.bitstruct_info())
+        if self._validated:
+            return
+        codec = type(self).__dict__.get('_codec')
+        if codec is not None:
+            codec.validate(self)
+        else:
+            structattr.validate(self, True, self.bitstruct_info())
+        self.__dict__['_validated'] = True
 
     @classmethod
     def _data_attributes(cls):
@@ -30,6 +104,10 @@ class AttrSerializer:
         Factory method that gets partially parsed bytes (in kwargs and data).
         Further parse data and return appropriate VelbusMessage object
         """
+        codec = cls.__dict__.get('_codec')
+        if codec is not None:
+            return codec.decode(cls, data, args, kwargs)
+
         fields = structattr.deserialize(data, cls.bitstruct_info())
 
         fields = {k[1:] if k.startswith('_') else k: v for k, v in fields.items()}
@@ -42,6 +120,10 @@ class AttrSerializer:
         Reconstruct the data-portion of the VelbusFrame
         :return:
         """
+        codec = type(self).__dict__.get('_codec')
+        if codec is not None:
+            return codec.encode(self)
+
         self.validate()
         attributes = self._data_attributes()
         return structattr.serialize(
@@ -51,22 +133,35 @@ class AttrSerializer:
     def to_json_able(self):
         """
         Method to make the object JSON-serialazable.
+
+        The result is cached until the object is modified, unless it contains
+        mutable values (lists or nested objects) that could change behind our
+        back.
         """
-        self.validate()
+        props = self._json
+        if props is None:
+            self.validate()
 
-        props = {}
+            props = {}
+            cacheable = True
 
-        for attribute in attr.fields(self.__class__):
-            if attribute.name.startswith('_'):
-                continue
-            value = getattr(self, attribute.name)
-            try:
-                value = value.to_json_able()
-            except AttributeError:
-                pass
-            props[attribute.name] = value
+            for attribute in attr.fields(self.__class__):
+                if attribute.name.startswith('_'):
+                    continue
+                value = getattr(self, attribute.name)
+                if isinstance(value, list) or \
+                        (isinstance(value, AttrSerializer) and not value.frozen):
+                    cacheable = False
+                try:
+                    value = value.to_json_able()
+                except AttributeError:
+                    pass
+                props[attribute.name] = value
+
+            if cacheable:
+                self.__dict__['_json'] = props
 
         return {
             'type': self.__class__.__name__,
-            'properties': props,
+            'properties': _copy_json(props),
         }
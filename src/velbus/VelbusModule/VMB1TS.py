@@ -55,6 +55,7 @@ class VMB1TS(VelbusModule):
                     message=SensorTemperatureRequest()
                 ),
                 SensorTemperature,
+                coalesce=True,
             )
             # Do await the reply, but don't actually use it.
             # The reply will (also) be given to self.message(),
@@ -87,6 +88,7 @@ class VMB1TS(VelbusModule):
                 message=ModuleStatusRequest(),
             ),
             TemperatureSensorStatus,
+            coalesce=True,
         )
 
         return sanic.response.json(sensor_status.message.set_temperature)
@@ -99,6 +101,7 @@ class VMB1TS(VelbusModule):
                     message=ModuleStatusRequest(),
                 ),
                 TemperatureSensorStatus,
+                coalesce=True,
             )
             # Do await the reply, but don't actually use it.
             # The reply will (also) be given to self.message(),
@@ -109,6 +109,7 @@ class VMB4DCChannel(VelbusModuleChannel):
                 ),
                 DimmercontrollerStatus,
                 additional_check=(lambda vbm: vbm.message.channel == self.channel),
+                coalesce=True,
             )
             # Do await the reply, but don't actually use it.
             # The reply will (also) be given to self.message(),
@@ -159,7 +160,8 @@ class VMB4DCChannel(VelbusModuleChannel):
 
     async def delayed_call(self, dim_step: DimStep) -> typing.Any:
         bus = VelbusDelayedHttpProtocol(original_timestamp=HttpApi.sanic_request_datetime.get(),
-                                        request=HttpApi.sanic_request.get())
+                                        request=HttpApi.sanic_request.get(),
+                                        velbus=self.velbus)
         _ = await bus.velbus_query(
             VelbusFrame(
                 address=self.address,
@@ -120,6 +120,7 @@ class VMB4RYNOChannel(VelbusModuleChannel):
                 RelayStatus,
                 additional_check=(lambda vbm: vbm.message.channel == self.channel),
                 # ^^^ Index decoding is done in RelayStatus
+                coalesce=True,
             )
             # Do await the reply, but don't actually use it.
             # The reply will (also) be given to self.message(),
@@ -205,7 +206,8 @@ class VMB4RYNOChannel(VelbusModuleChannel):
 
     async def delayed_call(self, relay_step: RelayStep) -> typing.Any:
         bus = VelbusDelayedHttpProtocol(original_timestamp=HttpApi.sanic_request_datetime.get(),
-                                        request=HttpApi.sanic_request.get())
+                                        request=HttpApi.sanic_request.get(),
+                                        velbus=self.velbus)
         if isinstance(relay_step.status, bool):
             message = SwitchRelay(
                 command=SwitchRelay.Command.SwitchRelayOn if relay_step.status
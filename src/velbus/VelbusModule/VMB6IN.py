@@ -69,6 +69,7 @@ class VMB6INChannel(VelbusModuleChannel):
                     ),
                 ),
                 ModuleStatus6IN,
+                coalesce=True,
             )
             # Do await the reply, but don't actually use it.
             # The reply will (also) be given to self.message(),
@@ -89,6 +89,7 @@ class VMBBLEChannel(VelbusModuleChannel):
                 ),
                 BlindStatusV2,
                 additional_check=(lambda vbm: vbm.message.channel == self.channel),
+                coalesce=True,
             )
             # Do await the reply, but don't actually use it.
             # The reply will (also) be given to self.message(),
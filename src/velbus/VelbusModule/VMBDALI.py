@@ -81,7 +81,8 @@ class VMBDALIChannel(VelbusModuleChannel):
 
     async def delayed_call(self, dim_step: DimStep) -> typing.Any:
         bus = VelbusDelayedHttpProtocol(original_timestamp=HttpApi.sanic_request_datetime.get(),
-                                        request=HttpApi.sanic_request.get())
+                                        request=HttpApi.sanic_request.get(),
+                                        velbus=self.velbus)
         _ = await bus.process_message(
             VelbusFrame(
                 address=self.address,
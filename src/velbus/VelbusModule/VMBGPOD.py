@@ -58,6 +58,7 @@ class VMBGPOD(VelbusModule):
                     message=SensorTemperatureRequest(),
                 ),
                 SensorTemperature,
+                coalesce=True,
             )
             # do await, but don't actually use the value
             # by the time we get here, message() will have populated the cache
@@ -84,6 +85,7 @@ class VMBGPOD(VelbusModule):
                 message=ModuleStatusRequest(),
             ),
             TemperatureSensorStatus,
+            coalesce=True,
         )
 
         return sanic.response.json(sensor_status.message.set_temperature)
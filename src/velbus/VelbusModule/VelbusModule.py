@@ -14,6 +14,7 @@ import sanic.request
 import sortedcontainers
 
 from ..VelbusProtocol import VelbusProtocol
+from ..VelbusBus import default_bus
 from ..VelbusMessage.VelbusFrame import VelbusFrame
 from ..VelbusMessage.ModuleInfo.ModuleInfo import ModuleInfo
 from ..JsonPatchDict import JsonPatchDict
@@ -141,6 +142,8 @@ class VelbusModule:
         :raises ValueError if this class is unwilling to handle the given address/module_info
         """
         self.address = address
+        self.velbus = bus.velbus if bus is not None else default_bus
+        """The bus this module is on (unlike `bus`, this doesn't change per request)"""
 
         self._state = JsonPatchDict()
         # state is synced to MQTT and via WebSockets to JavaScript clients
@@ -1,9 +1,17 @@
 import asyncio
+import collections
 import datetime
 import inspect
 import logging
 import typing
 
+import attr
+
+from .RxBuffer import RxBuffer
+from .FrameCache import FrameCache
+from .FrameFilter import FrameFilter
+from .TransmitQueue import TransmitQueue
+from .VelbusBus import VelbusBus, default_bus
 from .VelbusMessage.VelbusFrame import VelbusFrame
 from .VelbusMessage.BusActive import BusActive
 from .VelbusMessage.BusOff import BusOff
@@ -29,18 +37,53 @@ def format_sockaddr(sockaddr):
         raise TypeError("Unknown sockaddr format: {}".format(sockaddr))
 
 
+def _callable_key(f: typing.Callable) -> typing.Hashable:
+    """
+    Lambda's are re-created on every call, e.g.
+        additional_check=(lambda vbm: vbm.message.channel == self.channel)
+    Consider functions with the same code and the same captured variables
+    as equal.
+    """
+    try:
+        return (
+            f.__code__,
+            f.__defaults__,
+            tuple(id(cell.cell_contents) for cell in f.__closure__ or ()),
+        )
+    except (AttributeError, ValueError):
+        return f
+
+
+@attr.s(slots=True, auto_attribs=True)
+class PendingQuery:
+    reply: asyncio.Future
+    additional_check: typing.Callable[[VelbusFrame], bool]
+
+
 class VelbusProtocol(asyncio.Protocol):
-    serial_client: 'VelbusProtocol' = None
-    tcp_clients: 'typing.Set[VelbusProtocol]' = set()
-    listeners = set()
+    frame_cache = FrameCache()
+    """Received frames are shared (and frozen) via this cache, for all buses"""
 
-    def __init__(self, client_id: str):
+    def __init__(self, client_id: str, velbus: VelbusBus = None):
+        """
+        :param velbus: The bus this connection belongs to (default: `default_bus`)
+        """
         super().__init__()
         self.client_id = client_id
+        self.velbus = velbus if velbus is not None else default_bus
+
+    @property
+    def source(self) -> str:
+        """
+        The origin of our frames, for fair queuing on the serial port (see
+        TransmitQueue). This must be stable across requests: the connection
+        or subsystem, not the individual request.
+        """
+        return self.client_id
 
     def connection_made(self, transport):
         self.transport = transport
-        self.rx_buf = bytearray()
+        self.rx_buf = RxBuffer()
         logger.info("{p} : new connection".format(
             p=self.client_id
         ))
@@ -54,7 +97,7 @@ class VelbusProtocol(asyncio.Protocol):
     def data_received(self, data: bytearray):
         logger.debug("{cid} : Buf=[{b}], Rx=[{d}]".format(
             cid=self.client_id,
-            b=' '.join(["{:02x}".format(b) for b in self.rx_buf]),
+            b=' '.join(["{:02x}".format(b) for b in self.rx_buf.peek()]),
             d=' '.join(["{:02x}".format(b) for b in data])
         ))
         self.rx_buf.extend(data)
@@ -62,23 +105,48 @@ class VelbusProtocol(asyncio.Protocol):
         asyncio.ensure_future(self.try_decode())
         # reading will be resumed at the end of try_decode()
 
-    async def try_decode(self):
+    def next_frame(self) -> typing.Optional[bytes]:
+        """
+        Remove the next complete frame from the receive buffer. Only the
+        framing is checked (see VelbusFrame.frame_length()), the message is
+        not decoded. Invalid bytes are skipped.
+
+        :return: the raw frame, or None if no complete frame is available
+        """
         while self.rx_buf:
             try:
-                vbm = VelbusFrame.from_bytes(self.rx_buf)
-
-                await self.process_message(vbm)
+                length = VelbusFrame.frame_length(self.rx_buf.buf, self.rx_buf.offset)
 
             except BufferError:
                 break
 
             except ValueError as e:
-                logger.warning("{cid} : Invalid message, discarding 1 byte (0x{b:02x}): {e}".format(
-                    cid=self.client_id, b=self.rx_buf[0],
+                discarded = self.rx_buf.resync()
+                logger.warning("{cid} : Invalid message, discarding {n} byte(s) [{b}{more}]: {e}".format(
+                    cid=self.client_id, n=len(discarded),
+                    b=' '.join(["{:02x}".format(b) for b in discarded[0:16]]),
+                    more=' ...' if len(discarded) > 16 else '',
                     e=e,
                 ))
-                del self.rx_buf[0:1]
                 continue
+
+            return self.rx_buf.consume(length)
+
+        return None
+
+    async def try_decode(self):
+        while True:
+            raw = self.next_frame()
+            if raw is None:
+                break
+
+            vbm = self.frame_cache.from_bytes(raw, self.velbus.decoding_context)
+
+            await self.process_message(vbm)
+
+        self._resume_reading()
+
+    def _resume_reading(self) -> None:
         self.transport.resume_reading()
 
     async def process_message(self, vbm: VelbusFrame):
@@ -97,83 +165,234 @@ class VelbusProtocol(asyncio.Protocol):
         return await self.relay_message(vbm)
 
     async def relay_message(self, vbm: VelbusFrame):
-        data = vbm.to_bytes()
-
         # Order of relaying logic:
-        #  - Serial first. Serial is the slowest output. Send there first
-        #    so by the time that the rest is sent, Serial is hopefully done by then
+        #  - Serial first. Serial is the slowest output. The frame is queued
+        #    there, and sent out at the pace of the bus (see
+        #    VelbusSerialProtocol.transmit()), without holding up the rest
         #  - TCP next
         #  - listeners (potentially even async)
+        self.relay_raw(vbm.to_bytes())
+        self.dispatch(vbm)
+
+    def relay_raw(self, data: bytes) -> None:
+        """
+        Forward the (valid) frame `data` to the serial port and the TCP
+        clients, without decoding it. The frame is captured as well, if
+        enabled (see VelbusBus.capture).
+        """
+        velbus = self.velbus
+        if velbus.capture is not None:
+            velbus.capture.write(data, self.client_id)
 
-        if VelbusProtocol.serial_client != self:  # don't loop back
-            VelbusProtocol.serial_client.transport.write(data)
-            await asyncio.sleep(8/9600 * len(data) * 2)
-            # Sleep to make sure we never overflow the USB/RS232-to-Velbus-module's buffer
-            # There is no reliable way to flow-control this:
-            # The module can send an 'Receive buffer full', but by then it's too late
-            # There is no way to know how many bytes/frames can be safely sent without overflowing the buffer
+        if velbus.serial_client is not None and velbus.serial_client != self:  # don't loop back
+            velbus.serial_client.transmit(data, self.source)
 
-        for c in VelbusProtocol.tcp_clients:
+        for c in velbus.tcp_clients:
             if c != self:  # Don't loop back
-                c.transport.write(data)
+                c.send(data)
 
-        for l in VelbusProtocol.listeners:
+    def dispatch(self, vbm: VelbusFrame) -> None:
+        """
+        Pass `vbm` to the listeners, and to the queries waiting for it
+        """
+        for l in self.velbus.listeners:
             _ = l(vbm)
             if inspect.isawaitable(_):
                 asyncio.ensure_future(_)
 
+        self.match_pending_queries(vbm)
+
+    def match_pending_queries(self, vbm: VelbusFrame) -> None:
+        """
+        Complete the queries waiting for `vbm`. Only the queries for this
+        address and (a superclass of) this message type are checked.
+        """
+        by_type = self.velbus.pending_queries.get(vbm.address)
+        if not by_type:
+            return  # don't even decode the message
+        for cls in type(vbm.message).__mro__:
+            for query in by_type.get(cls, ()):
+                if not query.reply.done() and query.additional_check(vbm):
+                    query.reply.set_result(vbm)
+
     async def velbus_query(self,
                            question: VelbusFrame,
                            response_type: type,
                            response_address: int = None,
                            timeout: float = 2,
-                           additional_check=(lambda vbm: True)):
+                           additional_check=(lambda vbm: True),
+                           coalesce: bool = False):
         """
         Send a message on the bus and expect an answer
 
+        The number of queries in flight (per address and in total) is
+        limited by the bus' `query_scheduler`: queries over the limit wait for their
+        turn before the question is sent. If the answer arrives in the mean
+        time, the question is not sent at all.
+
+        With `coalesce`, if an identical query (same question, same expected
+        response) is already in progress, no new question is sent: this call
+        shares the outcome of the running query instead. Only use this for
+        questions about state (e.g. ModuleStatusRequest), never for commands:
+        a repeated command must be sent again.
+
+        Waiting for a turn and for the question to leave the transmit queue
+        counts on top of `timeout`: together they are limited to
+        `query_scheduler.max_wait`, so a call can take up to
+        `query_scheduler.max_wait` + `timeout` before it raises TimeoutError.
+        A call that shares a running query gives up after that time as well,
+        counted from its own start.
+
         :param question: The message to send (or None if nothing is to be sent)
         :param response_type: The type of message expected as response (probably a subclass of VelbusMessage)
         :param response_address: Override of the response address (defaults to the address the `question` is sent to)
-        :param timeout: Timeout in seconds
+        :param timeout: Timeout in seconds, from sending the question to receiving the reply.
+                        Modules that usually answer quickly get a shorter
+                        timeout, based on their round-trip times (see
+                        QueryScheduler.timeout_for())
         :param additional_check: Additional callable to filter the message
+        :param coalesce: Share the outcome of an identical query in progress
         :return: The message
         :raises: TimeoutError
         """
         if response_address is None:
             response_address = question.address
 
-        reply: asyncio.Future = asyncio.get_event_loop().create_future()
+        if question is None or not coalesce:
+            return await self._velbus_query(question, response_type, response_address, timeout, additional_check,
+                                            coalesce)
+
+        velbus = self.velbus
+        key = (bytes(question.to_bytes()), response_type, response_address, _callable_key(additional_check))
+        shared = velbus.in_flight_queries.get(key)
+        if shared is None:
+            shared = asyncio.ensure_future(self._velbus_query(
+                question, response_type, response_address, timeout, additional_check, coalesce))
+            velbus.in_flight_queries[key] = shared
+
+            def done(f):
+                if velbus.in_flight_queries.get(key) is f:
+                    del velbus.in_flight_queries[key]
+                if not f.cancelled():
+                    f.exception()  # don't warn when all callers gave up already
+            shared.add_done_callback(done)
+        else:
+            velbus.coalesced_queries += 1
 
-        def message_filter(vbm: VelbusFrame):
-            if vbm.address == response_address and \
-                    isinstance(vbm.message, response_type) and \
-                    additional_check(vbm):
-                if not reply.done():
-                    reply.set_result(vbm)
-
-        self.listeners.add(message_filter)
+        try:
+            return await asyncio.wait_for(asyncio.shield(shared), velbus.query_scheduler.max_wait + timeout)
+            # shield(): the query must continue when one of the callers is cancelled
+        except asyncio.TimeoutError:
+            raise TimeoutError()
 
-        if question is not None:
-            await self.process_message(question)
+    async def _velbus_query(self,
+                            question: VelbusFrame,
+                            response_type: type,
+                            response_address: int,
+                            timeout: float,
+                            additional_check,
+                            coalesce: bool) -> VelbusFrame:
+        query = PendingQuery(
+            reply=asyncio.get_event_loop().create_future(),
+            additional_check=additional_check,
+        )
+        pending_queries = self.velbus.pending_queries
+        queries = pending_queries.setdefault(response_address, {}).setdefault(response_type, [])
+        queries.append(query)
 
+        scheduler = self.velbus.query_scheduler
+        loop = asyncio.get_event_loop()
         try:
-            await asyncio.wait_for(reply, timeout)
-            return reply.result()
+            if question is None:
+                await asyncio.wait_for(query.reply, timeout)
+                return query.reply.result()
+
+            start = loop.time()
+            deadline = start + scheduler.max_wait
+            await asyncio.wait_for(scheduler.acquire(question.address), scheduler.max_wait)
+            sent = None
+            try:
+                scheduler.add_wait(loop.time() - start)
+                if coalesce and query.reply.done():
+                    return query.reply.result()  # answered while we were waiting
+                    # (a command is sent anyway, it may do something again)
+
+                serial = self.velbus.serial_client
+                if isinstance(serial, VelbusSerialProtocol):
+                    sent = serial.when_sent(bytes(question.to_bytes()))
+                await self.process_message(question)
+                if sent is not None and not sent.done():
+                    # The time spent in the transmit queue counts neither
+                    # towards the timeout nor the round-trip time
+                    await asyncio.wait({sent, query.reply}, timeout=max(deadline - loop.time(), 0),
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    if query.reply.done():
+                        return query.reply.result()  # answered before our question went out
+                    if not sent.done():
+                        raise asyncio.TimeoutError()
+
+                sent_at = loop.time()
+                try:
+                    await asyncio.wait_for(query.reply, scheduler.timeout_for(question.address, timeout))
+                except asyncio.TimeoutError:
+                    scheduler.timed_out(question.address)
+                    raise
+                scheduler.add_round_trip(question.address, loop.time() - sent_at)
+                return query.reply.result()
+            finally:
+                if sent is not None:
+                    sent.cancel()
+                scheduler.release(question.address)
         except asyncio.TimeoutError:
             raise TimeoutError()
         finally:
-            self.listeners.remove(message_filter)
+            queries.remove(query)
+            if not queries:
+                by_type = pending_queries[response_address]
+                del by_type[response_type]
+                if not by_type:
+                    del pending_queries[response_address]
 
 
 class VelbusTcpProtocol(VelbusProtocol):
-    def __init__(self):
-        super().__init__(client_id="will be overridden at connect")
+    # Frames for a client that can't keep up (the transport called
+    # pause_writing()) are queued, up to `output_queue_size` frames. When
+    # the queue overflows, `output_policy` decides what happens:
+    #  - 'drop-oldest': drop the oldest queued frame
+    #  - 'drop-lowest-priority': drop the least urgent frame (the oldest one
+    #    if there are several)
+    #  - 'disconnect': drop the oldest queued frame, and disconnect the client
+    #    if it stays blocked for `backpressure_timeout` seconds
+    OUTPUT_POLICIES = ('drop-oldest', 'drop-lowest-priority', 'disconnect')
+    output_queue_size: int = 256
+    output_policy: str = 'drop-oldest'
+    backpressure_timeout: float = 10.
+    raw_relay: bool = True
+    """Relay received frames without waiting for them to be decoded, see data_received()"""
+    max_line_length: int = 1024
+    """Maximum length of an in-band control line (see FrameFilter)"""
+
+    def __init__(self, velbus: VelbusBus = None):
+        super().__init__(client_id="will be overridden at connect", velbus=velbus)
+        self.output_queue = collections.deque()
+        self.writing_paused = False
+        self.backpressure_handle: asyncio.Handle = None
+        self.received: typing.List[bytes] = []
+        """Frames that are relayed, but not dispatched yet (see data_received())"""
+        self.dispatch_handle: asyncio.Handle = None
+        self.frame_filter: FrameFilter = None
+        """Only frames matching this filter are sent to the client (None: all frames)"""
+        self.sent_frames = 0
+        self.queued_frames = 0
+        self.dropped_frames = 0
+        self.relayed_frames = 0
+        self.filtered_frames = 0
 
     def connection_made(self, transport):
         self.client_id = "TCP:" + format_sockaddr(transport.get_extra_info('peername'))
         super().connection_made(transport)
-        VelbusProtocol.tcp_clients.add(self)
-        if VelbusProtocol.serial_client.paused:
+        self.velbus.tcp_clients.add(self)
+        if self.velbus.serial_client is not None and self.velbus.serial_client.readers_paused:
             asyncio.get_event_loop().call_soon(self.transport.pause_reading)
             # BUG: this doesn't seem to work if it is called right now:
             # The transport does report being paused (._paused == True), but data_received() is called anyway
@@ -181,41 +400,363 @@ class VelbusTcpProtocol(VelbusProtocol):
 
     def connection_lost(self, exc):
         super().connection_lost(exc)
-        VelbusProtocol.tcp_clients.remove(self)
+        self.velbus.tcp_clients.remove(self)
+        if self.backpressure_handle is not None:
+            self.backpressure_handle.cancel()
+            self.backpressure_handle = None
+        self.output_queue.clear()
+        if self.dispatch_handle is not None:
+            self.dispatch_handle.cancel()
+            self._dispatch_received()
+
+    def _resume_reading(self) -> None:
+        """
+        Don't undo the pause of _update_readers() while the serial port can't keep up
+        """
+        if self.velbus.serial_client is not None and self.velbus.serial_client.readers_paused:
+            return  # resumed by the serial port's _update_readers()
+        super()._resume_reading()
+
+    def next_frame(self) -> typing.Optional[bytes]:
+        """
+        Handle in-band control lines (see FrameFilter) in front of the next frame
+        """
+        rx_buf = self.rx_buf
+        prefix = FrameFilter.PREFIX
+        while rx_buf:
+            start = rx_buf.offset
+            if rx_buf.buf[start:(start + len(prefix))] != prefix[0:len(rx_buf)]:
+                break  # not a control line
+
+            end = rx_buf.buf.find(b'\n', start)
+            if end == -1:
+                if len(rx_buf) > self.max_line_length:
+                    break  # garbage, will be discarded
+                return None  # wait for the rest of the line
+
+            self.set_filter(rx_buf.consume(end + 1 - start).decode('ascii', errors='replace'))
+
+        return super().next_frame()
+
+    def set_filter(self, line: str) -> None:
+        try:
+            frame_filter = FrameFilter.parse(line)
+        except ValueError as e:
+            logger.warning("{cid} : Invalid filter `{l}`, ignoring: {e}".format(
+                cid=self.client_id, l=line.strip(), e=e,
+            ))
+            return
+
+        self.frame_filter = frame_filter
+        logger.info("{cid} : filter set: `{l}`".format(
+            cid=self.client_id, l=line.strip(),
+        ))
+
+    def data_received(self, data: bytearray):
+        """
+        TCP clients mostly talk to the serial port (and to each other), so
+        complete frames are relayed right away, based on the framing alone.
+        Decoding (and logging, listeners, ...) is done afterwards, in a
+        separate callback, so it does not add latency to the relaying.
+        """
+        if not self.raw_relay:
+            return super().data_received(data)
+
+        self.rx_buf.extend(data)
+        while True:
+            raw = self.next_frame()
+            if raw is None:
+                break
+            self.relay_raw(raw)
+            self.received.append(raw)
+            self.relayed_frames += 1
+
+        if self.received and self.dispatch_handle is None:
+            self.dispatch_handle = asyncio.get_event_loop().call_soon(self._dispatch_received)
+
+    def _dispatch_received(self) -> None:
+        self.dispatch_handle = None
+        received, self.received = self.received, []
+        for raw in received:
+            vbm = self.frame_cache.from_bytes(raw, self.velbus.decoding_context)
+            logger.info("{cid} : VBM: [{m}]".format(
+                cid=self.client_id,
+                m=' '.join(['{:02x}'.format(b) for b in raw]),
+            ))
+            logger.debug("%s : VBM: %r", self.client_id, vbm)
+            self.dispatch(vbm)
+
+    def send(self, data: bytes) -> None:
+        """
+        Send `data` to this client, or queue it if the client is not keeping up.
+        Frames that don't match the client's filter are dropped.
+        """
+        if self.frame_filter is not None and not self.frame_filter.matches(data):
+            self.filtered_frames += 1
+            return
+
+        if not self.writing_paused and not self.output_queue:
+            self.transport.write(data)
+            self.sent_frames += 1
+            return
+
+        self.output_queue.append(data)
+        self.queued_frames += 1
+        if len(self.output_queue) > self.output_queue_size:
+            self._drop()
+
+    def _drop(self) -> None:
+        if self.output_policy == 'drop-lowest-priority':
+            # Priority 0 is the most urgent; drop the highest number
+            victim = max(range(len(self.output_queue)),
+                         key=lambda i: (self.output_queue[i][1] & 0x03, -i))
+            del self.output_queue[victim]
+        else:
+            self.output_queue.popleft()
+
+        if self.dropped_frames == 0:
+            logger.warning("{} : client is not keeping up, dropping frames".format(
+                self.client_id,
+            ))
+        self.dropped_frames += 1
 
     def pause_writing(self):
-        logger.warning("{} : buffer full, dropping connection".format(
-            self.client_id,
+        self.writing_paused = True
+        if self.output_policy == 'disconnect' and self.backpressure_handle is None:
+            self.backpressure_handle = asyncio.get_event_loop().call_later(
+                self.backpressure_timeout, self._backpressure_timeout)
+
+    def resume_writing(self):
+        self.writing_paused = False
+        if self.backpressure_handle is not None:
+            self.backpressure_handle.cancel()
+            self.backpressure_handle = None
+
+        while self.output_queue and not self.writing_paused:
+            # write() may call pause_writing() again
+            self.transport.write(self.output_queue.popleft())
+            self.sent_frames += 1
+
+    def _backpressure_timeout(self):
+        self.backpressure_handle = None
+        logger.warning("{} : client blocked for {}s, dropping connection".format(
+            self.client_id, self.backpressure_timeout,
         ))
         self.transport.abort()
 
+    def statistics(self) -> dict:
+        return {
+            'queued': len(self.output_queue),
+            'total_queued': self.queued_frames,
+            'dropped': self.dropped_frames,
+            'sent': self.sent_frames,
+            'relayed': self.relayed_frames,
+            'filtered': self.filtered_frames,
+        }
+
 
 class VelbusSerialProtocol(VelbusProtocol):
-    def __init__(self):
-        super().__init__(client_id="SERIAL")
+    # The serial link runs at 38400 baud, but the bus behind it at 9600 baud.
+    # Frames are spaced out to avoid overflowing the
+    # USB/RS232-to-Velbus-module's buffer. How fast that buffer drains depends
+    # on the load on the bus, and the only feedback is an 'Receive buffer
+    # full' when it's already too late, followed by 'Receive buffer ready'.
+    # So the transmit rate is adapted (additive increase, multiplicative
+    # decrease): it slowly increases with every frame sent, and is cut on
+    # every RxBufFull. The rates at which overflows happened are remembered,
+    # and increases are slowed down close to that rate.
+    tx_initial_rate: float = 9600 / 8 / 2
+    """Transmit rate to start with, in bytes per second"""
+    tx_max_rate: float = 9600 / 10
+    """The bus can't go faster than this (8 data bits + start & stop bit)"""
+    tx_min_rate: float = 9600 / 10 / 16
+    tx_rate_increase: float = 1.
+    """Additive increase (bytes/s) per frame transmitted"""
+    tx_rate_decrease: float = 0.5
+    """Multiplicative decrease on RxBufFull"""
+    tx_pause_timeout: float = 2.
+    """Resume transmitting if no RxBufReady is received within this time (seconds)"""
+    tx_high_water: int = 64
+    """Stop reading from the TCP clients when this many frames are queued..."""
+    tx_low_water: int = 16
+    """... until the queue is drained to this many frames"""
+
+    def __init__(self, velbus: VelbusBus = None):
+        super().__init__(client_id="SERIAL", velbus=velbus)
 
     def connection_made(self, transport):
-        VelbusProtocol.serial_client = self
+        self.velbus.serial_client = self
         self.paused = False
+        self.readers_paused = False
+        """Whether the TCP clients are paused, see _update_readers()"""
+        self.tx_queue = TransmitQueue()
+        self.tx_ready_at = 0.
+        """loop.time() when the previous frame has been transmitted on the bus"""
+        self.tx_handle: asyncio.Handle = None
+        self.tx_frames = 0
+        self.tx_bytes = 0
+        self.tx_rate = self.tx_initial_rate
+        self.tx_overflow_rate: float = None
+        """Learned rate at which the interface's buffer overflows (moving average)"""
+        self.tx_overflows = 0
+        self.pause_handle: asyncio.Handle = None
+        self.sent_waiters: typing.Dict[bytes, typing.List[asyncio.Future]] = {}
+        """frame -> futures to complete when it is written, see when_sent()"""
         super().connection_made(transport)
 
     def connection_lost(self, exc):
         super().connection_lost(exc)
-        VelbusProtocol.serial_client = None
-        asyncio.get_event_loop().stop()
+        for handle in (self.tx_handle, self.pause_handle):
+            if handle is not None:
+                handle.cancel()
+        self.tx_handle = self.pause_handle = None
+        if self.tx_queue:
+            logger.warning("{cid} : {n} frame(s) not transmitted".format(
+                cid=self.client_id, n=len(self.tx_queue),
+            ))
+            self.tx_queue.clear()
+        for waiters in self.sent_waiters.values():
+            for f in waiters:
+                f.cancel()
+        self.sent_waiters.clear()
+        self.velbus.serial_client = None
+        self.velbus.close("serial connection lost")
+
+    def transmit(self, data: bytes, source: str = None) -> None:
+        """
+        Queue `data` for transmission on the bus. Returns immediately: frames
+        are written out one by one, paced at `tx_rate`, most urgent priority
+        first (see TransmitQueue).
+
+        :param source: client_id of the originator, for fair queuing
+        """
+        self.tx_queue.put(data, source, asyncio.get_event_loop().time())
+        if self.tx_handle is None:
+            self._transmit_queued()
+        if len(self.tx_queue) >= self.tx_high_water and not self.readers_paused:
+            self._update_readers()
+
+    def when_sent(self, data: bytes) -> asyncio.Future:
+        """
+        Return a future that completes when `data` leaves the transmit
+        queue and is written to the serial port. Call this before queueing
+        `data` with transmit().
+        """
+        f = asyncio.get_event_loop().create_future()
+        self.sent_waiters.setdefault(data, []).append(f)
+        return f
+
+    def _transmit_queued(self) -> None:
+        self.tx_handle = None
+        loop = asyncio.get_event_loop()
+        while self.tx_queue and not self.paused:
+            # resume_writing() will restart transmission when paused
+            now = loop.time()
+            if self.tx_ready_at > now:
+                self.tx_handle = loop.call_at(self.tx_ready_at, self._transmit_queued)
+                return
+
+            data = self.tx_queue.get(now)
+            self.transport.write(data)
+            if self.sent_waiters:
+                for f in self.sent_waiters.pop(bytes(data), ()):
+                    if not f.done():
+                        f.set_result(None)
+            self.tx_ready_at = now + len(data) / self.tx_rate
+            self.tx_frames += 1
+            self.tx_bytes += len(data)
+
+            increase = self.tx_rate_increase
+            if self.tx_overflow_rate is not None and self.tx_rate > 0.9 * self.tx_overflow_rate:
+                increase /= 10  # carefully probe around the learned limit
+            self.tx_rate = min(self.tx_rate + increase, self.tx_max_rate)
+
+        if self.readers_paused and len(self.tx_queue) <= self.tx_low_water:
+            self._update_readers()
+
+    def _update_readers(self) -> None:
+        """
+        Pause reading from the TCP clients while we can't transmit, or while
+        the queue is above the high water mark, so a fast client can't fill
+        up memory. The queue then drains to the low water mark before reading
+        resumes.
+        """
+        if self.paused:
+            should_pause = True
+        elif self.readers_paused:
+            should_pause = len(self.tx_queue) > self.tx_low_water
+        else:
+            should_pause = len(self.tx_queue) >= self.tx_high_water
+        if should_pause == self.readers_paused:
+            return
+
+        self.readers_paused = should_pause
+        logger.warning("{cid} : {a} reading from TCP clients ({n} frames queued)".format(
+            cid=self.client_id, a="pausing" if should_pause else "resuming", n=len(self.tx_queue),
+        ))
+        for c in self.velbus.tcp_clients:
+            if should_pause:
+                c.transport.pause_reading()
+            else:
+                c.transport.resume_reading()
+
+    def rx_buf_full(self) -> None:
+        """
+        The interface reported its receive buffer is full: we were sending
+        too fast. Back off, and stop sending until it's ready again.
+        """
+        if self.tx_overflow_rate is None:
+            self.tx_overflow_rate = self.tx_rate
+        else:
+            self.tx_overflow_rate = 0.75 * self.tx_overflow_rate + 0.25 * self.tx_rate
+        self.tx_rate = max(self.tx_rate * self.tx_rate_decrease, self.tx_min_rate)
+        self.tx_overflows += 1
+        logger.info("{cid} : transmit rate lowered to {r:.0f} B/s (overflow at ~{o:.0f} B/s)".format(
+            cid=self.client_id, r=self.tx_rate, o=self.tx_overflow_rate,
+        ))
+
+        self.pause_writing()
+        if self.pause_handle is not None:
+            self.pause_handle.cancel()
+        self.pause_handle = asyncio.get_event_loop().call_later(
+            self.tx_pause_timeout, self.rx_buf_ready)
+
+    def rx_buf_ready(self) -> None:
+        if self.pause_handle is not None:
+            self.pause_handle.cancel()
+            self.pause_handle = None
+        if not self.paused:
+            return
+        self.resume_writing()
+        if self.tx_handle is None:
+            self._transmit_queued()
+
+    def statistics(self) -> dict:
+        return {
+            'queued': len(self.tx_queue),
+            'frames': self.tx_frames,
+            'bytes': self.tx_bytes,
+            'paused': self.paused,
+            'readers_paused': self.readers_paused,
+            'rate': self.tx_rate,
+            'overflow_rate': self.tx_overflow_rate,
+            'overflows': self.tx_overflows,
+            'lanes': self.tx_queue.statistics(),
+        }
 
     async def process_message(self, vbm: VelbusFrame):
         if isinstance(vbm.message, RxBufFull):
-            self.pause_writing()
+            self.rx_buf_full()
+            self.relay_raw(vbm.to_bytes())  # let daemons connected via --upstream back off as well
             return
         elif isinstance(vbm.message, RxBufReady):
-            self.resume_writing()
+            self.rx_buf_ready()
+            self.relay_raw(vbm.to_bytes())
             return
         elif isinstance(vbm.message, BusOff):
             # we lost connectivity to the bus. Things may have changed beyond your imagination.
-            logger.warning("{} : bus off, exitting...".format(self.client_id))
-            asyncio.get_event_loop().stop()
-            # TODO: make this better
+            logger.warning("{} : bus off, closing...".format(self.client_id))
+            self.transport.close()  # connection_lost() closes the bus
         elif isinstance(vbm.message, BusActive):
             pass
 
@@ -226,35 +767,155 @@ class VelbusSerialProtocol(VelbusProtocol):
             self.client_id,
         ))
         self.paused = True
-        for c in VelbusProtocol.tcp_clients:
-            c.transport.pause_reading()
-            c.transport.pause_reading()
+        self._update_readers()
 
     def resume_writing(self):
         logger.warning("{} : buffer OK, resuming writes".format(
             self.client_id,
         ))
         self.paused = False
-        for c in VelbusProtocol.tcp_clients:
-            c.transport.resume_reading()
+        self._update_readers()
+
+
+class VelbusUpstreamProtocol(VelbusProtocol):
+    """
+    Connection to the TCP port of another daemon, which owns the serial
+    port. Takes the place of the serial client: frames to send on the bus
+    are forwarded to the upstream daemon, which does the pacing.
+
+    Our TCP clients are paused while the upstream daemon can't keep up:
+    when the connection to it is congested, and after its interface reported
+    RxBufFull (until RxBufReady, or `tx_pause_timeout`).
+    """
+    tx_pause_timeout: float = VelbusSerialProtocol.tx_pause_timeout
+
+    def __init__(self, velbus: VelbusBus = None):
+        super().__init__(client_id="will be overridden at connect", velbus=velbus)
+
+    def connection_made(self, transport):
+        self.client_id = "UPSTREAM:" + format_sockaddr(transport.get_extra_info('peername'))
+        self.velbus.serial_client = self
+        self.paused = False
+        """Whether the upstream's interface reported RxBufFull"""
+        self.writing_paused = False
+        """Whether the connection to the upstream is congested"""
+        self.readers_paused = False
+        self.pause_handle: asyncio.Handle = None
+        self.tx_frames = 0
+        self.tx_bytes = 0
+        self.tx_overflows = 0
+        super().connection_made(transport)
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        if self.pause_handle is not None:
+            self.pause_handle.cancel()
+            self.pause_handle = None
+        self.velbus.serial_client = None
+        self.velbus.close("upstream connection lost")
+
+    def transmit(self, data: bytes, source: str = None) -> None:
+        del source  # unused, the upstream daemon does the scheduling
+        self.transport.write(data)
+        self.tx_frames += 1
+        self.tx_bytes += len(data)
+
+    def pause_writing(self):
+        self.writing_paused = True
+        self._update_readers()
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self._update_readers()
+
+    def _update_readers(self) -> None:
+        """
+        Pause reading from our TCP clients while the upstream can't keep up
+        """
+        should_pause = self.paused or self.writing_paused
+        if should_pause == self.readers_paused:
+            return
+
+        self.readers_paused = should_pause
+        logger.warning("{cid} : {a} reading from TCP clients".format(
+            cid=self.client_id, a="pausing" if should_pause else "resuming",
+        ))
+        for c in self.velbus.tcp_clients:
+            if should_pause:
+                c.transport.pause_reading()
+            else:
+                c.transport.resume_reading()
+
+    def rx_buf_full(self) -> None:
+        self.tx_overflows += 1
+        self.paused = True
+        self._update_readers()
+        if self.pause_handle is not None:
+            self.pause_handle.cancel()
+        self.pause_handle = asyncio.get_event_loop().call_later(
+            self.tx_pause_timeout, self.rx_buf_ready)
+
+    def rx_buf_ready(self) -> None:
+        if self.pause_handle is not None:
+            self.pause_handle.cancel()
+            self.pause_handle = None
+        self.paused = False
+        self._update_readers()
+
+    async def process_message(self, vbm: VelbusFrame):
+        if isinstance(vbm.message, RxBufFull):
+            self.rx_buf_full()
+            self.relay_raw(vbm.to_bytes())
+            return
+        elif isinstance(vbm.message, RxBufReady):
+            self.rx_buf_ready()
+            self.relay_raw(vbm.to_bytes())
+            return
+
+        await super().process_message(vbm)
+
+    def statistics(self) -> dict:
+        return {
+            'upstream': self.client_id,
+            'frames': self.tx_frames,
+            'bytes': self.tx_bytes,
+            'paused': self.paused,
+            'writing_paused': self.writing_paused,
+            'readers_paused': self.readers_paused,
+            'overflows': self.tx_overflows,
+        }
 
 
 class VelbusHttpProtocol(VelbusProtocol):
-    def __init__(self, request):
+    def __init__(self, request, velbus: VelbusBus = None):
         super().__init__(client_id="HTTP:{ip}:{port}{path}".format(
             ip=request.ip,
             port=request.port,
             path=request.path
-        ))
+        ), velbus=velbus)
+
+    @property
+    def source(self) -> str:
+        return "HTTP"  # all requests share a turn
 
 
 class VelbusDelayedProtocol(VelbusProtocol):
     def __init__(self, original_protocol: VelbusProtocol):
         super().__init__(client_id=f"DELAYED<{datetime.datetime.utcnow().isoformat()}>"
-                         f":{original_protocol.client_id}")
+                         f":{original_protocol.client_id}",
+                         velbus=original_protocol.velbus)
+
+    @property
+    def source(self) -> str:
+        return "DELAYED"
 
 
 class VelbusDelayedHttpProtocol(VelbusProtocol):
-    def __init__(self, original_timestamp: datetime.datetime, request):
+    def __init__(self, original_timestamp: datetime.datetime, request, velbus: VelbusBus = None):
         super().__init__(client_id=f"DELAYED<{original_timestamp.isoformat()}>"
-                                   f":HTTP:{request.ip}:{request.port}{request.path}")
+                                   f":HTTP:{request.ip}:{request.port}{request.path}",
+                         velbus=velbus)
+
+    @property
+    def source(self) -> str:
+        return "DELAYED"
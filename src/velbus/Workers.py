@@ -0,0 +1,457 @@
+"""
+HTTP worker processes, see `--workers`.
+
+The main process owns the serial port(s): it is the only one that talks to
+the bus, queries the modules and holds their state. The workers serve the
+HTTP API on the same port (SO_REUSEPORT), without touching the bus:
+
+ - Module requests (`/module/...`) are forwarded to the main process, which
+   handles them like its own requests, and returns the response.
+ - The state of the modules is mirrored to the workers, as JSON Patch
+   operations (see VelbusBus.state_listeners). The workers serve the
+   `/module_state` WebSocket clients from their copy.
+
+The processes talk over a Unix socket, one JSON object per line:
+
+    main -> worker:
+        {"buses": [name, ...]}                          first message, default bus first
+        {"bus": name, "patch": [operation, ...]}        paths start with the hex address
+        {"id": n, "response": {...}}                    reply to a request
+        {"id": n, "timeout": timestamp}                 ... that timed out
+    worker -> main:
+        {"id": n, "bus": name, "handler": name, "args": {...}, "request": {...}}
+
+A worker exits when it loses the connection to the main process. The main
+process restarts workers that exit (see WorkerPool).
+"""
+import asyncio
+import base64
+import datetime
+import functools
+import json
+import logging
+import typing
+
+import attr
+import sanic.exceptions
+import sanic.response
+
+from . import HttpApi
+from .CachedException import CachedTimeoutError
+from .JsonPatchDict import JsonPatch, JsonPatchOperation
+from .VelbusBus import VelbusBus, default_bus, buses
+from .VelbusProtocol import VelbusProtocol
+
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(slots=True, auto_attribs=True)
+class ForwardedRequest:
+    """
+    The parts of a sanic.request.Request that the modules use, for a
+    request forwarded by a worker
+    """
+    method: str
+    path: str
+    headers: typing.Dict[str, str]
+    body: bytes
+    ip: str
+    port: int
+
+    @property
+    def json(self) -> typing.Any:
+        if not self.body:
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            raise sanic.exceptions.InvalidUsage("Failed when parsing body as json")
+
+    def to_json_able(self) -> dict:
+        return {
+            'method': self.method,
+            'path': self.path,
+            'headers': self.headers,
+            'body': base64.b64encode(self.body).decode('ascii'),
+            'ip': self.ip,
+            'port': self.port,
+        }
+
+    @classmethod
+    def from_json_able(cls, o: dict) -> 'ForwardedRequest':
+        return cls(
+            method=o['method'],
+            path=o['path'],
+            headers=o['headers'],
+            body=base64.b64decode(o['body']),
+            ip=o['ip'],
+            port=o['port'],
+        )
+
+    @classmethod
+    def from_request(cls, request: sanic.request) -> 'ForwardedRequest':
+        return cls(
+            method=request.method,
+            path=request.path,
+            headers={k.lower(): v for k, v in request.headers.items()},
+            body=request.body or b'',
+            ip=request.ip,
+            port=request.port,
+        )
+
+
+def encode_response(response: sanic.response.HTTPResponse) -> dict:
+    return {
+        'status': response.status,
+        'content_type': response.headers.get('content-type', getattr(response, 'content_type', None)),
+        'headers': {
+            k: v
+            for k, v in response.headers.items()
+            if k.lower() not in ('content-type', 'content-length')
+        },
+        'body': base64.b64encode(response.body or b'').decode('ascii'),
+    }
+
+
+def decode_response(o: dict) -> sanic.response.HTTPResponse:
+    return sanic.response.raw(
+        base64.b64decode(o['body']),
+        status=o['status'],
+        headers=o['headers'],
+        content_type=o['content_type'],
+    )
+
+
+class JsonLinesProtocol(asyncio.Protocol):
+    """
+    Exchange JSON objects, one per line
+    """
+    def connection_made(self, transport):
+        self.transport = transport
+        self.rx_buf = bytearray()
+
+    def data_received(self, data: bytes):
+        self.rx_buf.extend(data)
+        start = 0
+        while True:
+            end = self.rx_buf.find(b'\n', start)
+            if end < 0:
+                break
+            self.message_received(json.loads(self.rx_buf[start:end]))
+            start = end + 1
+        del self.rx_buf[0:start]
+
+    def send(self, message: dict) -> None:
+        self.send_line(json.dumps(message).encode('utf-8') + b'\n')
+
+    def send_line(self, line: bytes) -> None:
+        self.transport.write(line)
+
+    def message_received(self, message: dict) -> None:
+        raise NotImplementedError()
+
+
+class WorkerServer:
+    """
+    Main process side: accepts the connections of the workers, and sends
+    them the module state of all buses
+    """
+    def __init__(self):
+        self.connections: typing.Set['WorkerConnection'] = set()
+        self.server: asyncio.AbstractServer = None
+        self.listeners: typing.Dict[VelbusBus, typing.Callable] = {}
+
+    async def start(self, path: str) -> None:
+        self.server = await asyncio.get_event_loop().create_unix_server(
+            functools.partial(WorkerConnection, self), path)
+        for velbus in buses.values():
+            self.listeners[velbus] = functools.partial(self.send_patch, velbus)
+            velbus.state_listeners.add(self.listeners[velbus])
+
+    def send_patch(self, velbus: VelbusBus, patch: JsonPatch) -> None:
+        if not self.connections:
+            return
+        line = json.dumps({'bus': velbus.name, 'patch': patch.to_json_able()}).encode('utf-8') + b'\n'
+        # ^^^ encoded right away: the values may change later on
+        for c in self.connections:
+            c.send_line(line)
+
+    async def close(self) -> None:
+        for velbus, listener in self.listeners.items():
+            velbus.state_listeners.discard(listener)
+        self.listeners.clear()
+        self.server.close()
+        await self.server.wait_closed()
+        for c in list(self.connections):
+            c.transport.close()
+
+
+class WorkerConnection(JsonLinesProtocol):
+    """
+    Connection from a single worker, in the main process. Handles the
+    requests the worker forwards.
+    """
+    backpressure_timeout: float = 10.
+    """Drop the worker if it doesn't keep up with the state updates for this long (seconds)"""
+
+    handlers = {
+        'module_req': HttpApi.module_req,
+        'delete_module': HttpApi.delete_module,
+        'delete_modules': HttpApi.delete_modules,
+        'statistics': HttpApi.statistics,
+    }
+
+    _next_number = 1
+
+    def __init__(self, server: WorkerServer):
+        super().__init__()
+        self.server = server
+        self.client_id = "WORKER:{}".format(WorkerConnection._next_number)
+        WorkerConnection._next_number += 1
+        self.backpressure_handle: asyncio.Handle = None
+        self.tasks: typing.Set[asyncio.Future] = set()
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        logger.info("{} : new connection".format(self.client_id))
+
+        self.send({'buses': [default_bus.name] + [name for name in buses if name != default_bus.name]})
+        for velbus in buses.values():
+            for address, mod in velbus.modules.items():
+                if not mod.done() or mod.cancelled() or mod.exception() is not None:
+                    continue
+                self.send({'bus': velbus.name, 'patch': JsonPatch([JsonPatchOperation(
+                    op=JsonPatchOperation.Operation.add,
+                    path=['{:02x}'.format(address)],
+                    value=mod.result().state,
+                )]).to_json_able()})
+        self.server.connections.add(self)
+
+    def connection_lost(self, exc):
+        logger.warning("{} : connection closed".format(self.client_id))
+        self.server.connections.discard(self)
+        if self.backpressure_handle is not None:
+            self.backpressure_handle.cancel()
+            self.backpressure_handle = None
+        for task in self.tasks:
+            task.cancel()
+
+    def pause_writing(self):
+        if self.backpressure_handle is None:
+            self.backpressure_handle = asyncio.get_event_loop().call_later(
+                self.backpressure_timeout, self._backpressure_timeout)
+
+    def resume_writing(self):
+        if self.backpressure_handle is not None:
+            self.backpressure_handle.cancel()
+            self.backpressure_handle = None
+
+    def _backpressure_timeout(self):
+        self.backpressure_handle = None
+        logger.warning("{} : worker blocked for {}s, dropping connection".format(
+            self.client_id, self.backpressure_timeout,
+        ))
+        self.transport.abort()  # its state is stale: it exits, and is restarted
+
+    def message_received(self, message: dict) -> None:
+        task = asyncio.ensure_future(self.handle(message))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handle(self, message: dict) -> None:
+        reply = {'id': message['id']}
+        try:
+            velbus = buses[message['bus']]
+            args = message['args']
+            if message['handler'] == 'get_module':
+                await HttpApi.get_module(VelbusProtocol(client_id=self.client_id, velbus=velbus),
+                                         int(args['address'], 16))
+                reply['response'] = None
+            else:
+                request = ForwardedRequest.from_json_able(message['request'])
+                response = await self.handlers[message['handler']](request, **args, velbus=velbus)
+                reply['response'] = encode_response(response)
+
+        except TimeoutError as e:
+            timestamp = getattr(e, 'timestamp', None)
+            reply['timeout'] = timestamp.isoformat() if timestamp is not None else None
+        except sanic.exceptions.SanicException as e:
+            reply['response'] = encode_response(sanic.response.text(str(e), status=e.status_code))
+        except Exception as e:
+            logger.exception("{} : uncaught exception: {}".format(self.client_id, repr(e)))
+            reply['response'] = encode_response(sanic.response.text("Internal Server Error\r\n", status=500))
+
+        if not self.transport.is_closing():
+            self.send(reply)
+
+
+class WorkerLink(JsonLinesProtocol):
+    """
+    Connection to the main process, in a worker. Keeps a copy of the
+    module state, and forwards requests.
+    """
+    def __init__(self):
+        super().__init__()
+        self.buses: asyncio.Future = asyncio.get_event_loop().create_future()
+        """Names of the buses of the main process, once connected"""
+        self.state: typing.Dict[str, typing.Dict[str, dict]] = {}
+        """bus name -> hex address -> module state"""
+        self.requests: typing.Dict[int, asyncio.Future] = {}
+        self.next_id = 0
+
+    def connection_lost(self, exc):
+        logger.warning("Connection to the main process lost")
+        for f in self.requests.values():
+            if not f.done():
+                f.set_exception(ConnectionError("Connection to the main process lost"))
+        self.requests.clear()
+        for velbus in list(buses.values()):
+            if velbus.owner is self:
+                velbus.close("main process gone")
+
+    def message_received(self, message: dict) -> None:
+        if 'buses' in message:
+            self.buses.set_result(message['buses'])
+        elif 'patch' in message:
+            self.apply(message['bus'], JsonPatch.from_json_able(message['patch']))
+        else:
+            f = self.requests.pop(message['id'], None)
+            if f is not None and not f.done():
+                f.set_result(message)
+
+    def apply(self, bus_name: str, patch: JsonPatch) -> None:
+        patch.apply(self.state.setdefault(bus_name, {}))
+
+        velbus = buses.get(bus_name)
+        if velbus is None or velbus.owner is not self:
+            return  # not set up yet; only the state matters
+        for op in patch:
+            if not op.path:
+                asyncio.ensure_future(HttpApi.forget_modules(velbus))
+            elif op.op == JsonPatchOperation.Operation.remove and len(op.path) == 1:
+                asyncio.ensure_future(HttpApi.forget_module(velbus, int(op.path[0], 16)))
+            else:
+                HttpApi.gen_update_state_cb(int(op.path[0], 16), velbus)(JsonPatch([
+                    JsonPatchOperation(op=op.op, path=op.path[1:], value=op.value),
+                ]))
+
+    async def request(self, velbus: VelbusBus, handler: str, args: dict,
+                      request: typing.Optional[sanic.request.Request] = None) -> dict:
+        """
+        Have the main process run `handler`
+
+        :raises: CachedTimeoutError when the main process timed out
+        """
+        self.next_id += 1
+        message = {
+            'id': self.next_id,
+            'bus': velbus.name,
+            'handler': handler,
+            'args': args,
+        }
+        if request is not None:
+            message['request'] = ForwardedRequest.from_request(request).to_json_able()
+        f = asyncio.get_event_loop().create_future()
+        self.requests[self.next_id] = f
+        self.send(message)
+        reply = await f
+
+        if 'timeout' in reply:
+            e = CachedTimeoutError()
+            if reply['timeout'] is not None:
+                e.timestamp = datetime.datetime.fromisoformat(reply['timeout'])
+            raise e
+        return reply
+
+    async def forward(self, request: sanic.request.Request, velbus: VelbusBus, handler: str,
+                      **args) -> sanic.response.HTTPResponse:
+        reply = await self.request(velbus, handler, args, request)
+        return decode_response(reply['response'])
+
+    async def get_module(self, velbus: VelbusBus, address: int) -> 'RemoteModule':
+        await self.request(velbus, 'get_module', {'address': '{:02x}'.format(address)})
+        return RemoteModule(self, velbus, address)
+
+
+class RemoteModule:
+    """
+    Stand-in for a module in a worker process. The module itself lives in
+    the main process: its state is mirrored by the WorkerLink, and requests
+    are forwarded.
+    """
+    def __init__(self, link: WorkerLink, velbus: VelbusBus, address: int):
+        self.link = link
+        self.velbus = velbus
+        self.address = address
+
+    @property
+    def state(self) -> dict:
+        return self.link.state.get(self.velbus.name, {}).get('{:02x}'.format(self.address), {})
+
+    def message(self, vbm) -> None:
+        pass  # workers don't receive frames
+
+    def dispatch(self, path_info: str, request: sanic.request, bus: VelbusProtocol):
+        return self.link.forward(request, self.velbus, 'module_req',
+                                 address='{:02x}'.format(self.address), module_path=path_info)
+
+
+class WorkerPool:
+    """
+    Runs `count` worker processes, and restarts the ones that exit. A worker
+    that keeps exiting is restarted with exponential back-off.
+    """
+    restart_delay: float = 1.
+    max_restart_delay: float = 60.
+
+    def __init__(self, args: typing.List[str], count: int, env: typing.Mapping[str, str] = None):
+        self.args = args
+        self.count = count
+        self.env = env
+        self.processes: typing.Dict[int, asyncio.subprocess.Process] = {}
+        """worker number -> running process"""
+        self.tasks: typing.List[asyncio.Future] = []
+        self.restarts = 0
+        self.stopping = False
+
+    def start(self) -> None:
+        for number in range(self.count):
+            self.tasks.append(asyncio.ensure_future(self._run(number)))
+
+    async def _run(self, number: int) -> None:
+        loop = asyncio.get_event_loop()
+        delay = self.restart_delay
+        while True:
+            started = loop.time()
+            process = await asyncio.create_subprocess_exec(*self.args, env=self.env)
+            self.processes[number] = process
+            if self.stopping:
+                process.terminate()
+            returncode = await process.wait()
+            del self.processes[number]
+            if self.stopping:
+                return
+
+            if loop.time() - started > self.max_restart_delay:
+                delay = self.restart_delay  # it ran fine for a while
+            logger.warning("Worker {n} (pid {p}) exited with {r}, restarting in {d:.0f}s".format(
+                n=number, p=process.pid, r=returncode, d=delay,
+            ))
+            self.restarts += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_restart_delay)
+
+    async def stop(self) -> None:
+        self.stopping = True
+        processes = list(self.processes.values())
+        for process in processes:
+            try:
+                process.terminate()
+            except ProcessLookupError:
+                pass
+        for process in processes:
+            await process.wait()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -1,7 +1,11 @@
 import argparse
+import functools
 import logging
 import re
+import shutil
 import signal
+import sys
+import tempfile
 import time
 import asyncio
 
@@ -16,10 +20,14 @@ import sanic.response
 
 from .VelbusMessage.VelbusFrame import VelbusFrame
 from .VelbusMessage.InterfaceStatusRequest import InterfaceStatusRequest
-from .VelbusProtocol import VelbusProtocol, VelbusSerialProtocol, VelbusTcpProtocol, format_sockaddr
+from .VelbusProtocol import VelbusProtocol, VelbusSerialProtocol, VelbusTcpProtocol, VelbusUpstreamProtocol, \
+    format_sockaddr
+from .VelbusBus import VelbusBus, default_bus, buses
 from .CachedException import CachedTimeoutError
+from .Capture import CaptureWriter
 from . import HttpApi
 from .mqtt import MqttStateSync
+from .Workers import WorkerServer, WorkerLink, WorkerPool
 
 from .VelbusMessage._registry import command_registry
 from .VelbusMessage.ModuleInfo._registry import module_type_registry
@@ -31,18 +39,54 @@ from .VelbusModule._registry import module_registry
 
 parser = argparse.ArgumentParser(
     description='Velbus communication daemon',
+    epilog="Each bus is closed when its serial port (or upstream) connection is lost. "
+           "The daemon exits when all its buses are closed.",
     formatter_class=argparse.ArgumentDefaultsHelpFormatter,
 )
-parser.add_argument('--tcp-port', help="TCP port to listen on", type=int, default=8445)
+parser.add_argument('--tcp-port', help="TCP port to listen on. Additional buses use the following port numbers",
+                    type=int, default=8445)
+parser.add_argument('--tcp-queue-size', help="Number of frames to queue for slow TCP clients",
+                    type=int, default=VelbusTcpProtocol.output_queue_size)
+parser.add_argument('--tcp-queue-policy', help="What to do when a TCP client's queue is full",
+                    choices=VelbusTcpProtocol.OUTPUT_POLICIES, default=VelbusTcpProtocol.output_policy)
+parser.add_argument('--tcp-backpressure-timeout', help="Disconnect TCP clients that are blocked for this long "
+                                                       "(seconds, with --tcp-queue-policy=disconnect)",
+                    type=float, default=VelbusTcpProtocol.backpressure_timeout)
+parser.add_argument('--http-port', help="HTTP port to listen on", type=int, default=8080)
+parser.add_argument('--workers', help="Number of additional processes serving HTTP on the same port. "
+                                      "They are restarted when they exit",
+                    type=int, default=0)
+parser.add_argument('--worker-of', type=str, default=None,
+                    help="Internal: serve HTTP as a worker of the main process at this Unix socket (see --workers)")
+parser.add_argument('--upstream', type=str, default=None, action='append',
+                    help="Instead of opening a serial port, connect to the TCP port of another instance "
+                         "(`[name=]host:port`, 0 or more)")
 parser.add_argument('--static-dir', help="Directory to serve under /static the API", type=str,
                     default='{}/static'.format(os.path.dirname(__file__)))
 parser.add_argument('--logfile', help="Log to the given file", type=str)
 parser.add_argument('--debug', help="Enable debug mode", action='store_true')
+parser.add_argument('--max-queries-per-module', help="Maximum number of queries waiting for a reply per module",
+                    type=int, default=default_bus.query_scheduler.max_per_address)
+parser.add_argument('--max-queries', help="Maximum number of queries waiting for a reply on the bus",
+                    type=int, default=default_bus.query_scheduler.max_total)
+parser.add_argument('--capture', type=str, default=None,
+                    help="Record all frames to this capture file (see velbus.Capture). "
+                         "Additional buses use `FILE-name`")
+parser.add_argument('--capture-max-bytes', help="Rotate the capture file when it reaches this size (0: never)",
+                    type=int, default=100_000_000)
+parser.add_argument('--capture-backups', help="Number of rotated capture files to keep",
+                    type=int, default=10)
 parser.add_argument('--mqtt', type=str, default=None, action='append',
                     help="MQTT URL & topic prefix to connect to (0 or more). e.g. mqtt://localhost/bus/velbus")
-parser.add_argument('serial_port', help="Serial port to open")
+parser.add_argument('serial_port', nargs='*',
+                    help="Serial port to open. To serve multiple buses, give multiple `name=port` arguments. "
+                         "The first one is the default bus")
 
 args = parser.parse_args()
+if args.upstream is None:
+    args.upstream = []
+if [bool(args.serial_port), bool(args.upstream), bool(args.worker_of)].count(True) != 1:
+    parser.error("Give either serial port(s), --upstream or --worker-of")
 
 
 logging.getLogger(None).setLevel(logging.INFO)
@@ -93,42 +137,128 @@ def handle_sighup():
 
 loop.add_signal_handler(signal.SIGHUP, handle_sighup)
 
-# Connect to serial port
-serial_transport, serial_protocol = loop.run_until_complete(
-    serial_asyncio.create_serial_connection(
-        loop, VelbusSerialProtocol, args.serial_port,
-        baudrate=38400,
-        bytesize=serial.EIGHTBITS,
-        parity=serial.PARITY_NONE,
-        stopbits=serial.STOPBITS_ONE,
-    ))
-try:
-    logger.debug("Old DTR/RTS: {}/{}".format(
-        serial_transport._serial.dtr,
-        serial_transport._serial.rts
-    ))
-    serial_transport._serial.dtr = False  # low
-    serial_transport._serial.rts = True   # high
-    logger.debug("New DTR/RTS: {}/{}".format(
-        serial_transport._serial.dtr,
-        serial_transport._serial.rts
-    ))
-except OSError as e:
-    logger.warning("Could not set DTR/RTS status, trying anyway... ({})".format(str(e)))
-
-# send an interface status request, so we can quit right away if the bus is not active
-internal = VelbusProtocol(client_id="INTERNAL")
-loop.run_until_complete(internal.process_message(VelbusFrame(address=0, message=InterfaceStatusRequest())))
-# The reply will be read as soon as we enter the loop
-
-
-# Start up TCP server
-tcpserver = loop.run_until_complete(
-    loop.create_server(VelbusTcpProtocol, None, args.tcp_port, reuse_port=True))
-logger.info("Listening for TCP on {}".format(
-    format_sockaddr(tcpserver.sockets[0].getsockname())))
-
-if args.mqtt is None:
+VelbusTcpProtocol.output_queue_size = args.tcp_queue_size
+VelbusTcpProtocol.output_policy = args.tcp_queue_policy
+VelbusTcpProtocol.backpressure_timeout = args.tcp_backpressure_timeout
+
+
+def bus_for(bus_index: int, bus_name: str) -> VelbusBus:
+    if bus_index == 0:
+        velbus = default_bus
+        if bus_name:
+            del buses[velbus.name]
+            velbus.name = bus_name
+            buses[velbus.name] = velbus
+        return velbus
+
+    if not bus_name:
+        raise ValueError("Additional buses need a name: `name=...`")
+    if bus_name in buses:
+        raise ValueError(f"Duplicate bus name `{bus_name}`")
+    velbus = VelbusBus(bus_name)
+    buses[velbus.name] = velbus
+    return velbus
+
+
+def bus_closed(velbus: VelbusBus) -> None:
+    """
+    The connection to `velbus` is lost: disconnect its TCP clients, so they
+    notice. The other buses keep running; once all buses are closed, the
+    daemon exits (and can be restarted by e.g. systemd).
+    """
+    for tcp_client in list(velbus.tcp_clients):
+        tcp_client.transport.close()
+    if all(b.closed for b in buses.values()):
+        logger.warning("All buses closed, exiting...")
+        loop.stop()
+
+
+internal_protocols = []
+tcpservers = []
+if args.worker_of:
+    # Worker process: the main process owns the bus(es), and does the querying
+    worker_link = WorkerLink()
+    loop.run_until_complete(loop.create_unix_connection(lambda: worker_link, args.worker_of))
+    for bus_index, bus_name in enumerate(loop.run_until_complete(worker_link.buses)):
+        velbus = bus_for(bus_index, bus_name)
+        velbus.owner = worker_link
+        velbus.close_callbacks.append(bus_closed)
+        internal_protocols.append(VelbusProtocol(client_id="INTERNAL", velbus=velbus))
+
+for bus_index, upstream in enumerate(args.upstream):
+    # The upstream instance owns the serial port, and relays all frames to
+    # us over TCP.
+    bus_name, _, upstream = upstream.rpartition('=')
+    velbus = bus_for(bus_index, bus_name)
+    velbus.close_callbacks.append(bus_closed)
+    host, _, port = upstream.rpartition(':')
+    loop.run_until_complete(loop.create_connection(
+        functools.partial(VelbusUpstreamProtocol, velbus=velbus), host, int(port)))
+    logger.info("Bus {b}: connected to {u}".format(b=velbus.name, u=upstream))
+
+    velbus.query_scheduler.max_per_address = args.max_queries_per_module
+    velbus.query_scheduler.max_total = args.max_queries
+
+    internal_protocols.append(VelbusProtocol(client_id="INTERNAL", velbus=velbus))
+
+for bus_index, serial_port in enumerate(args.serial_port):
+    bus_name, _, serial_port = serial_port.rpartition('=')
+    velbus = bus_for(bus_index, bus_name)
+    velbus.close_callbacks.append(bus_closed)
+
+    # Connect to serial port
+    serial_transport, serial_protocol = loop.run_until_complete(
+        serial_asyncio.create_serial_connection(
+            loop, functools.partial(VelbusSerialProtocol, velbus=velbus), serial_port,
+            baudrate=38400,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+        ))
+    try:
+        logger.debug("Old DTR/RTS: {}/{}".format(
+            serial_transport._serial.dtr,
+            serial_transport._serial.rts
+        ))
+        serial_transport._serial.dtr = False  # low
+        serial_transport._serial.rts = True   # high
+        logger.debug("New DTR/RTS: {}/{}".format(
+            serial_transport._serial.dtr,
+            serial_transport._serial.rts
+        ))
+    except OSError as e:
+        logger.warning("Could not set DTR/RTS status, trying anyway... ({})".format(str(e)))
+
+    velbus.query_scheduler.max_per_address = args.max_queries_per_module
+    velbus.query_scheduler.max_total = args.max_queries
+
+    if args.capture:
+        capture_path = args.capture
+        if bus_index > 0:
+            root, ext = os.path.splitext(args.capture)
+            capture_path = "{r}-{b}{e}".format(r=root, b=velbus.name, e=ext)
+        velbus.capture = CaptureWriter(capture_path,
+                                       max_bytes=args.capture_max_bytes, backup_count=args.capture_backups)
+        logger.info("Bus {b}: capturing to {c}".format(b=velbus.name, c=capture_path))
+
+    # send an interface status request, so we can quit right away if the bus is not active
+    internal = VelbusProtocol(client_id="INTERNAL", velbus=velbus)
+    loop.run_until_complete(internal.process_message(VelbusFrame(address=0, message=InterfaceStatusRequest())))
+    # The reply will be read as soon as we enter the loop
+    internal_protocols.append(internal)
+
+    # Start up TCP server
+    tcpserver = loop.run_until_complete(
+        loop.create_server(functools.partial(VelbusTcpProtocol, velbus=velbus), None, args.tcp_port + bus_index,
+                           reuse_port=True))
+    logger.info("Bus {b} on {s}: listening for TCP on {t}".format(
+        b=velbus.name, s=serial_port,
+        t=format_sockaddr(tcpserver.sockets[0].getsockname())))
+    tcpservers.append(tcpserver)
+    velbus.close_callbacks.append(lambda _, server=tcpserver: server.close())
+
+if args.mqtt is None or args.worker_of:
+    # Workers don't publish to MQTT: the main process already does
     args.mqtt = []
 for uri in args.mqtt:
     match = re.fullmatch("(?P<proto>[a-z]+)://(?P<host>[^/]+)(?P<topic>/.*)", uri)
@@ -144,9 +274,37 @@ for uri in args.mqtt:
 # Start up Web server
 app = Sanic(__name__, log_config={})
 app.config.LOGO = None
-httpserver = app.create_server(host="0.0.0.0", port=8080, return_asyncio_server=True)
+httpserver = app.create_server(host="0.0.0.0", port=args.http_port, return_asyncio_server=True,
+                               asyncio_server_kwargs={'reuse_port': True})
 asyncio.get_event_loop().create_task(httpserver)
 
+worker_pool = None
+if args.workers and args.serial_port:
+    # The workers share the HTTP port (SO_REUSEPORT). They get the module
+    # state from us, and forward the module requests (see Workers)
+    worker_dir = tempfile.mkdtemp(prefix='velbus-')
+    worker_socket = os.path.join(worker_dir, 'workers.sock')
+    worker_server = WorkerServer()
+    loop.run_until_complete(worker_server.start(worker_socket))
+
+    worker_args = [
+        sys.executable, '-m', __package__,
+        '--worker-of', worker_socket,
+        '--http-port', str(args.http_port),
+        '--static-dir', args.static_dir,
+    ]
+    if args.debug:
+        worker_args.append('--debug')
+    if args.logfile:
+        worker_args += ['--logfile', args.logfile]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    worker_pool = WorkerPool(worker_args, args.workers, env=env)
+    worker_pool.start()
+    logger.info("Started {n} HTTP workers".format(n=args.workers))
+
 
 logger.info("Serving /static from {}".format(args.static_dir))
 app.static('/static', args.static_dir)
@@ -172,7 +330,8 @@ def timeout(request, exception):
                                status=504)
 
 
-HttpApi.add_routes(bus=internal, app=app)
+for internal in internal_protocols:
+    HttpApi.add_routes(bus=internal, app=app)
 
 
 # Run loop
@@ -182,6 +341,15 @@ except KeyboardInterrupt:
     logger.warning("SIGINT received, closing...")
     pass
 
-tcpserver.close()
-loop.run_until_complete(tcpserver.wait_closed())
+if worker_pool is not None:
+    loop.run_until_complete(worker_pool.stop())
+    loop.run_until_complete(worker_server.close())
+    shutil.rmtree(worker_dir, ignore_errors=True)
+
+for tcpserver in tcpservers:
+    tcpserver.close()
+    loop.run_until_complete(tcpserver.wait_closed())
+for velbus in buses.values():
+    if velbus.capture is not None:
+        velbus.capture.close()
 loop.close()
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import os
+import tty
+
+
+logger = logging.getLogger(__name__)
+
+
+class PtyTransport(asyncio.Transport):
+    """
+    Serve a protocol on a pseudo-terminal, so it can be opened like a serial
+    port (at `slave_path`).
+    """
+    def __init__(self, protocol: asyncio.Protocol):
+        super().__init__()
+        self.master_fd, self.slave_fd = os.openpty()
+        # The slave stays open here as well: without any process having it
+        # open, reading the master fails (EIO) instead of blocking.
+        tty.setraw(self.slave_fd)
+        os.set_blocking(self.master_fd, False)
+        self.slave_path = os.ttyname(self.slave_fd)
+
+        self._protocol = protocol
+        self._loop = asyncio.get_event_loop()
+        self._loop.add_reader(self.master_fd, self._read)
+        self._closing = False
+        self.dropped_bytes = 0
+        protocol.connection_made(self)
+
+    def _read(self) -> None:
+        try:
+            data = os.read(self.master_fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        if data:
+            self._protocol.data_received(data)
+
+    def write(self, data) -> None:
+        try:
+            written = os.write(self.master_fd, data)
+        except BlockingIOError:
+            written = 0
+        if written < len(data):
+            # Nobody is reading: a real serial port loses the data as well
+            self.dropped_bytes += len(data) - written
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self.master_fd)
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+        self._loop.call_soon(self._protocol.connection_lost, None)
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import random
+import typing
+
+from ..RxBuffer import RxBuffer
+from ..TransmitQueue import TransmitQueue
+from ..VelbusMessage.VelbusFrame import VelbusFrame
+from ..VelbusMessage.VelbusMessage import VelbusMessage
+from ..VelbusMessage.InterfaceStatusRequest import InterfaceStatusRequest
+from ..VelbusMessage.BusActive import BusActive
+from ..VelbusMessage.RxBufFull import RxBufFull
+from ..VelbusMessage.RxBufReady import RxBufReady
+from .SimulatedModule import SimulatedModule
+
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatedBus(asyncio.Protocol):
+    """
+    A simulated Velbus bus with modules, behind a simulated USB/RS232
+    interface. The daemon connects to it instead of to a real serial port
+    (see `velbus.simulator` for the transports).
+
+    Timing follows the real bus: every frame occupies the bus for 10 bits
+    per byte at `baudrate`, and frames waiting for the bus are sent most
+    urgent priority first (like the CAN arbitration does). Modules answer
+    after `response_delay`.
+
+    Frames from the daemon wait in the interface's receive buffer until the
+    bus is free. When more than `rx_buffer_size` frames are waiting, the
+    interface answers RxBufFull and drops the frame, and sends RxBufReady
+    once the buffer is half empty again. On top of that, RxBufFull can be
+    injected at random (`rx_buf_full_probability` per received frame).
+    """
+    INTERFACE_ADDRESS = 0x00
+    INTERFACE_STATUS_REQUEST = bytes(InterfaceStatusRequest().data())
+
+    def __init__(self,
+                 baudrate: float = 9600,
+                 rx_buffer_size: int = 32,
+                 response_delay: typing.Tuple[float, float] = (0.002, 0.010),
+                 rx_buf_full_probability: float = 0.,
+                 rand: random.Random = None,
+                 ):
+        """
+        :param baudrate: bits per second on the bus. 0 to disable the timing
+        :param response_delay: (min, max) time (seconds) for a module to answer
+        """
+        self.baudrate = baudrate
+        self.rx_buffer_size = rx_buffer_size
+        self.response_delay = response_delay
+        self.rx_buf_full_probability = rx_buf_full_probability
+        self.rand = rand if rand is not None else random.Random()
+
+        self.modules: typing.Dict[int, SimulatedModule] = {}
+        self.context: typing.Dict[int, type] = {}
+        """address -> ModuleInfo class, to decode the frames for the modules"""
+
+        self.transport: asyncio.Transport = None
+        self.rx_buf = RxBuffer()
+        self.host_frames = 0
+        """Number of frames from the daemon waiting in the interface"""
+        self.rx_buf_full = False
+        self.bus_queue = TransmitQueue()
+        self.bus_handle: asyncio.Handle = None
+        self.bus_free_at = 0.
+        self.handles: typing.Set[asyncio.Handle] = set()
+
+        self.frames_from_host = 0
+        self.frames_on_bus = 0
+        self.bytes_on_bus = 0
+        self.rx_buf_fulls = 0
+        self.dropped_frames = 0
+
+    def add(self, module: SimulatedModule) -> None:
+        if module.address in self.modules or module.address == self.INTERFACE_ADDRESS:
+            raise ValueError("Address 0x{:02x} already in use".format(module.address))
+        module.bus = self
+        self.modules[module.address] = module
+        self.context[module.address] = module.module_info_class
+
+    def now(self) -> float:
+        return asyncio.get_event_loop().time()
+
+    def call_later(self, delay: float, callback: typing.Callable, *args) -> asyncio.Handle:
+        """
+        Like loop.call_later(), but the calls are cancelled when the bus stops
+        """
+        def run():
+            self.handles.discard(handle)
+            callback(*args)
+        handle = asyncio.get_event_loop().call_later(delay, run)
+        self.handles.add(handle)
+        return handle
+
+    def send(self, address: int, message: VelbusMessage, delay: float = 0.) -> asyncio.Handle:
+        """
+        Queue `message` for the bus, as sent by the module at `address`,
+        `delay` seconds + the response time of the module from now.
+        """
+        frame = bytes(VelbusFrame(address=address, message=message).to_bytes())
+        delay += self.rand.uniform(*self.response_delay)
+        return self.call_later(delay, self._queue, frame, address)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        logger.info("Simulated bus: connected")
+
+    def connection_lost(self, exc):
+        # The modules keep their state (and keep talking) for the next connection
+        logger.info("Simulated bus: disconnected")
+        self.transport = None
+
+    def stop(self) -> None:
+        """
+        Cancel all pending activity
+        """
+        for handle in self.handles:
+            handle.cancel()
+        self.handles.clear()
+        if self.bus_handle is not None:
+            self.bus_handle.cancel()
+            self.bus_handle = None
+        self.bus_queue.clear()
+        self.host_frames = 0
+
+    def data_received(self, data: bytes):
+        self.rx_buf.extend(data)
+        while self.rx_buf:
+            try:
+                length = VelbusFrame.frame_length(self.rx_buf.buf, self.rx_buf.offset)
+            except BufferError:
+                break
+            except ValueError:
+                self.rx_buf.resync()
+                continue
+            self.from_host(self.rx_buf.consume(length))
+
+    def from_host(self, frame: bytes) -> None:
+        self.frames_from_host += 1
+        if frame[2] == self.INTERFACE_ADDRESS and frame[4:-2] == self.INTERFACE_STATUS_REQUEST:
+            # Answered by the interface itself
+            self.to_host(BusActive())
+            return
+
+        if self.host_frames >= self.rx_buffer_size:
+            self.dropped_frames += 1
+            if not self.rx_buf_full:
+                self._buffer_full()
+            return
+        if self.rx_buf_full_probability and not self.rx_buf_full \
+                and self.rand.random() < self.rx_buf_full_probability:
+            # Injected: the frame itself still made it
+            self._buffer_full()
+            self.call_later(self.rand.uniform(0.01, 0.1), self._buffer_ready)
+
+        self.host_frames += 1
+        self._queue(frame, 'host')
+
+    def _buffer_full(self) -> None:
+        self.rx_buf_full = True
+        self.rx_buf_fulls += 1
+        self.to_host(RxBufFull())
+
+    def _buffer_ready(self) -> None:
+        if self.rx_buf_full:
+            self.rx_buf_full = False
+            self.to_host(RxBufReady())
+
+    def to_host(self, message: VelbusMessage) -> None:
+        """
+        Message from the interface itself, not via the bus
+        """
+        self._write(bytes(VelbusFrame(address=self.INTERFACE_ADDRESS, message=message).to_bytes()))
+
+    def _write(self, frame: bytes) -> None:
+        if self.transport is not None:
+            self.transport.write(frame)
+
+    def _queue(self, frame: bytes, source: typing.Union[int, str]) -> None:
+        self.bus_queue.put(frame, source, self.now())
+        if self.bus_handle is None:
+            self._transmit()
+
+    def _transmit(self) -> None:
+        """
+        Put the next frame on the bus, when it's free
+        """
+        self.bus_handle = None
+        while self.bus_queue:
+            now = self.now()
+            if self.bus_free_at > now:
+                self.bus_handle = asyncio.get_event_loop().call_at(self.bus_free_at, self._transmit)
+                return
+
+            source, frame = self.bus_queue.get_with_source(now)
+            if self.baudrate:
+                self.bus_free_at = now + len(frame) * 10 / self.baudrate
+            self.frames_on_bus += 1
+            self.bytes_on_bus += len(frame)
+
+            if source == 'host':
+                self.host_frames -= 1
+                if self.rx_buf_full and self.host_frames <= self.rx_buffer_size // 2:
+                    self._buffer_ready()
+                self._deliver(frame)
+            else:
+                # The interface receives everything on the bus
+                self._write(frame)
+
+    def _deliver(self, frame: bytes) -> None:
+        module = self.modules.get(frame[2])
+        if module is None:
+            return  # nobody home
+        try:
+            module.handle(VelbusFrame.from_bytes(frame, self.context).message)
+        except Exception:
+            logger.exception("{m} failed to handle [{f}]".format(
+                m=module, f=' '.join('{:02x}'.format(b) for b in frame),
+            ))
+
+    def generate_events(self, rate: float) -> None:
+        """
+        Let random modules generate spontaneous traffic (see
+        SimulatedModule.spontaneous()), `rate` times per second on average
+        """
+        if rate <= 0 or not self.modules:
+            return
+        modules = list(self.modules.values())
+
+        def event():
+            self.rand.choice(modules).spontaneous()
+            self.call_later(self.rand.expovariate(rate), event)
+        self.call_later(self.rand.expovariate(rate), event)
+
+    def statistics(self) -> dict:
+        return {
+            'modules': len(self.modules),
+            'frames_from_host': self.frames_from_host,
+            'frames_on_bus': self.frames_on_bus,
+            'bytes_on_bus': self.bytes_on_bus,
+            'rx_buf_fulls': self.rx_buf_fulls,
+            'dropped_frames': self.dropped_frames,
+        }
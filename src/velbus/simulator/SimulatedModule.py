@@ -0,0 +1,388 @@
+import random
+import typing
+
+from ..VelbusMessage.VelbusMessage import VelbusMessage
+from ..VelbusMessage.ModuleTypeRequest import ModuleTypeRequest
+from ..VelbusMessage.ModuleType import ModuleType
+from ..VelbusMessage.ModuleStatusRequest import ModuleStatusRequest
+from ..VelbusMessage.ModuleStatus import ModuleStatus6IN
+from ..VelbusMessage.PushButtonStatus import PushButtonStatus
+from ..VelbusMessage.RelayStatus import RelayStatus
+from ..VelbusMessage.SwitchRelay import SwitchRelay
+from ..VelbusMessage.StartRelayTimer import StartRelayTimer
+from ..VelbusMessage.DimmercontrollerStatus import DimmercontrollerStatus
+from ..VelbusMessage.SetDimvalue import SetDimvalue, SetDimvalue_VMBDALI
+from ..VelbusMessage.SensorTemperatureRequest import SensorTemperatureRequest
+from ..VelbusMessage.SensorTemperature import SensorTemperature
+from ..VelbusMessage.TemperatureSensorStatus import TemperatureSensorStatus
+from ..VelbusMessage.BlindStatus import BlindStatusV1, BlindStatusV2
+from ..VelbusMessage.SwitchBlind import SwitchBlindV1, SwitchBlindV2
+from ..VelbusMessage.SwitchBlindOff import SwitchBlindOffV1, SwitchBlindOffV2
+from ..VelbusMessage.SetBlindPosition import SetBlindPosition
+from ..VelbusMessage.DaliDeviceSettingsRequest import DaliDeviceSettingsRequest
+from ..VelbusMessage.DaliDeviceSettings import DaliDeviceSettings, DaliDeviceSettingValueLevel
+from ..VelbusMessage.ModuleInfo.ModuleInfo import ModuleInfo
+from ..VelbusMessage.ModuleInfo.VMB4RYNO import VMB4RYNO as VMB4RYNO_MI
+from ..VelbusMessage.ModuleInfo.VMB4DC import VMB4DC as VMB4DC_MI
+from ..VelbusMessage.ModuleInfo.VMB1TS import VMB1TS as VMB1TS_MI
+from ..VelbusMessage.ModuleInfo.VMB2BL import VMB2BL as VMB2BL_MI
+from ..VelbusMessage.ModuleInfo.VMB2BLE import VMB2BLE as VMB2BLE_MI
+from ..VelbusMessage.ModuleInfo.VMB6IN import VMB6IN as VMB6IN_MI
+from ..VelbusMessage.ModuleInfo.VMBDALI import VMBDALI as VMBDALI_MI
+from ..VelbusMessage.ModuleInfo.VMBGPOD import VMBGPOD as VMBGPOD_MI
+
+
+simulated_module_types: typing.Dict[str, type] = {}
+"""name -> SimulatedModule subclass"""
+
+
+def simulates(name: str):
+    def decorator(cls):
+        simulated_module_types[name] = cls
+        return cls
+    return decorator
+
+
+def channels_in(bitmap: int, channels: typing.Iterable[int], width: int = 1) -> typing.List[int]:
+    """
+    Decode the channel bitmap of a ModuleStatusRequest:
+    channel `c` is selected by `width` bits at position `width * (c - 1)`
+    """
+    mask = (1 << width) - 1
+    return [c for c in channels if bitmap >> (width * (c - 1)) & mask]
+
+
+class SimulatedModule:
+    """
+    A Velbus module on the SimulatedBus.
+
+    Subclasses implement the state machine of a specific module type:
+    `handle()` gets every message addressed to the module, and answers via
+    `send()`, like the real module would. `spontaneous()` generates
+    unsolicited traffic (e.g. button presses), to load the bus.
+    """
+    module_info_class: typing.Type[ModuleInfo] = None
+
+    def __init__(self, address: int, rand: random.Random = None):
+        self.address = address
+        self.rand = rand if rand is not None else random.Random(address)
+        self.bus: 'SimulatedBus' = None
+        """Set by SimulatedBus.add()"""
+        self.module_info = self.module_info_class(
+            build_year=self.rand.randrange(10, 21),
+            build_week=self.rand.randrange(1, 53),
+        )
+
+    def __repr__(self):
+        return "{cls}(address=0x{a:02x})".format(cls=self.__class__.__name__, a=self.address)
+
+    def now(self) -> float:
+        return self.bus.now()
+
+    def send(self, message: VelbusMessage, delay: float = 0.):
+        """
+        Put `message` on the bus, from this module (after the module's
+        response time, plus `delay` seconds)
+        :return: a handle to cancel the message
+        """
+        return self.bus.send(self.address, message, delay)
+
+    def handle(self, message: VelbusMessage) -> None:
+        if isinstance(message, ModuleTypeRequest):
+            self.send(ModuleType(module_info=self.module_info))
+
+    def spontaneous(self) -> None:
+        """
+        Generate some unsolicited traffic. Default: nothing
+        """
+
+
+@simulates('VMB4RYNO')
+class SimulatedVMB4RYNO(SimulatedModule):
+    module_info_class = VMB4RYNO_MI
+    CHANNELS = range(1, 6)
+
+    def __init__(self, address: int, rand: random.Random = None):
+        super().__init__(address, rand)
+        self.relay = {c: False for c in self.CHANNELS}
+        self.timer_end = {c: None for c in self.CHANNELS}
+        self.timer_handle = {c: None for c in self.CHANNELS}
+
+    def status(self, channel: int) -> RelayStatus:
+        delay = 0
+        if self.timer_end[channel] is not None:
+            delay = max(0, int(self.timer_end[channel] - self.now()))
+        return RelayStatus(
+            channel=channel,
+            relay_status=RelayStatus.RelayStatus.On if self.relay[channel] else RelayStatus.RelayStatus.Off,
+            delay_timer=delay,
+        )
+
+    def switch(self, channel: int, on: bool, timer: float = None) -> None:
+        if self.timer_handle[channel] is not None:
+            self.timer_handle[channel].cancel()
+        self.timer_handle[channel] = self.timer_end[channel] = None
+        self.relay[channel] = on
+        if timer is not None:
+            self.timer_end[channel] = self.now() + timer
+            self.timer_handle[channel] = self.bus.call_later(timer, self.switch, channel, False)
+        self.send(self.status(channel))
+
+    def handle(self, message: VelbusMessage) -> None:
+        if isinstance(message, SwitchRelay):
+            self.switch(message.channel, message.command == SwitchRelay.Command.SwitchRelayOn)
+        elif isinstance(message, StartRelayTimer):
+            if message.delay_time in (0, 0xffffff):
+                self.switch(message.channel, True)
+            else:
+                self.switch(message.channel, True, message.delay_time)
+        elif isinstance(message, ModuleStatusRequest):
+            for c in channels_in(message.channel, self.CHANNELS):
+                self.send(self.status(c))
+        else:
+            super().handle(message)
+
+
+@simulates('VMB4DC')
+class SimulatedVMB4DC(SimulatedModule):
+    module_info_class = VMB4DC_MI
+    CHANNELS = range(1, 5)
+
+    def __init__(self, address: int, rand: random.Random = None):
+        super().__init__(address, rand)
+        self.dimvalue = {c: 0 for c in self.CHANNELS}
+
+    def status(self, channel: int) -> DimmercontrollerStatus:
+        return DimmercontrollerStatus(channel=channel, dimvalue=self.dimvalue[channel])
+
+    def handle(self, message: VelbusMessage) -> None:
+        if isinstance(message, SetDimvalue):
+            self.dimvalue[message.channel] = min(message.dimvalue, 100)
+            # Report the end value right away; the dimming itself takes `dimspeed` seconds
+            self.send(self.status(message.channel))
+        elif isinstance(message, ModuleStatusRequest):
+            for c in channels_in(message.channel, self.CHANNELS):
+                self.send(self.status(c))
+        else:
+            super().handle(message)
+
+
+@simulates('VMB1TS')
+class SimulatedVMB1TS(SimulatedModule):
+    module_info_class = VMB1TS_MI
+
+    def __init__(self, address: int, rand: random.Random = None):
+        super().__init__(address, rand)
+        self.temperature = round(self.rand.uniform(17, 23), 1)
+        self.set_temperature = 20.
+        self.minimum = self.maximum = self.temperature
+
+    def handle(self, message: VelbusMessage) -> None:
+        if isinstance(message, SensorTemperatureRequest):
+            self.send(self.sensor_temperature())
+        elif isinstance(message, ModuleStatusRequest):
+            self.send(TemperatureSensorStatus(
+                temperature=round(self.temperature * 2) / 2,
+                set_temperature=self.set_temperature,
+                heater=self.temperature < self.set_temperature,
+            ))
+        else:
+            super().handle(message)
+
+    def sensor_temperature(self) -> SensorTemperature:
+        return SensorTemperature(
+            current_temperature=self.temperature,
+            minimum_temperature=self.minimum,
+            maximum_temperature=self.maximum,
+        )
+
+    def spontaneous(self) -> None:
+        # Temperature drifts a little, and is reported (like auto-send does)
+        self.temperature = round(self.temperature + self.rand.choice((-0.0625, 0.0625)), 4)
+        self.minimum = min(self.minimum, self.temperature)
+        self.maximum = max(self.maximum, self.temperature)
+        self.send(self.sensor_temperature())
+
+
+@simulates('VMBGPOD')
+class SimulatedVMBGPOD(SimulatedVMB1TS):
+    module_info_class = VMBGPOD_MI
+
+
+class SimulatedBlind:
+    """
+    A blind motor, moving between 0 (up) and 100 (down) in `travel_time`
+    seconds.
+    """
+    def __init__(self, travel_time: float = 30.):
+        self.travel_time = travel_time
+        self.position = 0.
+        self.direction = 0
+        """-1: moving up, 1: moving down"""
+        self.since = 0.
+        self.target = 0.
+        self.stop_handle = None
+
+    def position_at(self, now: float) -> float:
+        position = self.position + self.direction * 100 * (now - self.since) / self.travel_time
+        low, high = sorted((self.position, self.target))
+        return min(max(position, low), high)
+
+    def move(self, now: float, direction: int, target: float = None) -> float:
+        """
+        Start moving (or stop, with `direction` 0)
+        :return: seconds until the blind stops
+        """
+        self.position = self.position_at(now)
+        self.since = now
+        self.direction = direction
+        if direction == 0:
+            self.target = self.position
+            return 0.
+        if target is None:
+            target = 0. if direction < 0 else 100.
+        self.target = target
+        return abs(target - self.position) * self.travel_time / 100
+
+
+@simulates('VMB2BL')
+class SimulatedVMB2BL(SimulatedModule):
+    module_info_class = VMB2BL_MI
+    CHANNELS = range(1, 3)
+
+    def __init__(self, address: int, rand: random.Random = None):
+        super().__init__(address, rand)
+        self.blinds = {c: SimulatedBlind() for c in self.CHANNELS}
+
+    def status(self, channel: int) -> BlindStatusV1:
+        blind = self.blinds[channel]
+        if blind.direction == 0:
+            status = BlindStatusV1.BlindStatus.Off
+        else:
+            status = BlindStatusV1.BlindStatus(
+                (1 if blind.direction < 0 else 2) << 2 * (channel - 1))
+        return BlindStatusV1(channel=channel, blind_status=status)
+
+    def move(self, channel: int, direction: int) -> None:
+        blind = self.blinds[channel]
+        if blind.stop_handle is not None:
+            blind.stop_handle.cancel()
+            blind.stop_handle = None
+        duration = blind.move(self.now(), direction)
+        if direction != 0:
+            blind.stop_handle = self.bus.call_later(duration, self.move, channel, 0)
+        self.send(self.status(channel))
+
+    def handle(self, message: VelbusMessage) -> None:
+        if isinstance(message, SwitchBlindV1):
+            self.move(message.channel, -1 if message.command == message.Command.SwitchBlindUp else 1)
+        elif isinstance(message, SwitchBlindOffV1):
+            self.move(message.channel, 0)
+        elif isinstance(message, ModuleStatusRequest):
+            for c in channels_in(message.channel, self.CHANNELS, width=2):
+                self.send(self.status(c))
+        else:
+            super().handle(message)
+
+
+@simulates('VMBBLE')
+class SimulatedVMB2BLE(SimulatedModule):
+    module_info_class = VMB2BLE_MI
+    CHANNELS = range(1, 3)
+
+    def __init__(self, address: int, rand: random.Random = None):
+        super().__init__(address, rand)
+        self.blinds = {c: SimulatedBlind() for c in self.CHANNELS}
+
+    def status(self, channel: int) -> BlindStatusV2:
+        blind = self.blinds[channel]
+        return BlindStatusV2(
+            channel=channel,
+            blind_status={
+                0: BlindStatusV2.BlindStatus.Off,
+                -1: BlindStatusV2.BlindStatus.Up,
+                1: BlindStatusV2.BlindStatus.Down,
+            }[blind.direction],
+            blind_position=int(round(blind.position_at(self.now()))),
+        )
+
+    def move(self, channel: int, direction: int, target: float = None) -> None:
+        blind = self.blinds[channel]
+        if blind.stop_handle is not None:
+            blind.stop_handle.cancel()
+            blind.stop_handle = None
+        duration = blind.move(self.now(), direction, target)
+        if direction != 0:
+            blind.stop_handle = self.bus.call_later(duration, self.move, channel, 0)
+        self.send(self.status(channel))
+
+    def handle(self, message: VelbusMessage) -> None:
+        if isinstance(message, SwitchBlindV2):
+            self.move(message.channel, -1 if message.command == message.Command.SwitchBlindUp else 1)
+        elif isinstance(message, SwitchBlindOffV2):
+            self.move(message.channel, 0)
+        elif isinstance(message, SetBlindPosition):
+            current = self.blinds[message.channel].position_at(self.now())
+            target = min(message.position, 100)
+            self.move(message.channel, (target > current) - (target < current), target)
+        elif isinstance(message, ModuleStatusRequest):
+            for c in channels_in(message.channel, self.CHANNELS):
+                self.send(self.status(c))
+        else:
+            super().handle(message)
+
+
+@simulates('VMB6IN')
+class SimulatedVMB6IN(SimulatedModule):
+    module_info_class = VMB6IN_MI
+    CHANNELS = range(1, 7)
+    press_duration = 0.2
+
+    def __init__(self, address: int, rand: random.Random = None):
+        super().__init__(address, rand)
+        self.inputs = 0
+
+    def handle(self, message: VelbusMessage) -> None:
+        if isinstance(message, ModuleStatusRequest):
+            self.send(ModuleStatus6IN(input_status=self.inputs))
+        else:
+            super().handle(message)
+
+    def press(self, channel: int) -> None:
+        bit = 1 << (channel - 1)
+        self.inputs |= bit
+        self.send(PushButtonStatus(just_pressed=bit))
+        self.bus.call_later(self.press_duration, self.release, channel)
+
+    def release(self, channel: int) -> None:
+        bit = 1 << (channel - 1)
+        self.inputs &= ~bit
+        self.send(PushButtonStatus(just_released=bit))
+
+    def spontaneous(self) -> None:
+        self.press(self.rand.choice(self.CHANNELS))
+
+
+@simulates('VMBDALI')
+class SimulatedVMBDALI(SimulatedModule):
+    module_info_class = VMBDALI_MI
+    CHANNELS = range(1, 65)
+
+    def __init__(self, address: int, rand: random.Random = None):
+        super().__init__(address, rand)
+        self.level = {c: 0 for c in self.CHANNELS}
+
+    def handle(self, message: VelbusMessage) -> None:
+        if isinstance(message, SetDimvalue_VMBDALI):
+            # The VMBDALI does not answer a SetDimvalue
+            if message.channel in self.level and message.dimvalue != 255:
+                self.level[message.channel] = message.dimvalue
+        elif isinstance(message, DaliDeviceSettingsRequest):
+            if message.channel in self.level:
+                self.send(DaliDeviceSettings(
+                    channel=message.channel,
+                    setting=DaliDeviceSettings.Setting.ActualLevel,
+                    setting_value=DaliDeviceSettingValueLevel(level=self.level[message.channel]),
+                ))
+        else:
+            super().handle(message)
@@ -0,0 +1,4 @@
+"""
+Simulated Velbus installation, to test (and load test) the daemon without
+real hardware. Run with `python -m velbus.simulator --help`.
+"""
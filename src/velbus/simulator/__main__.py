@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from .SimulatedBus import SimulatedBus
+from .SimulatedModule import simulated_module_types
+from .PtyTransport import PtyTransport
+
+
+parser = argparse.ArgumentParser(
+    description='Simulated Velbus bus. Point the daemon to the printed port instead of a serial port',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument('--listen', help="Listen for the daemon on this TCP `[host:]port` "
+                                     "(open it as serial port `socket://host:port`)",
+                    type=str, default="127.0.0.1:8446")
+parser.add_argument('--pty', help="Create a pseudo-terminal instead of listening on TCP",
+                    action='store_true')
+parser.add_argument('--modules', help="Modules to simulate: comma separated `TYPE=COUNT`. Types: " +
+                                      ", ".join(sorted(simulated_module_types)),
+                    type=str, default="VMB4RYNO=40,VMB4DC=30,VMB1TS=30,VMB2BL=20,VMBBLE=20,"
+                                      "VMB6IN=30,VMBDALI=10,VMBGPOD=20")
+parser.add_argument('--baudrate', help="Bus speed, 0 for no timing at all", type=float, default=9600)
+parser.add_argument('--rx-buffer', help="Size (in frames) of the interface's receive buffer",
+                    type=int, default=32)
+parser.add_argument('--rx-buf-full-probability', help="Inject an RxBufFull for this fraction of received frames",
+                    type=float, default=0.)
+parser.add_argument('--events-per-second', help="Spontaneous traffic (button presses, temperature updates)",
+                    type=float, default=1.)
+parser.add_argument('--seed', help="Random seed", type=int, default=None)
+parser.add_argument('--stats-interval', help="Log statistics every this many seconds (0 to disable)",
+                    type=float, default=10.)
+parser.add_argument('--debug', help="Enable debug mode", action='store_true')
+
+args = parser.parse_args()
+
+logging.basicConfig(
+    level=logging.DEBUG if args.debug else logging.INFO,
+    format="%(asctime)sZ [%(name)s %(levelname)s] %(message)s",
+)
+logging.Formatter.converter = time.gmtime
+logger = logging.getLogger(__name__)
+
+rand = random.Random(args.seed)
+bus = SimulatedBus(
+    baudrate=args.baudrate,
+    rx_buffer_size=args.rx_buffer,
+    rx_buf_full_probability=args.rx_buf_full_probability,
+    rand=rand,
+)
+
+address = 1
+for spec in args.modules.split(','):
+    module_type, _, count = spec.partition('=')
+    try:
+        cls = simulated_module_types[module_type]
+    except KeyError:
+        parser.error("Unknown module type `{}`".format(module_type))
+    for _ in range(int(count or 1)):
+        if address > 0xff:
+            parser.error("Too many modules, only 255 addresses available")
+        bus.add(cls(address, rand=random.Random(rand.random())))
+        address += 1
+logger.info("Simulating {n} modules at address 0x01-0x{last:02x}".format(n=len(bus.modules), last=address - 1))
+
+
+class Busy(asyncio.Protocol):
+    def connection_made(self, transport):
+        logger.warning("Refusing second connection, the bus is already in use")
+        transport.close()
+
+
+loop = asyncio.get_event_loop()
+if args.pty:
+    transport = PtyTransport(bus)
+    logger.info("Serving on {}".format(transport.slave_path))
+else:
+    host, _, port = args.listen.rpartition(':')
+    server = loop.run_until_complete(loop.create_server(
+        lambda: bus if bus.transport is None else Busy(),
+        host or None, int(port)))
+    logger.info("Listening on {h}:{p}, open as serial port `socket://{h}:{p}`".format(
+        h=host or 'localhost', p=port))
+
+bus.generate_events(args.events_per_second)
+
+
+def log_statistics():
+    logger.info("Statistics: {}".format(bus.statistics()))
+    loop.call_later(args.stats_interval, log_statistics)
+
+
+if args.stats_interval > 0:
+    loop.call_later(args.stats_interval, log_statistics)
+
+try:
+    loop.run_forever()
+except KeyboardInterrupt:
+    pass
+bus.stop()
+loop.close()
@@ -0,0 +1,69 @@
+import os
+
+from velbus.Capture import CaptureWriter, CaptureReader
+from velbus.CaptureIndex import CaptureIndex
+
+MINUTE = 60 * 1_000_000_000
+
+
+def frame(address: int) -> bytes:
+    return bytes([0x0f, 0xfb, address, 0x01, 0xfa, 0x00, 0x04])
+
+
+def write_capture(path: str) -> None:
+    w = CaptureWriter(path)
+    for minute in range(10):
+        for address in (0x01, 0x02 + minute):
+            w.write(frame(address), 'SERIAL', monotonic_ns=minute * MINUTE, wall_ns=minute * MINUTE)
+    w.close()
+
+
+def search(path: str, **kwargs):
+    index = CaptureIndex.load(path)
+    with CaptureReader(path) as r:
+        return [
+            (record.wall_ns // MINUTE, record.frame[2])
+            for start, end in index.search(**kwargs)
+            for record in r.read(start, end)
+        ]
+
+
+def test_written_while_capturing(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    write_capture(path)
+    with open(CaptureIndex.path_for(path), 'rb') as f:
+        assert len(f.read()) == len(CaptureIndex.HEADER) + 10 * CaptureIndex.ENTRY.size
+
+
+def test_search_address(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    write_capture(path)
+    assert search(path, addresses=[0x05]) == [(3, 0x01), (3, 0x05)]
+    assert search(path, addresses=[0xff]) == []
+    assert len(search(path, addresses=[0x01])) == 20
+
+
+def test_search_time(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    write_capture(path)
+    assert search(path, since_ns=8 * MINUTE) == [(8, 0x01), (8, 0x0a), (9, 0x01), (9, 0x0b)]
+    assert search(path, since_ns=2 * MINUTE + 1, until_ns=3 * MINUTE) == [(2, 0x01), (2, 0x04)]
+
+
+def test_missing_index(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    write_capture(path)
+    os.remove(CaptureIndex.path_for(path))
+    assert search(path, addresses=[0x05]) == [(3, 0x01), (3, 0x05)]
+
+
+def test_catch_up(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    write_capture(path)
+    w = CaptureWriter(path)
+    w.write(frame(0x42), 'SERIAL', wall_ns=20 * MINUTE)
+    w.flush()  # bucket still open: not in the index file yet
+
+    assert search(path, addresses=[0x42]) == [(20, 0x42)]
+    w.close()
+    assert search(path, addresses=[0x42]) == [(20, 0x42)]
@@ -0,0 +1,143 @@
+import asyncio
+import os
+
+import pytest
+
+from velbus.Capture import CaptureWriter, CaptureReader, CaptureRecord, replay, HEADER
+from velbus.VelbusBus import VelbusBus
+from velbus.VelbusProtocol import VelbusProtocol
+from velbus.VelbusMessage.VelbusFrame import VelbusFrame
+from velbus.VelbusMessage.ModuleTypeRequest import ModuleTypeRequest
+
+FRAME = bytes(VelbusFrame(address=0x01, message=ModuleTypeRequest()).to_bytes())
+
+
+def test_roundtrip(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    w = CaptureWriter(path)
+    w.write(FRAME, 'TCP:[::1]:1234', monotonic_ns=1000, wall_ns=2000)
+    w.write(FRAME, 'SERIAL', monotonic_ns=3000, wall_ns=4000)
+    w.close()
+
+    with CaptureReader(path) as r:
+        records = list(r)
+    assert [(rec.monotonic_ns, rec.wall_ns, rec.client_id, rec.frame) for rec in records] == [
+        (1000, 2000, 'TCP:[::1]:1234', FRAME),
+        (3000, 4000, 'SERIAL', FRAME),
+    ]
+
+
+def test_append(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    for _ in range(2):
+        w = CaptureWriter(path)
+        w.write(FRAME, 'SERIAL')
+        w.close()
+    with CaptureReader(path) as r:
+        assert len(list(r)) == 2
+
+
+def test_truncated(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    w = CaptureWriter(path)
+    w.write(FRAME, 'SERIAL')
+    w.write(FRAME, 'SERIAL')
+    w.close()
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 1)
+
+    with CaptureReader(path) as r:
+        assert len(list(r)) == 1
+
+
+def test_append_after_truncated(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    w = CaptureWriter(path)
+    w.write(FRAME, 'SERIAL', wall_ns=1)
+    w.write(FRAME, 'SERIAL', wall_ns=2)
+    w.close()
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 3)  # crashed while writing the second record
+
+    w = CaptureWriter(path)
+    for wall_ns in (3, 4, 5):
+        w.write(FRAME, 'SERIAL', wall_ns=wall_ns)
+    w.close()
+
+    with CaptureReader(path) as r:
+        assert [rec.wall_ns for rec in r] == [1, 3, 4, 5]
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(b'something else')
+    with pytest.raises(ValueError):
+        CaptureReader(str(path))
+
+
+def test_rotate(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    w = CaptureWriter(path)
+    w.write(FRAME, 'SERIAL')
+    w.close()
+    record_size = os.path.getsize(path) - len(HEADER)
+    os.remove(path)
+    os.remove(path + '.idx')
+
+    w = CaptureWriter(path, max_bytes=len(HEADER) + 2 * record_size, backup_count=2)
+    for _ in range(7):
+        w.write(FRAME, 'SERIAL')
+    w.close()
+
+    assert w.rotations == 3
+    assert sorted(os.listdir(str(tmp_path))) == [
+        'bus.vbcap', 'bus.vbcap.1', 'bus.vbcap.1.idx', 'bus.vbcap.2', 'bus.vbcap.2.idx', 'bus.vbcap.idx']
+    for name, n in (('bus.vbcap', 1), ('bus.vbcap.1', 2), ('bus.vbcap.2', 2)):
+        with CaptureReader(str(tmp_path / name)) as r:
+            assert len(list(r)) == n
+
+
+@pytest.mark.asyncio
+async def test_capture_relayed(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    bus = VelbusBus('capture')
+    bus.capture = CaptureWriter(path)
+    await VelbusProtocol(client_id='INTERNAL', velbus=bus).process_message(VelbusFrame.from_bytes(FRAME))
+    bus.capture.close()
+
+    with CaptureReader(path) as r:
+        assert [(rec.client_id, rec.frame) for rec in r] == [('INTERNAL', FRAME)]
+
+
+@pytest.mark.asyncio
+async def test_replay(tmp_path):
+    path = str(tmp_path / 'bus.vbcap')
+    w = CaptureWriter(path)
+    w.write(FRAME, 'SERIAL', monotonic_ns=0)
+    w.write(FRAME, 'TCP', monotonic_ns=int(10e9))
+    w.close()
+
+    bus = VelbusBus('replay')
+    received = []
+    bus.listeners.add(received.append)
+    with CaptureReader(path) as r:
+        count = await replay(r, bus, speed=100)  # 10 seconds in 0.1
+    assert count == 2
+    assert [bytes(vbm.to_bytes()) for vbm in received] == [FRAME, FRAME]
+
+
+@pytest.mark.asyncio
+async def test_replay_reboot():
+    records = [
+        CaptureRecord(monotonic_ns=int(1e9), wall_ns=int(1000e9), client_id='SERIAL', frame=FRAME),
+        # rebooted: monotonic clock restarted, at a higher uptime
+        CaptureRecord(monotonic_ns=int(3600e9), wall_ns=int(1001e9), client_id='SERIAL', frame=FRAME),
+        # rebooted again, monotonic clock goes backwards
+        CaptureRecord(monotonic_ns=int(2e9), wall_ns=int(1002e9), client_id='SERIAL', frame=FRAME),
+        CaptureRecord(monotonic_ns=int(3e9), wall_ns=int(1002e9), client_id='SERIAL', frame=FRAME),
+    ]
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    count = await replay(records, VelbusBus('reboot'), speed=100)  # 3 seconds in 0.03
+    assert count == 4
+    assert 0.025 < loop.time() - start < 1
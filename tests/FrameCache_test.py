@@ -0,0 +1,66 @@
+import attr
+import pytest
+
+from velbus.FrameCache import FrameCache
+from velbus.VelbusMessage.BusActive import BusActive
+from velbus.VelbusMessage.ModuleStatus import ModuleStatus6IN
+
+
+BUS_ACTIVE = b'\x0f\xf8\x00\x01\x0a\xee\x04'
+BUS_ACTIVE_01 = b'\x0f\xf8\x01\x01\x0a\xed\x04'
+
+
+def test_hit_miss():
+    c = FrameCache()
+    a = c.from_bytes(BUS_ACTIVE)
+    b = c.from_bytes(BUS_ACTIVE)
+    assert a is b
+    assert c.hits == 1
+    assert c.misses == 1
+
+    assert c.from_bytes(BUS_ACTIVE, {0: object}) is not a
+    assert c.misses == 2
+
+
+def test_lru():
+    c = FrameCache(maxsize=1)
+    a = c.from_bytes(BUS_ACTIVE)
+    c.from_bytes(BUS_ACTIVE_01)
+    assert len(c) == 1
+    assert c.from_bytes(BUS_ACTIVE) is not a
+    assert c.statistics() == {'size': 1, 'maxsize': 1, 'hits': 0, 'misses': 3}
+
+
+def test_invalid():
+    c = FrameCache()
+    with pytest.raises(ValueError):
+        c.from_bytes(b'\x0f\xf8\x00\x01\x0a\xef\x04')
+    assert len(c) == 0
+
+
+def test_frozen():
+    c = FrameCache()
+    a = c.from_bytes(BUS_ACTIVE)
+    assert a.message == BusActive(priority=0)
+    assert a.message.frozen
+
+    with pytest.raises(attr.exceptions.FrozenInstanceError):
+        a.message = BusActive()
+    with pytest.raises(attr.exceptions.FrozenInstanceError):
+        a.message._priority = 3
+
+    b = a.copy()
+    assert b == a
+    b.message._priority = 3
+    assert b.to_bytes() == b'\x0f\xfb\x00\x01\x0a\xeb\x04'
+    assert a.to_bytes() == BUS_ACTIVE
+
+
+def test_copy_nested():
+    m = ModuleStatus6IN(input_status=[True] + [False] * 7)
+    m.freeze()
+    n = m.copy()
+    assert n == m
+    assert not n.frozen
+    n.input_status = [True, True] + [False] * 6
+    assert n != m
@@ -0,0 +1,34 @@
+import pytest
+
+from velbus.FrameFilter import FrameFilter
+
+
+def frame(address: int, *data: int) -> bytes:
+    return bytes([0x0f, 0xfb, address, len(data), *data, 0x00, 0x04])
+
+
+def test_address_and_command():
+    f = FrameFilter.parse("FILTER address=01,10-1f command=ee\n")
+    assert f.matches(frame(0x01, 0xee))
+    assert f.matches(frame(0x15, 0xee, 0x00))
+    assert not f.matches(frame(0x02, 0xee))
+    assert not f.matches(frame(0x01, 0xfb))
+    assert f.matches(frame(0x1f))  # no command
+
+
+def test_empty_matches_all():
+    f = FrameFilter.parse("FILTER")
+    assert all(f.matches(frame(a, c)) for a in range(256) for c in (0x00, 0xff))
+
+
+@pytest.mark.parametrize('line', [
+    "FILTERS",
+    "FILTER addr=01",
+    "FILTER address",
+    "FILTER address=100",
+    "FILTER address=1f-10",
+    "FILTER command=xx",
+])
+def test_invalid(line):
+    with pytest.raises(ValueError):
+        FrameFilter.parse(line)
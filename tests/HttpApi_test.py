@@ -45,7 +45,8 @@ async def test_get_module(generate_sanic_request):
                      response_type: type,
                      response_address: int = None,
                      timeout: int = 2,
-                     additional_check=(lambda vbm: True)):
+                     additional_check=(lambda vbm: True),
+                     coalesce: bool = False):
         assert question == VelbusFrame(address=1, message=ModuleTypeRequest())
         return make_awaitable(
             VelbusFrame(address=1, message=ModuleType(module_info=VMB4RYNO_mi()))
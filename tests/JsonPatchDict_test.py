@@ -123,3 +123,24 @@ def test_reconstruct():
 
     a.replace({"hello": "world"})
     assert a == b
+
+
+def test_apply():
+    a = JsonPatchDict()
+
+    b = dict()
+
+    def cb(ops: JsonPatch):
+        JsonPatch.from_json_able(ops.to_json_able()).apply(b)
+
+    a.callback.add(cb)
+
+    a['foo']['b/r'] = 'bar'
+    assert a == b
+
+    a['foo']['baz'] = {'x': 1}
+    del a['foo']['b/r']
+    assert a == b
+
+    a.replace({"hello": "world"})
+    assert a == b
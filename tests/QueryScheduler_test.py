@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from velbus.QueryScheduler import QueryScheduler
+
+
+@pytest.mark.asyncio
+async def test_per_address_limit():
+    s = QueryScheduler(max_per_address=1, max_total=8)
+    await s.acquire(1)
+    second = asyncio.ensure_future(s.acquire(1))
+    await s.acquire(2)  # other addresses are not held up
+    await asyncio.sleep(0)
+    assert not second.done()
+    assert s.statistics()['waiting'] == 1
+
+    s.release(1)
+    await asyncio.sleep(0)
+    assert second.done()
+    assert s.statistics()['in_flight'] == 2
+
+
+@pytest.mark.asyncio
+async def test_total_limit_in_order():
+    s = QueryScheduler(max_per_address=8, max_total=1)
+    await s.acquire(1)
+    order = []
+
+    async def query(address):
+        await s.acquire(address)
+        order.append(address)
+
+    tasks = [asyncio.ensure_future(query(a)) for a in [3, 2]]
+    await asyncio.sleep(0)
+    s.release(1)
+    await asyncio.sleep(0)
+    s.release(3)
+    await asyncio.gather(*tasks)
+    assert order == [3, 2]
+
+
+@pytest.mark.asyncio
+async def test_cancel():
+    s = QueryScheduler(max_per_address=1)
+    await s.acquire(1)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(s.acquire(1), 0.01)
+    assert s.statistics()['waiting'] == 0
+    s.release(1)
+    assert s.statistics()['in_flight'] == 0
+
+
+@pytest.mark.asyncio
+async def test_release_while_cancelling():
+    s = QueryScheduler(max_per_address=1)
+    await s.acquire(1)
+    waiter = asyncio.ensure_future(s.acquire(1))
+    await asyncio.sleep(0)
+
+    waiter.cancel()  # the waiter's future is cancelled, its cleanup runs later
+    s.release(1)  # must not hand the slot to the cancelled waiter
+    assert s.statistics()['in_flight'] == 0
+
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert s.statistics()['waiting'] == 0
+    await asyncio.wait_for(s.acquire(1), 0.1)
+    assert s.statistics()['in_flight'] == 1
+
+
+def test_adaptive_timeout():
+    s = QueryScheduler(min_timeout=0.1, min_samples=3)
+    assert s.timeout_for(1, 2) == 2  # no history
+
+    for _ in range(3):
+        s.add_round_trip(1, 0.02)
+    assert s.timeout_for(1, 2) == 0.1
+    assert s.timeout_for(2, 2) == 2
+
+    s.timed_out(1)
+    assert s.timeout_for(1, 2) == 0.2  # back off
+    s.add_round_trip(1, 0.02)
+    assert s.timeout_for(1, 2) == 0.1
+
+    for _ in range(10):
+        s.add_round_trip(1, 1.5)
+    assert s.timeout_for(1, 2) == 2  # capped
+
+
+def test_backoff_below_cap():
+    s = QueryScheduler(min_timeout=0.1, min_samples=5)
+    for _ in range(5):
+        s.add_round_trip(1, 0.02)
+    for _ in range(5):
+        s.timed_out(1)
+    assert s.timeout_for(1, 2) == 0.2
+
+
+def test_rtt_statistics():
+    s = QueryScheduler()
+    s.add_round_trip(0x1a, 0.015)
+    s.add_round_trip(0x1a, 7)
+    stats = s.statistics()['modules']['1a']
+    assert stats['histogram']['<=0.02'] == 1
+    assert stats['histogram']['>5.0'] == 1
+    assert stats['p50'] == 7
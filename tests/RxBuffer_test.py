@@ -0,0 +1,37 @@
+from velbus.RxBuffer import RxBuffer
+
+
+def test_consume():
+    b = RxBuffer()
+    b.extend(b'\x01\x02\x03')
+    assert len(b) == 3
+    assert b.consume(2) == b'\x01\x02'
+    assert len(b) == 1
+    assert b.peek() == b'\x03'
+    assert b.consume(1) == b'\x03'
+    assert not b
+    assert b.offset == 0  # reset when fully consumed
+
+
+def test_compact():
+    b = RxBuffer(compact_threshold=4)
+    b.extend(b'\x00' * 6 + b'\x0f')
+    b.consume(3)
+    assert b.offset == 3
+    b.consume(2)
+    assert b.offset == 0
+    assert b.peek() == b'\x00\x0f'
+
+
+def test_resync():
+    b = RxBuffer()
+    b.extend(b'\x0f\x01\x02\x0f\x03')
+    assert b.resync() == b'\x0f\x01\x02'
+    assert b.peek() == b'\x0f\x03'
+    assert b.discarded_bytes == 3
+    assert b.resyncs == 1
+
+    assert b.resync() == b'\x0f\x03'  # no next start byte
+    assert not b
+    assert b.discarded_bytes == 5
+    assert b.resyncs == 2
@@ -0,0 +1,41 @@
+import pytest
+
+from velbus.TransmitQueue import TransmitQueue
+
+
+def frame(prio: int, tag: int) -> bytes:
+    return bytes([0x0f, 0xf8 | prio, tag, 0x00, 0x00, 0x04])
+
+
+def test_priority():
+    q = TransmitQueue()
+    q.put(frame(3, 1), 'HTTP', 0)
+    q.put(frame(0, 2), 'TCP', 1)
+    assert len(q) == 2
+    assert q.get(2) == frame(0, 2)
+    assert q.get(2) == frame(3, 1)
+    assert not q
+    with pytest.raises(IndexError):
+        q.get(2)
+
+
+def test_fairness():
+    q = TransmitQueue()
+    for i in range(3):
+        q.put(frame(3, i), 'chatty', 0)
+    q.put(frame(3, 10), 'quiet', 0)
+    assert [q.get(0)[2] for _ in range(4)] == [0, 10, 1, 2]
+
+
+def test_statistics():
+    q = TransmitQueue()
+    q.put(frame(3, 1), 'a', 0)
+    q.put(frame(3, 2), 'b', 1)
+    q.get(2)
+    stats = q.statistics()[3]
+    assert stats['queued'] == 1
+    assert stats['max_queued'] == 2
+    assert stats['sources'] == 1
+    assert stats['frames'] == 1
+    assert stats['wait_avg'] == 2
+    assert q.statistics()[0]['wait_avg'] is None
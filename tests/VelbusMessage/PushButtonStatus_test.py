@@ -23,3 +23,20 @@ def test_pressed():
     )
     assert a.to_bytes() == b
 
+
+
+def test_bitmap():
+    b = b'\x0f\xf8\x00\x04\x00\x01\x0a\x00\xea\x04'
+    a = VelbusFrame.from_bytes(b)
+    just_released = a.message.just_released
+    assert just_released == 0x0a
+    assert len(just_released) == 8
+    assert just_released[4] and just_released[-2]
+    assert not just_released[0]
+    assert list(just_released) == [False, False, False, False, True, False, True, False]
+    assert just_released[4:] == [True, False, True, False]
+    assert just_released.set_bits() == [4, 6]
+    assert a.to_json_able()['message']['properties']['just_released'] == \
+        [False, False, False, False, True, False, True, False]
+    with pytest.raises(ValueError):
+        type(just_released)([True])
@@ -66,3 +66,64 @@ def test_decode_invalid():
     with pytest.raises(ValueError):
         VelbusFrame.from_bytes(b'\x0f\xf8\x00\x00\xf9\x00')  # invalid EOF
 
+
+
+def test_frame_length():
+    b = b'\x00\x0f\xf8\x00\x01\x0a\xee\x04\x0f'
+    assert VelbusFrame.frame_length(b, 1) == 7
+    with pytest.raises(ValueError):
+        VelbusFrame.frame_length(b, 0)
+    with pytest.raises(BufferError):
+        VelbusFrame.frame_length(b, 8)
+
+
+def test_decoder_index():
+    __import__('velbus.VelbusMessage', fromlist=['*'])
+    from velbus.VelbusMessage._registry import decoder_index, decoders_for
+    from velbus.VelbusMessage.BlindStatus import BlindStatusV1, BlindStatusV2
+
+    ambiguous = [key for key, decoder in decoder_index.items() if decoder.ambiguous]
+    assert ambiguous == []
+
+    assert decoders_for(b'\xec\x03\x00\x00\x00\x00\x00\x00') == [BlindStatusV1]
+    assert decoders_for(b'\xec\x02\x00\x00\x00\x00\x00\x00') == [BlindStatusV2]
+    assert decoders_for(b'\xec\x04\x00\x00\x00\x00\x00\x00') == []
+    assert decoders_for(b'\xec\x02') == []
+
+
+def test_decode_with_context():
+    from velbus.VelbusMessage.SetDimvalue import SetDimvalue, SetDimvalue_VMBDALI
+    from velbus.VelbusMessage.ModuleInfo.VMB4DC import VMB4DC
+    from velbus.VelbusMessage.ModuleInfo.VMBDALI import VMBDALI
+
+    b = b'\x0f\xf8\x01\x05\x07\x01\x40\x00\x00\xab\x04'
+    assert isinstance(VelbusFrame.from_bytes(b).message, SetDimvalue)
+    assert isinstance(VelbusFrame.from_bytes(b, {1: VMB4DC}).message, SetDimvalue)
+
+    a = VelbusFrame.from_bytes(b, {1: VMBDALI})
+    assert a.message == SetDimvalue_VMBDALI(channel=1, dimvalue=0x40)
+    assert a.to_bytes() == b
+
+    b = b'\x0f\xfb\xda\x04\xe8\01\x1a\xfe\x17\x04'  # DaliDeviceSettings
+    assert isinstance(VelbusFrame.from_bytes(b, {0xda: VMB4DC}).message, UnknownMessage)
+    assert not isinstance(VelbusFrame.from_bytes(b, {0xda: VMBDALI}).message, UnknownMessage)
+
+
+def test_lazy_decode():
+    from velbus.VelbusMessage.BusActive import BusActive
+
+    b = b'\x0f\xf8\x00\x01\x0a\xee\x04'
+    a = VelbusFrame.from_bytes(b)
+    assert not a.decoded
+    assert a.address == 0
+    assert a.to_bytes() == b
+    assert not a.decoded
+
+    assert a == VelbusFrame.from_bytes(b)
+    assert not a.decoded
+
+    assert a == VelbusFrame(address=0, message=BusActive(priority=0))
+    assert a.decoded
+
+    a.message = UnknownMessage(priority=0, data=b'\x01')
+    assert a.to_bytes() == b'\x0f\xf8\x00\x01\x01\xf7\x04'
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+import structattr
+
+__import__('velbus.VelbusMessage', fromlist=['*'])
+from velbus.VelbusMessage._registry import command_registry
+from velbus.VelbusMessage.ModuleInfo._registry import module_type_registry
+
+
+def compiled_classes():
+    classes = set()
+    for candidates in list(command_registry.values()) + list(module_type_registry.values()):
+        for cls in candidates:
+            if cls.__dict__.get('_codec') is not None:
+                classes.add(cls)
+    return sorted(classes, key=lambda c: c.__name__)
+
+
+def generic_decode(cls, data):
+    fields = structattr.deserialize(data, cls.bitstruct_info())
+    fields = {k[1:] if k.startswith('_') else k: v for k, v in fields.items()}
+    return cls(**fields)
+
+
+def generic_encode(obj):
+    structattr.validate(obj, True, obj.bitstruct_info())
+    return structattr.serialize(
+        [getattr(obj, a.name) for a in obj._data_attributes()],
+        obj.bitstruct_info())
+
+
+def test_compiled():
+    names = [c.__name__ for c in compiled_classes()]
+    assert 'BlindStatusV1' in names
+    assert 'TemperatureSensorStatus' in names
+    assert 'VMB4DC' in names
+
+
+@pytest.mark.parametrize('cls', compiled_classes(), ids=lambda c: c.__name__)
+def test_codec_matches_structattr(cls):
+    length = sum(a.type.bits() for a in cls._data_attributes()) // 8
+    rand = random.Random(length)
+    command = [cmd.value for cmd in cls.Command][0] if hasattr(cls, 'Command') else None
+
+    for _ in range(200):
+        data = bytearray(rand.getrandbits(8) for _ in range(length))
+        if command is not None:
+            data[0] = command
+
+        try:
+            expected = generic_decode(cls, bytes(data))
+        except ValueError:
+            with pytest.raises(ValueError):
+                cls.from_bytes(data=bytes(data))
+            continue
+
+        obj = cls.from_bytes(data=bytes(data))
+        assert obj == expected
+        assert obj.data() == generic_encode(expected) == bytes(data)
+        obj.validate()
+        assert obj == expected
+
+
+def test_decoded_is_validated():
+    from velbus.VelbusMessage.SwitchRelay import SwitchRelay
+
+    obj = SwitchRelay.from_bytes(data=b'\x02\x04')
+    assert obj._validated
+    constructed = SwitchRelay(channel=3)
+    assert not constructed._validated
+    constructed.validate()
+    assert constructed._validated
+
+    obj.channel = 9
+    assert not obj._validated
+    with pytest.raises(ValueError):
+        obj.data()
+
+
+def test_json_cache():
+    from velbus.VelbusMessage.SwitchRelay import SwitchRelay
+
+    obj = SwitchRelay.from_bytes(data=b'\x02\x04')
+    j = obj.to_json_able()
+    assert j['properties']['channel'] == 3
+    j['properties']['channel'] = 42  # must not poison the cache
+    assert obj.to_json_able()['properties']['channel'] == 3
+
+    obj.channel = 1
+    assert obj.to_json_able()['properties']['channel'] == 1
+
+
+def test_json_cache_nested():
+    from velbus.VelbusMessage.SwitchRelay import SwitchRelay
+
+    obj = SwitchRelay.from_bytes(data=b'\x02\x04')
+    j = obj.to_json_able()
+    j['properties']['command']['name'] = 'poisoned'  # nested Enum JSON
+    assert obj.to_json_able()['properties']['command']['name'] == 'SwitchRelayOn'
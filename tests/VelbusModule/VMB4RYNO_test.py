@@ -9,7 +9,8 @@ import asyncio
 import sanic.response
 
 from velbus import HttpApi
-from velbus.VelbusProtocol import VelbusHttpProtocol
+from velbus.VelbusBus import VelbusBus
+from velbus.VelbusProtocol import VelbusProtocol, VelbusHttpProtocol
 from velbus.VelbusMessage._types import Index, Bitmap
 from velbus.VelbusMessage.VelbusFrame import VelbusFrame
 from velbus.VelbusMessage.ModuleTypeRequest import ModuleTypeRequest
@@ -67,8 +68,9 @@ async def test_get_module(sanic_req):
                      response_type: type,
                      response_address: int = None,
                      timeout: int = 2,
-                     additional_check=(lambda vbm: True)):
-        del self, response_type, response_address, timeout, additional_check  # unused
+                     additional_check=(lambda vbm: True),
+                     coalesce: bool = False):
+        del self, response_type, response_address, timeout, additional_check, coalesce  # unused
         velbus_query.called += 1
         assert question == VelbusFrame(address=0x11, message=ModuleTypeRequest())
         return make_awaitable(
@@ -325,3 +327,10 @@ async def test_last_change(generate_sanic_request, mock_velbus, module_address,
         resp = await HttpApi.module_req(sanic_req, f"{module_address:02x}", f"/{channel}/last_change")
         assert resp.status == 200
         assert resp.body.decode('utf-8') == str(now)
+
+
+def test_module_bus():
+    other = VelbusBus('other')
+    mod = VMB4RYNO_mod(bus=VelbusProtocol(client_id="TEST", velbus=other), address=0x11, module_info=VMB4RYNO_mi())
+    assert mod.velbus is other
+    assert mod.submodules[1].velbus is other
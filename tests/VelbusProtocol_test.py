@@ -1,10 +1,20 @@
+import asyncio
+
 import pytest
 
-from velbus.VelbusProtocol import VelbusProtocol
+from velbus.VelbusProtocol import VelbusProtocol, VelbusSerialProtocol, VelbusTcpProtocol, VelbusUpstreamProtocol, \
+    VelbusHttpProtocol
+from velbus.VelbusBus import VelbusBus, default_bus
 from velbus.VelbusMessage.VelbusFrame import VelbusFrame
 from velbus.VelbusMessage.ModuleTypeRequest import ModuleTypeRequest
 from velbus.VelbusMessage.ModuleType import ModuleType
 from velbus.VelbusMessage.ModuleInfo.VMB4RYNO import VMB4RYNO
+from velbus.VelbusMessage.RxBufFull import RxBufFull
+from velbus.VelbusMessage.RxBufReady import RxBufReady
+from velbus.VelbusMessage.BusOff import BusOff
+from velbus.VelbusMessage.SwitchRelay import SwitchRelay
+from velbus.VelbusMessage.RelayStatus import RelayStatus
+from velbus.VelbusMessage._types import Index
 
 
 @pytest.mark.asyncio
@@ -60,3 +70,608 @@ async def test_no_reply(mock_velbus):
             ModuleType,
             timeout=0.01,
         )
+
+
+@pytest.mark.asyncio
+async def test_coalesced_timeout():
+    bus = VelbusBus('coalesce')
+    bus.query_scheduler.max_wait = 0.01
+    protocol = VelbusProtocol(client_id="INTERNAL", velbus=bus)
+    question = VelbusFrame(address=0x01, message=ModuleTypeRequest())
+
+    first = asyncio.ensure_future(protocol.velbus_query(question, ModuleType, timeout=10, coalesce=True))
+    await asyncio.sleep(0)
+    start = asyncio.get_event_loop().time()
+    with pytest.raises(TimeoutError):
+        # Shares the question of `first`, but keeps its own time limit
+        await protocol.velbus_query(question, ModuleType, timeout=0.05, coalesce=True)
+    assert asyncio.get_event_loop().time() - start < 1
+    assert bus.coalesced_queries == 1
+    assert not first.done()
+    for shared in list(bus.in_flight_queries.values()):
+        shared.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+class FakeTransport:
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_resync():
+    received = []
+
+    class RecordingProtocol(VelbusProtocol):
+        async def process_message(self, vbm):
+            received.append(vbm)
+
+    bus = RecordingProtocol(client_id="TEST")
+    bus.connection_made(FakeTransport())
+    bus.rx_buf.extend(b'\x00\x01\x02\x0f\x00' + b'\x0f\xf8\x00\x01\x0a\xee\x04')
+    await bus.try_decode()
+
+    assert len(received) == 1
+    assert received[0].to_bytes() == b'\x0f\xf8\x00\x01\x0a\xee\x04'
+    assert bus.rx_buf.discarded_bytes == 5
+    assert bus.rx_buf.resyncs == 2
+
+
+@pytest.mark.asyncio
+async def test_serial_tx_pacing():
+    written = []
+
+    class WritingTransport(FakeTransport):
+        def write(self, data):
+            written.append((asyncio.get_event_loop().time(), bytes(data)))
+
+    serial = VelbusSerialProtocol()
+    serial.connection_made(WritingTransport())
+    serial.tx_rate = serial.tx_max_rate = 1000
+    try:
+        bus = VelbusProtocol(client_id="TEST")
+        frame = VelbusFrame.from_bytes(b'\x0f\xf8\x00\x01\x0a\xee\x04')
+        await bus.relay_message(frame)
+        await bus.relay_message(frame)
+        # relay_message() does not wait for the serial port
+        assert len(written) == 1
+        assert serial.statistics()['queued'] == 1
+
+        await asyncio.sleep(0.02)
+        assert len(written) == 2
+        assert written[1][0] - written[0][0] >= 7 * 0.001
+        assert serial.statistics()['frames'] == 2
+        assert serial.statistics()['bytes'] == 14
+    finally:
+        serial.tx_handle = None
+        default_bus.serial_client = None
+
+
+@pytest.mark.asyncio
+async def test_serial_tx_high_water():
+    class Transport(FakeTransport):
+        paused = False
+
+        def write(self, data):
+            pass
+
+        def pause_reading(self):
+            self.paused = True
+
+        def resume_reading(self):
+            self.paused = False
+
+    serial = VelbusSerialProtocol()
+    serial.connection_made(Transport())
+    serial.tx_rate = serial.tx_max_rate = 100_000
+    tcp = VelbusTcpProtocol()
+    tcp_transport = Transport()
+    tcp_transport.get_extra_info = lambda _: ('127.0.0.1', 1234)
+    tcp.connection_made(tcp_transport)
+    try:
+        serial.tx_high_water = 4
+        serial.tx_low_water = 1
+        serial.tx_ready_at = asyncio.get_event_loop().time() + 0.01  # hold the queue
+        for _ in range(4):
+            serial.transmit(b'\x0f\xf8\x00\x01\x0a\xee\x04', tcp.client_id)
+        assert tcp_transport.paused
+        assert serial.statistics()['readers_paused']
+
+        await asyncio.sleep(0.05)
+        assert serial.statistics()['queued'] == 0
+        assert not tcp_transport.paused
+    finally:
+        if serial.tx_handle is not None:
+            serial.tx_handle.cancel()
+        default_bus.tcp_clients.discard(tcp)
+        default_bus.serial_client = None
+
+
+@pytest.mark.asyncio
+async def test_serial_tx_high_water_decoded():
+    """Decoding frames of a paused client does not resume it"""
+    class Transport(FakeTransport):
+        paused = False
+
+        def write(self, data):
+            pass
+
+        def pause_reading(self):
+            self.paused = True
+
+        def resume_reading(self):
+            self.paused = False
+
+    serial = VelbusSerialProtocol()
+    serial.connection_made(Transport())
+    serial.tx_rate = serial.tx_max_rate = 100_000
+    tcp = VelbusTcpProtocol()
+    tcp.raw_relay = False
+    tcp_transport = Transport()
+    tcp_transport.get_extra_info = lambda _: ('127.0.0.1', 1234)
+    tcp.connection_made(tcp_transport)
+    try:
+        serial.tx_ready_at = asyncio.get_event_loop().time() + 0.01  # hold the queue
+        tcp.data_received(b'\x0f\xf8\x00\x01\x0a\xee\x04' * 100)
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert serial.statistics()['queued'] == 100
+        assert serial.statistics()['readers_paused']
+        assert tcp_transport.paused
+
+        for _ in range(100):
+            if serial.statistics()['queued'] == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert not serial.statistics()['readers_paused']
+        assert not tcp_transport.paused
+    finally:
+        if serial.tx_handle is not None:
+            serial.tx_handle.cancel()
+        default_bus.tcp_clients.discard(tcp)
+        default_bus.serial_client = None
+
+
+@pytest.mark.asyncio
+async def test_serial_tx_fair_source():
+    class Request:
+        ip = '192.0.2.1'
+        port = 1234
+
+        def __init__(self, path):
+            self.path = path
+
+    queued = []
+
+    class RecordingSerial(VelbusSerialProtocol):
+        def transmit(self, data, source=None):
+            queued.append(source)
+
+    serial = RecordingSerial()
+    serial.connection_made(FakeTransport())
+    try:
+        frame = b'\x0f\xf8\x00\x01\x0a\xee\x04'
+        for path in ('/module/01/type', '/module/02/type'):
+            VelbusHttpProtocol(Request(path)).relay_raw(frame)
+        VelbusProtocol(client_id="INTERNAL").relay_raw(frame)
+        # Every HTTP request has its own client_id, but they share a turn
+        assert queued == ["HTTP", "HTTP", "INTERNAL"]
+    finally:
+        default_bus.serial_client = None
+
+
+@pytest.mark.asyncio
+async def test_query_timeout_excludes_queue_time():
+    bus = VelbusBus('queued')
+    loop = asyncio.get_event_loop()
+    reply = VelbusFrame(address=0x01, message=ModuleType(module_info=VMB4RYNO()))
+
+    class AnsweringTransport(FakeTransport):
+        def write(self, data):
+            loop.call_later(0.01, lambda: asyncio.ensure_future(serial.process_message(reply)))
+
+    serial = VelbusSerialProtocol(velbus=bus)
+    serial.connection_made(AnsweringTransport())
+    try:
+        serial.tx_ready_at = loop.time() + 0.2  # the question waits in the queue
+        protocol = VelbusProtocol(client_id="INTERNAL", velbus=bus)
+        await protocol.velbus_query(VelbusFrame(address=0x01, message=ModuleTypeRequest()),
+                                    ModuleType, timeout=0.1)
+        assert bus.query_scheduler.rtt[0x01].srtt < 0.1
+        assert not serial.sent_waiters
+    finally:
+        if serial.tx_handle is not None:
+            serial.tx_handle.cancel()
+
+
+@pytest.mark.asyncio
+async def test_query_max_wait_total():
+    """Waiting for a turn and for the transmit queue share `max_wait`"""
+    bus = VelbusBus('waiting')
+    bus.query_scheduler.max_per_address = 1
+    bus.query_scheduler.max_wait = 0.1
+    loop = asyncio.get_event_loop()
+
+    serial = VelbusSerialProtocol(velbus=bus)
+    serial.connection_made(FakeTransport())
+    try:
+        serial.tx_ready_at = loop.time() + 10  # the question never leaves the queue
+        await bus.query_scheduler.acquire(0x01)
+        loop.call_later(0.08, bus.query_scheduler.release, 0x01)
+        protocol = VelbusProtocol(client_id="INTERNAL", velbus=bus)
+        start = loop.time()
+        with pytest.raises(TimeoutError):
+            await protocol.velbus_query(VelbusFrame(address=0x01, message=ModuleTypeRequest()),
+                                        ModuleType, timeout=0.01)
+        assert loop.time() - start < 0.15
+    finally:
+        if serial.tx_handle is not None:
+            serial.tx_handle.cancel()
+
+
+@pytest.mark.asyncio
+async def test_serial_tx_backoff():
+    written = []
+
+    class WritingTransport(FakeTransport):
+        def write(self, data):
+            written.append(bytes(data))
+
+    serial = VelbusSerialProtocol()
+    serial.connection_made(WritingTransport())
+    try:
+        rate = serial.tx_rate
+        serial.transmit(b'\x0f\xf8\x00\x01\x0a\xee\x04')
+        assert serial.tx_rate > rate  # additive increase
+        rate = serial.tx_rate
+
+        await serial.process_message(VelbusFrame(address=0, message=RxBufFull()))
+        assert serial.paused
+        assert serial.tx_rate == rate * serial.tx_rate_decrease
+        assert serial.tx_overflow_rate == rate
+
+        serial.tx_ready_at = 0
+        serial.transmit(b'\x0f\xf8\x00\x01\x0a\xee\x04')
+        assert len(written) == 1  # held back while paused
+
+        await serial.process_message(VelbusFrame(address=0, message=RxBufReady()))
+        assert not serial.paused
+        assert len(written) == 2
+        assert serial.statistics()['overflows'] == 1
+    finally:
+        serial.tx_handle = None
+        default_bus.serial_client = None
+
+
+class SlowTransport(FakeTransport):
+    def __init__(self):
+        self.written = []
+        self.aborted = False
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def abort(self):
+        self.aborted = True
+
+
+def prio_frame(prio: int, tag: int) -> bytes:
+    return bytes([0x0f, 0xf8 | prio, tag, 0x00, 0x00, 0x04])
+
+
+@pytest.mark.parametrize('policy, expected', [
+    ('drop-oldest', [2, 3, 4]),
+    ('drop-lowest-priority', [0, 2, 4]),
+])
+def test_tcp_output_queue(policy, expected):
+    client = VelbusTcpProtocol()
+    client.transport = SlowTransport()
+    client.output_queue_size = 3
+    client.output_policy = policy
+
+    client.pause_writing()
+    for tag, prio in enumerate([0, 3, 0, 3, 0]):
+        client.send(prio_frame(prio, tag))
+    assert client.transport.written == []
+
+    client.resume_writing()
+    assert [f[2] for f in client.transport.written] == expected
+    assert client.statistics() == {'queued': 0, 'total_queued': 5, 'dropped': 2, 'sent': 3, 'relayed': 0, 'filtered': 0}
+
+
+@pytest.mark.asyncio
+async def test_tcp_backpressure_disconnect():
+    client = VelbusTcpProtocol()
+    client.transport = SlowTransport()
+    client.output_policy = 'disconnect'
+    client.backpressure_timeout = 0.01
+
+    client.pause_writing()
+    await asyncio.sleep(0.02)
+    assert client.transport.aborted
+
+
+@pytest.mark.asyncio
+async def test_pending_query_index(mock_velbus):
+    bus = VelbusProtocol(client_id="INTERNAL")
+    query = asyncio.ensure_future(bus.velbus_query(None, ModuleType, response_address=0x12, timeout=1))
+    await asyncio.sleep(0)
+    assert list(default_bus.pending_queries[0x12].keys()) == [ModuleType]
+
+    other = VelbusFrame.from_bytes(VelbusFrame(address=0x13, message=ModuleType(module_info=VMB4RYNO())).to_bytes())
+    bus.match_pending_queries(other)
+    assert not other.decoded  # no query for this address: not even decoded
+
+    reply = VelbusFrame(address=0x12, message=ModuleType(module_info=VMB4RYNO()))
+    bus.match_pending_queries(reply)
+    assert await query is reply
+    assert default_bus.pending_queries == {}
+
+
+@pytest.mark.asyncio
+async def test_coalesce(mock_velbus, module_address):
+    question = VelbusFrame(
+        address=module_address,
+        message=ModuleTypeRequest(),
+    )
+    mock_velbus.set_expected_conversation([
+        (
+            question.to_bytes(),
+            VelbusFrame(
+                address=module_address,
+                message=ModuleType(
+                    module_info=VMB4RYNO(),
+                ),
+            ).to_bytes()
+        )
+    ])
+    bus = VelbusProtocol(client_id="INTERNAL")
+    coalesced = default_bus.coalesced_queries
+    replies = await asyncio.gather(*[
+        bus.velbus_query(question, ModuleType, additional_check=(lambda vbm: vbm.address == module_address),
+                         coalesce=True)
+        for _ in range(3)
+    ])
+    assert replies[0] is replies[1] is replies[2]
+    assert default_bus.coalesced_queries == coalesced + 2
+    mock_velbus.assert_conversation_happened_exactly()
+    assert default_bus.in_flight_queries == {}
+
+
+@pytest.mark.asyncio
+async def test_no_coalesce_commands(mock_velbus, module_address):
+    question = VelbusFrame(
+        address=module_address,
+        message=SwitchRelay(
+            command=SwitchRelay.Command.SwitchRelayOn,
+            channel=Index(8)(1),
+        ),
+    )
+    switch = (
+        question.to_bytes(),
+        VelbusFrame(
+            address=module_address,
+            message=RelayStatus(
+                channel=1,
+                relay_status=RelayStatus.RelayStatus.On,
+            ),
+        ).to_bytes()
+    )
+    mock_velbus.set_expected_conversation([switch, switch])
+    bus = VelbusProtocol(client_id="INTERNAL")
+    coalesced = default_bus.coalesced_queries
+    await asyncio.gather(*[
+        bus.velbus_query(question, RelayStatus, additional_check=(lambda vbm: vbm.message.channel == 1))
+        for _ in range(2)
+    ])
+    assert default_bus.coalesced_queries == coalesced
+    await asyncio.sleep(0.05)  # allow time to process the queue
+    mock_velbus.assert_conversation_happened_exactly()
+
+
+@pytest.mark.asyncio
+async def test_separate_buses():
+    class WritingTransport(FakeTransport):
+        def __init__(self):
+            self.written = []
+
+        def write(self, data):
+            self.written.append(bytes(data))
+
+    other_bus = VelbusBus('other')
+    serial = VelbusSerialProtocol(velbus=other_bus)
+    serial.connection_made(WritingTransport())
+    assert other_bus.serial_client is serial
+    assert default_bus.serial_client is not serial
+
+    received = []
+    other_bus.listeners.add(received.append)
+
+    frame = VelbusFrame.from_bytes(b'\x0f\xf8\x00\x01\x0a\xee\x04')
+    await VelbusProtocol(client_id="TEST", velbus=other_bus).relay_message(frame)
+    assert serial.transport.written == [frame.to_bytes()]
+    assert received == [frame]
+    serial.tx_handle = None
+
+
+@pytest.mark.asyncio
+async def test_upstream():
+    class WritingTransport(FakeTransport):
+        def __init__(self):
+            self.written = []
+
+        def get_extra_info(self, name):
+            return ('127.0.0.1', 8445)
+
+        def write(self, data):
+            self.written.append(bytes(data))
+
+    other_bus = VelbusBus('other')
+    upstream = VelbusUpstreamProtocol(velbus=other_bus)
+    upstream.connection_made(WritingTransport())
+    assert other_bus.serial_client is upstream
+
+    received = []
+    other_bus.listeners.add(received.append)
+
+    # Frames to send are forwarded right away, the upstream paces them
+    frame = VelbusFrame.from_bytes(b'\x0f\xf8\x00\x01\x0a\xee\x04')
+    await VelbusProtocol(client_id="TEST", velbus=other_bus).relay_message(frame)
+    frame2 = VelbusFrame.from_bytes(b'\x0f\xfb\x01\x01\x0a\xea\x04')
+    await VelbusProtocol(client_id="TEST", velbus=other_bus).relay_message(frame2)
+    assert upstream.transport.written == [frame.to_bytes(), frame2.to_bytes()]
+    assert upstream.statistics()['frames'] == 2
+
+    # Frames from upstream are not sent back
+    upstream.data_received(frame.to_bytes())
+    await asyncio.sleep(0)
+    assert len(upstream.transport.written) == 2
+    assert len(received) == 3
+
+
+@pytest.mark.asyncio
+async def test_upstream_flow_control():
+    class PausingTransport(FakeTransport):
+        def __init__(self):
+            self.reading = True
+
+        def get_extra_info(self, name):
+            return ('127.0.0.1', 8445)
+
+        def pause_reading(self):
+            self.reading = False
+
+        def resume_reading(self):
+            self.reading = True
+
+        def write(self, data):
+            pass
+
+    other_bus = VelbusBus('other')
+    upstream = VelbusUpstreamProtocol(velbus=other_bus)
+    upstream.connection_made(PausingTransport())
+    client = VelbusTcpProtocol(velbus=other_bus)
+    client.connection_made(PausingTransport())
+    try:
+        # Congested connection to the upstream
+        upstream.pause_writing()
+        assert not client.transport.reading
+        upstream.resume_writing()
+        assert client.transport.reading
+
+        # The upstream's interface is full: relayed to our clients as well
+        await upstream.process_message(VelbusFrame(address=0, message=RxBufFull()))
+        assert not client.transport.reading
+        assert upstream.statistics()['overflows'] == 1
+        assert client.sent_frames == 1
+        await upstream.process_message(VelbusFrame(address=0, message=RxBufReady()))
+        assert client.transport.reading
+
+        # Resume anyway if RxBufReady gets lost
+        upstream.tx_pause_timeout = 0.01
+        await upstream.process_message(VelbusFrame(address=0, message=RxBufFull()))
+        assert not client.transport.reading
+        await asyncio.sleep(0.05)
+        assert client.transport.reading
+    finally:
+        upstream.connection_lost(None)
+        client.connection_lost(None)
+
+
+@pytest.mark.asyncio
+async def test_bus_off_closes_bus():
+    class ClosingTransport(FakeTransport):
+        def write(self, data):
+            pass
+
+        def close(self):
+            serial.connection_lost(None)
+
+    other_bus = VelbusBus('other')
+    closed = []
+    other_bus.close_callbacks.append(closed.append)
+    serial = VelbusSerialProtocol(velbus=other_bus)
+    serial.connection_made(ClosingTransport())
+
+    await serial.process_message(VelbusFrame(address=0, message=BusOff()))
+    assert closed == [other_bus]
+    assert other_bus.closed
+    assert other_bus.serial_client is None
+    assert not default_bus.closed
+    assert asyncio.get_event_loop().is_running()
+
+    other_bus.close("again")
+    assert closed == [other_bus]
+
+
+@pytest.mark.asyncio
+async def test_tcp_raw_relay():
+    class PeerTransport(SlowTransport):
+        def get_extra_info(self, name):
+            return ('127.0.0.1', 1234)
+
+    other_bus = VelbusBus('other')
+    serial = VelbusUpstreamProtocol(velbus=other_bus)  # transmits without pacing
+    serial.connection_made(PeerTransport())
+    sender = VelbusTcpProtocol(velbus=other_bus)
+    sender.connection_made(PeerTransport())
+    receiver = VelbusTcpProtocol(velbus=other_bus)
+    receiver.connection_made(PeerTransport())
+
+    received = []
+    other_bus.listeners.add(received.append)
+
+    frame = b'\x0f\xf8\x00\x01\x0a\xee\x04'
+    sender.data_received(b'\x00' + frame + frame[0:3])
+    # Relayed right away, before decoding
+    assert serial.transport.written == [frame]
+    assert receiver.transport.written == [frame]
+    assert sender.transport.written == []
+    assert received == []
+
+    sender.data_received(frame[3:])
+    assert receiver.transport.written == [frame, frame]
+
+    await asyncio.sleep(0)
+    assert [vbm.to_bytes() for vbm in received] == [frame, frame]
+    assert sender.statistics()['relayed'] == 2
+
+
+@pytest.mark.asyncio
+async def test_tcp_filter():
+    class PeerTransport(SlowTransport):
+        def get_extra_info(self, name):
+            return ('127.0.0.1', 1234)
+
+    other_bus = VelbusBus('other')
+    serial = VelbusUpstreamProtocol(velbus=other_bus)
+    serial.connection_made(PeerTransport())
+    sender = VelbusTcpProtocol(velbus=other_bus)
+    sender.connection_made(PeerTransport())
+    receiver = VelbusTcpProtocol(velbus=other_bus)
+    receiver.connection_made(PeerTransport())
+
+    wanted = b'\x0f\xf8\x00\x01\x0a\xee\x04'
+    other = b'\x0f\xfb\x01\x01\x0a\xea\x04'
+    receiver.data_received(b'FIL')
+    receiver.data_received(b'TER address=00\n' + wanted)
+    assert receiver.frame_filter is not None
+    assert serial.transport.written == [wanted]  # the line itself is not relayed
+
+    sender.data_received(wanted + other)
+    assert receiver.transport.written == [wanted]
+    assert serial.transport.written == [wanted, wanted, other]
+    assert receiver.statistics()['filtered'] == 1
+
+    receiver.data_received(b'FILTER bogus\n')  # ignored
+    sender.data_received(other)
+    assert receiver.transport.written == [wanted]
+
+    receiver.data_received(b'FILTER\n')
+    sender.data_received(other)
+    assert receiver.transport.written == [wanted, other]
+    await asyncio.sleep(0)
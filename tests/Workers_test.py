@@ -0,0 +1,146 @@
+import asyncio
+import contextlib
+import json
+import sys
+
+import pytest
+import sanic.response
+
+from velbus import HttpApi
+from velbus.CachedException import CachedTimeoutError
+from velbus.JsonPatchDict import JsonPatchDict, JsonPatch, JsonPatchOperation
+from velbus.VelbusBus import VelbusBus, buses
+from velbus.Workers import WorkerServer, WorkerLink, WorkerPool, ForwardedRequest, RemoteModule
+
+
+class FakeModule:
+    def __init__(self):
+        self.state = JsonPatchDict()
+        self.state_callback = self.state.callback
+
+    def dispatch(self, path_info, request, bus):
+        return sanic.response.json({'path': path_info, 'body': request.json}, status=201)
+
+
+def done(result=None, exception=None) -> asyncio.Future:
+    f = asyncio.get_event_loop().create_future()
+    if exception is not None:
+        f.set_exception(exception)
+    else:
+        f.set_result(result)
+    return f
+
+
+@contextlib.asynccontextmanager
+async def worker_setup(tmp_path):
+    velbus = VelbusBus('workers')
+    buses[velbus.name] = velbus
+    mod = FakeModule()
+    mod.state['relay'] = True
+    velbus.modules[0x11] = done(mod)
+    mod.state_callback.add(HttpApi.gen_update_state_cb(0x11, velbus))
+
+    server = WorkerServer()
+    await server.start(str(tmp_path / 'workers.sock'))
+    link = WorkerLink()
+    await asyncio.get_event_loop().create_unix_connection(lambda: link, str(tmp_path / 'workers.sock'))
+    await link.buses
+
+    try:
+        yield velbus, mod, link
+    finally:
+        link.transport.close()
+        await server.close()
+        del buses[velbus.name]
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_state_mirror(tmp_path):
+    async with worker_setup(tmp_path) as (velbus, mod, link):
+        assert velbus.name in await link.buses
+        await settle()
+        assert link.state[velbus.name] == {'11': {'relay': True}}
+
+        mod.state['relay'] = False
+        mod.state['led']['on'] = 1
+        await settle()
+        assert link.state[velbus.name] == {'11': {'relay': False, 'led': {'on': 1}}}
+
+        await HttpApi.forget_module(velbus, 0x11)
+        await settle()
+        assert link.state[velbus.name] == {}
+
+
+@pytest.mark.asyncio
+async def test_forward(tmp_path):
+    async with worker_setup(tmp_path) as (velbus, mod, link):
+        remote = await link.get_module(velbus, 0x11)
+        assert isinstance(remote, RemoteModule)
+        await settle()
+        assert remote.state == {'relay': True}
+
+        request = ForwardedRequest(method='PUT', path='/module/11/1/relay', headers={},
+                                   body=b'true', ip='127.0.0.1', port=1234)
+        response = await remote.dispatch('/1/relay', request, None)
+        assert response.status == 201
+        assert json.loads(response.body) == {'path': '/1/relay', 'body': True}
+
+        request.body = b'not json'
+        response = await remote.dispatch('/1/relay', request, None)
+        assert response.status == 400
+
+
+@pytest.mark.asyncio
+async def test_forward_statistics(tmp_path):
+    async with worker_setup(tmp_path) as (velbus, mod, link):
+        worker_bus = VelbusBus(velbus.name)  # the worker's copy of the bus
+        worker_bus.owner = link
+        request = ForwardedRequest(method='GET', path='/statistics', headers={},
+                                   body=b'', ip='127.0.0.1', port=1234)
+        requests = link.next_id
+        response = await HttpApi.statistics(request, velbus=worker_bus)
+        assert link.next_id == requests + 1  # answered by the main process
+        assert response.status == 200
+        assert velbus.name in json.loads(response.body)['buses']
+
+
+@pytest.mark.asyncio
+async def test_forward_timeout(tmp_path):
+    async with worker_setup(tmp_path) as (velbus, mod, link):
+        timeout = CachedTimeoutError()
+        velbus.modules[0x12] = done(exception=timeout)
+
+        with pytest.raises(CachedTimeoutError) as e:
+            await link.get_module(velbus, 0x12)
+        assert e.value.timestamp == timeout.timestamp
+
+
+@pytest.mark.asyncio
+async def test_pool_restarts():
+    pool = WorkerPool([sys.executable, '-c', 'pass'], 2)
+    pool.restart_delay = 0.01
+    pool.start()
+    for _ in range(500):
+        if pool.restarts >= 4:
+            break
+        await asyncio.sleep(0.01)
+    await pool.stop()
+    assert pool.restarts >= 4
+    assert pool.processes == {}
+
+
+@pytest.mark.asyncio
+async def test_pool_stop():
+    pool = WorkerPool([sys.executable, '-c', 'import time; time.sleep(60)'], 2)
+    pool.start()
+    for _ in range(500):
+        if len(pool.processes) == 2:
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.wait_for(pool.stop(), 5)
+    assert pool.restarts == 0
@@ -14,6 +14,8 @@ import sanic.request
 
 from velbus import HttpApi
 from velbus.VelbusProtocol import VelbusProtocol, VelbusSerialProtocol
+from velbus.QueryScheduler import QueryScheduler
+from velbus.VelbusBus import default_bus
 from velbus.VelbusMessage.VelbusFrame import VelbusFrame
 
 
@@ -180,20 +182,24 @@ def mock_velbus(request):
         def assert_conversation_happened_exactly(self) -> None:
             assert self.did_conversation_happened_exactly()
 
-    VelbusProtocol.serial_client = FakeSerialProtocol()
-    VelbusProtocol.serial_client.connection_made(FakeTransport(VelbusProtocol.serial_client))
-    VelbusProtocol.serial_client.client_id = "FAKE_SERIAL"
+    serial_client = FakeSerialProtocol()
+    serial_client.connection_made(FakeTransport(serial_client))  # registers with default_bus
+    serial_client.client_id = "FAKE_SERIAL"
 
     HttpApi.modules.clear()
     HttpApi.ws_clients.clear()
-    VelbusProtocol.listeners = {HttpApi.message}
+    default_bus.listeners = {HttpApi.message}
+    # Queries left behind by previous tests belong to a closed event loop
+    default_bus.pending_queries.clear()
+    default_bus.in_flight_queries.clear()
+    default_bus.query_scheduler = QueryScheduler()
 
-    yield VelbusProtocol.serial_client
+    yield serial_client
 
-    VelbusProtocol.serial_client = None
+    default_bus.serial_client = None
     HttpApi.modules.clear()
     HttpApi.ws_clients.clear()
-    VelbusProtocol.listeners.clear()
+    default_bus.listeners.clear()
 
 
 @pytest.fixture(params=[0, 1])  # test with at least 2 values
@@ -0,0 +1,132 @@
+import asyncio
+import random
+
+import pytest
+
+from velbus.simulator.SimulatedBus import SimulatedBus
+from velbus.simulator.SimulatedModule import SimulatedVMB4RYNO, SimulatedVMB2BLE, SimulatedVMB6IN
+from velbus.VelbusMessage.VelbusFrame import VelbusFrame
+from velbus.VelbusMessage.InterfaceStatusRequest import InterfaceStatusRequest
+from velbus.VelbusMessage.BusActive import BusActive
+from velbus.VelbusMessage.ModuleTypeRequest import ModuleTypeRequest
+from velbus.VelbusMessage.ModuleType import ModuleType
+from velbus.VelbusMessage.ModuleStatusRequest import ModuleStatusRequest
+from velbus.VelbusMessage.SwitchRelay import SwitchRelay
+from velbus.VelbusMessage.RelayStatus import RelayStatus
+from velbus.VelbusMessage.SetBlindPosition import SetBlindPosition
+from velbus.VelbusMessage.BlindStatus import BlindStatusV2
+from velbus.VelbusMessage.PushButtonStatus import PushButtonStatus
+from velbus.VelbusMessage.RxBufFull import RxBufFull
+from velbus.VelbusMessage.RxBufReady import RxBufReady
+from velbus.VelbusMessage.ModuleInfo.VMB4RYNO import VMB4RYNO
+
+
+class RecordingTransport:
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(VelbusFrame.from_bytes(bytes(data), {0x01: VMB4RYNO}))
+
+    def messages(self):
+        return [f.message for f in self.written]
+
+
+@pytest.fixture
+def bus():
+    bus = SimulatedBus(response_delay=(0.001, 0.001), rand=random.Random(0))
+    bus.add(SimulatedVMB4RYNO(0x01))
+    bus.add(SimulatedVMB2BLE(0x02))
+    bus.add(SimulatedVMB6IN(0x03))
+    bus.connection_made(RecordingTransport())
+    yield bus
+    bus.stop()
+
+
+def to_bus(bus: SimulatedBus, address: int, message) -> None:
+    bus.data_received(VelbusFrame(address=address, message=message).to_bytes())
+
+
+@pytest.mark.asyncio
+async def test_interface_status(bus):
+    to_bus(bus, 0x00, InterfaceStatusRequest())
+    assert bus.transport.messages() == [BusActive()]
+
+
+@pytest.mark.asyncio
+async def test_module_type_and_relay(bus):
+    to_bus(bus, 0x01, ModuleTypeRequest())
+    to_bus(bus, 0x01, SwitchRelay(command=SwitchRelay.Command.SwitchRelayOn, channel=2))
+    to_bus(bus, 0x42, ModuleTypeRequest())  # nobody there
+    await asyncio.sleep(0.1)
+
+    messages = bus.transport.messages()
+    assert isinstance(messages[0], ModuleType)
+    assert messages[0].module_info == bus.modules[0x01].module_info
+    assert messages[1] == RelayStatus(channel=2, relay_status=RelayStatus.RelayStatus.On)
+
+    to_bus(bus, 0x01, ModuleStatusRequest(channel=0b00011))
+    await asyncio.sleep(0.1)
+    assert [(m.channel, m.relay_status) for m in bus.transport.messages()[2:]] == [
+        (1, RelayStatus.RelayStatus.Off),
+        (2, RelayStatus.RelayStatus.On),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_blind_position(bus):
+    bus.modules[0x02].blinds[1].travel_time = 0.1
+    to_bus(bus, 0x02, SetBlindPosition(channel=1, position=50))
+    await asyncio.sleep(0.2)
+    moving, stopped = bus.transport.messages()
+    assert moving.blind_status == BlindStatusV2.BlindStatus.Down
+    assert stopped.blind_status == BlindStatusV2.BlindStatus.Off
+    assert stopped.blind_position == 50
+
+
+@pytest.mark.asyncio
+async def test_spontaneous(bus):
+    bus.modules[0x03].press_duration = 0.01
+    bus.modules[0x03].press(4)
+    await asyncio.sleep(0.1)
+    pressed, released = bus.transport.messages()
+    assert pressed == PushButtonStatus(just_pressed=0b1000)
+    assert released == PushButtonStatus(just_released=0b1000)
+
+
+@pytest.mark.asyncio
+async def test_baudrate(bus):
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    for channel in range(1, 6):
+        to_bus(bus, 0x01, SwitchRelay(command=SwitchRelay.Command.SwitchRelayOn, channel=channel))
+    while len(bus.transport.written) < 5:
+        await asyncio.sleep(0.005)
+    # 5 questions (8 bytes) + 5 answers (14 bytes), at 960 bytes/s
+    assert loop.time() - start >= 5 * (8 + 14) / 960 * 0.9
+    assert bus.statistics()['bytes_on_bus'] == 5 * (8 + 14)
+
+
+@pytest.mark.asyncio
+async def test_rx_buffer_full(bus):
+    bus.rx_buffer_size = 2
+    for channel in range(1, 6):
+        to_bus(bus, 0x01, SwitchRelay(command=SwitchRelay.Command.SwitchRelayOn, channel=channel))
+    assert bus.transport.messages() == [RxBufFull()]
+    assert bus.statistics()['dropped_frames'] == 2
+
+    await asyncio.sleep(0.1)
+    messages = bus.transport.messages()
+    assert RxBufReady() in messages
+    assert sum(isinstance(m, RelayStatus) for m in messages) == 3
+
+
+@pytest.mark.asyncio
+async def test_rx_buf_full_injection(bus):
+    bus.rx_buf_full_probability = 1.
+    to_bus(bus, 0x01, SwitchRelay(command=SwitchRelay.Command.SwitchRelayOn, channel=1))
+    await asyncio.sleep(0.15)
+    messages = bus.transport.messages()
+    assert messages[0] == RxBufFull()
+    assert RxBufReady() in messages
+    assert any(isinstance(m, RelayStatus) for m in messages)  # not dropped